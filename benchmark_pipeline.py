@@ -0,0 +1,243 @@
+import contextlib
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import sys
+import time
+from datetime import datetime, timezone
+import pyarrow.parquet as pq
+
+try:
+    import resource
+except ImportError:  # Windows: peak memory is not reported
+    resource = None
+
+# Reproducible benchmarks of every pipeline step, on a synthetic corpus (synthetic_corpus.py) and a fake
+# Telegram client (fake_telegram_client.py).
+#
+# Every stage runs in a fresh process, so its peak resident memory (peak RSS) is its own and not the highest of
+# the stages that ran before it. Each result records the time of the stage, its throughput (rows per second)
+# and its peak RSS; results are saved as JSON and can be compared with the results of a previous run
+# (compare_results) to catch regressions before they reach production.
+
+BENCHMARK_STAGES = ['scrape', 'combine', 'combine_streaming', 'summary', 'keywords', 'sample', 'links', 'near_duplicates']
+
+BENCHMARK_KEYWORDS = ['Trump', 'fraude', 'eleição']
+
+def peak_rss_mb():
+
+    # Peak resident memory of the current process, in MB (None where the resource module does not exist).
+
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024  # Bytes on macOS, KB on Linux
+
+def stage_scrape(work_folder, corpus_folder, scrape_posts=5000, latency=0.01, flood_rate=300):
+
+    # Scrape synthetic channels from the fake client into Parquet parts. The fake client adds network latency and
+    # answers with flood waits above 'flood_rate' requests per second, so the rate limiter has to adapt.
+
+    import asyncio
+    from fake_telegram_client import FakeTelegramClient
+    from parquet_stream_writer import StreamingParquetWriter
+    from rate_limiter import AdaptiveRateLimiter
+    from telegram_scraper import MESSAGE_SCHEMA, scrape_channels
+
+    channels = {f'@fake_channel_{index:03}': scrape_posts // 20 for index in range(20)}
+    client = FakeTelegramClient(channels, comments_per_post=1, latency=latency, flood_rate=flood_rate, flood_seconds=0, seed=0)
+    date_max = client.date_max
+    date_min = date_max - (scrape_posts // 20) * client.post_interval
+    writer = StreamingParquetWriter(os.path.join(work_folder, 'scrape_parts'), 'benchmark', schema=MESSAGE_SCHEMA)
+    limiter = AdaptiveRateLimiter(rate=100, burst=50, max_rate=1000, increase=1, backoff=0.01)
+    asyncio.run(scrape_channels(client, list(channels), date_min, date_max, concurrency=10, writer=writer,
+                                rate_limiter=limiter, max_comment_requests=20))
+    return writer.rows_written
+
+def stage_combine(work_folder, corpus_folder):
+    from combine_scraped_parquet_files import combine_parquet_files
+    output_path = os.path.join(work_folder, 'unified_in_memory.parquet')
+    combine_parquet_files(corpus_folder, ['Group', 'Message ID'], output_path)
+    return pq.ParquetFile(output_path).metadata.num_rows
+
+def stage_combine_streaming(work_folder, corpus_folder):
+    from combine_scraped_parquet_files import combine_parquet_files_streaming
+    output_path = os.path.join(work_folder, 'unified_data_telegram.parquet')
+    combine_parquet_files_streaming(corpus_folder, ['Group', 'Message ID'], output_path, temp_folder=work_folder)
+    return pq.ParquetFile(output_path).metadata.num_rows
+
+def unified_file(work_folder):
+
+    # The combined file read by the analysis stages (written by the 'combine_streaming' stage).
+
+    return os.path.join(work_folder, 'unified_data_telegram.parquet')
+
+def stage_summary(work_folder, corpus_folder):
+    from generate_groups_month_summary import create_group_month_summary
+    store_path = os.path.join(work_folder, 'summary_rollup.parquet')
+    for path in [store_path, f'{store_path}.json']:
+        if os.path.exists(path):
+            os.remove(path)
+    create_group_month_summary(work_folder, 'unified_data_telegram.parquet', 'summary', 'Date', 'Group', 'Comments')
+    return pq.ParquetFile(unified_file(work_folder)).metadata.num_rows
+
+def stage_keywords(work_folder, corpus_folder):
+    from scrape_and_filter_by_keywords_from_parquet_to_excel import filter_and_save_by_keywords
+    filter_and_save_by_keywords(work_folder, 'unified_data_telegram.parquet', 'filtered_keywords', 'Content',
+                                BENCHMARK_KEYWORDS, max_rows_per_file=1000000)
+    return pq.ParquetFile(unified_file(work_folder)).metadata.num_rows
+
+def stage_sample(work_folder, corpus_folder):
+    from sample_data_from_parquet_to_excel import create_sampled_file
+    create_sampled_file(work_folder, 'unified_data_telegram.parquet', 'Content', 'Group', 10000, 'sampled_data.xlsx', 20, seed=42)
+    return pq.ParquetFile(unified_file(work_folder)).metadata.num_rows
+
+def stage_links(work_folder, corpus_folder):
+    from snowballing_scrape_telegram_links_from_data import process_file_for_telegram_links
+    process_file_for_telegram_links(work_folder, 'unified_data_telegram.parquet', 'telegram_links.xlsx',
+                                    edges_filename='link_graph.parquet', include_comments=True)
+    return pq.ParquetFile(unified_file(work_folder)).metadata.num_rows
+
+def stage_near_duplicates(work_folder, corpus_folder):
+    from near_duplicates import add_near_duplicate_columns
+    add_near_duplicate_columns(unified_file(work_folder), os.path.join(work_folder, 'unified_data_telegram_clusters.parquet'))
+    return pq.ParquetFile(unified_file(work_folder)).metadata.num_rows
+
+def run_stage(stage, work_folder, corpus_folder, stage_kwargs, quiet, results, profile_folder=None, trace_memory=False):
+
+    # Worker process of one stage: runs it and sends back its time, rows and peak RSS.
+    # With a profile_folder, the stage runs under profile_run and its statistics are saved as '{stage}.prof'.
+
+    from pipeline_metrics import profile_run
+
+    rss_before = peak_rss_mb()
+    profiler = profile_run(os.path.join(profile_folder, f'{stage}.prof'), trace_memory) if profile_folder else contextlib.nullcontext()
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull if quiet else sys.stdout), \
+            contextlib.redirect_stderr(devnull if quiet else sys.stderr):
+        start_time = time.perf_counter()
+        with profiler:
+            rows = globals()[f'stage_{stage}'](work_folder, corpus_folder, **stage_kwargs)
+        seconds = time.perf_counter() - start_time
+    results.put({'rows': rows, 'seconds': seconds, 'rss_before_mb': rss_before, 'peak_rss_mb': peak_rss_mb()})
+
+def run_benchmarks(scale='10k', stages=None, corpus_folder=None, work_folder=None, seed=0, quiet=True,
+                   results_path=None, baseline_path=None, tolerance=0.25, scrape_posts=5000, profile_folder=None,
+                   trace_memory=False):
+
+    # Generate (or reuse) a synthetic corpus and time every pipeline stage on it.
+
+    # Parameters:
+    # scale (str or int): Corpus size: '10k', '1m', '10m' (see synthetic_corpus.CORPUS_SCALES) or a number of rows.
+    # stages (list of str): Stages to run, in order (default: BENCHMARK_STAGES; 'combine' loads everything in
+    #                       memory and is skipped by default above 1M rows). The analysis stages read the file
+    #                       written by 'combine_streaming'.
+    # corpus_folder (str): Folder of the corpus (default: 'benchmark_corpus_{scale}'); generated if it has no files.
+    # work_folder (str): Folder of the outputs of the stages (default: 'benchmark_work_{scale}'); emptied first.
+    # seed (int): Seed of the corpus.
+    # quiet (bool): Hide the output of the stages.
+    # results_path (str): JSON file where the results are saved (default: 'benchmark_results_{scale}.json').
+    # baseline_path (str): Results of a previous run to compare with (see compare_results).
+    # tolerance (float): Allowed slowdown / memory growth before a stage is reported as a regression (0.25 = 25%).
+    # scrape_posts (int): Number of posts of the 'scrape' stage (the fake client serves them with latency and flood waits).
+    # profile_folder (str): If set, every stage is profiled with cProfile and its statistics are saved there as
+    #                       '{stage}.prof' (the profiler slows the stages down: do not compare these times with a baseline).
+    # trace_memory (bool): With profile_folder, also trace the allocations of each stage with tracemalloc.
+
+    # Returns:
+    # list of dict: One result per stage: 'stage', 'rows', 'seconds', 'rows_per_second', 'peak_rss_mb', ...
+
+    # Example:
+    # results = run_benchmarks('1m', baseline_path='benchmark_results_1m_main.json')
+
+    from synthetic_corpus import CORPUS_SCALES, generate_corpus
+
+    rows = CORPUS_SCALES[scale] if isinstance(scale, str) else scale
+    corpus_folder = corpus_folder or f'benchmark_corpus_{scale}'
+    work_folder = work_folder or f'benchmark_work_{scale}'
+    results_path = results_path or f'benchmark_results_{scale}.json'
+    if stages is None:
+        stages = [stage for stage in BENCHMARK_STAGES if stage != 'combine' or rows <= 1000000]
+
+    if not os.path.isdir(corpus_folder) or not any(name.endswith('.parquet') for name in os.listdir(corpus_folder)):
+        start_time = time.perf_counter()
+        generate_corpus(corpus_folder, rows, seed=seed)
+        print(f"Corpus of {rows} rows generated in {time.perf_counter() - start_time:.1f}s: {corpus_folder}")
+    shutil.rmtree(work_folder, ignore_errors=True)
+    os.makedirs(work_folder)
+    if profile_folder:
+        os.makedirs(profile_folder, exist_ok=True)
+
+    # Spawned processes start from a clean interpreter (no memory inherited from this one)
+    context = multiprocessing.get_context('spawn')
+    results = []
+    for stage in stages:
+        queue = context.Queue()
+        stage_kwargs = {'scrape_posts': scrape_posts} if stage == 'scrape' else {}
+        process = context.Process(target=run_stage, args=(stage, work_folder, corpus_folder, stage_kwargs, quiet, queue,
+                                                          profile_folder, trace_memory))
+        process.start()
+        process.join()
+        result = queue.get() if process.exitcode == 0 else None
+        if result is None:
+            print(f"{stage}: failed (exit code {process.exitcode})")
+            continue
+        result = {'stage': stage, **result, 'rows_per_second': result['rows'] / result['seconds'] if result['seconds'] else None}
+        results.append(result)
+        peak = f"{result['peak_rss_mb']:.0f} MB" if result['peak_rss_mb'] is not None else 'n/a'
+        print(f"{stage:<18} {result['rows']:>10} rows {result['seconds']:>9.2f}s {result['rows_per_second'] or 0:>12.0f} rows/s  peak RSS {peak}")
+
+    report = {
+        'scale': scale,
+        'rows': rows,
+        'seed': seed,
+        'date': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'results': results,
+    }
+    with open(results_path, 'w', encoding='utf-8') as file:
+        json.dump(report, file, indent=2)
+    print(f"Results saved to {results_path}")
+
+    if baseline_path:
+        compare_results(results, baseline_path, tolerance)
+    return results
+
+def compare_results(results, baseline_path, tolerance=0.25):
+
+    # Compare the results of a run with the saved results of a previous run.
+
+    # Parameters:
+    # results (list of dict): Results returned by run_benchmarks.
+    # baseline_path (str): JSON file saved by a previous run_benchmarks (same scale).
+    # tolerance (float): Allowed relative growth of the time and of the peak RSS of each stage.
+
+    # Returns:
+    # list of str: The regressions found (empty if none).
+
+    with open(baseline_path, 'r', encoding='utf-8') as file:
+        baseline = {result['stage']: result for result in json.load(file)['results']}
+
+    regressions = []
+    for result in results:
+        previous = baseline.get(result['stage'])
+        if previous is None:
+            continue
+        for metric in ['seconds', 'peak_rss_mb']:
+            if result.get(metric) is None or not previous.get(metric):
+                continue
+            change = result[metric] / previous[metric] - 1
+            if change > tolerance:
+                regressions.append(f"{result['stage']}: {metric} {previous[metric]:.2f} -> {result[metric]:.2f} (+{change:.0%})")
+
+    print("No regressions found." if not regressions else "Regressions:\n" + "\n".join(regressions))
+    return regressions
+
+# Usage
+if __name__ == '__main__':
+    # python benchmark_pipeline.py 1m [baseline.json]
+    benchmark_scale = sys.argv[1] if len(sys.argv) > 1 else '10k'
+    run_benchmarks(benchmark_scale, baseline_path=sys.argv[2] if len(sys.argv) > 2 else None)
@@ -1,9 +1,16 @@
 import os
+import shutil
+import tempfile
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 from tqdm import tqdm
-import json
+from comments_schema import count_comments, to_nested_comments
+from partitioned_dataset import write_partitioned_dataset
+from typed_columns import has_typed_columns, media_to_bool, to_typed_table
 
-def combine_parquet_files(folder_path, duplicate_columns, output_file_path):
+def combine_parquet_files(folder_path, duplicate_columns, output_file_path, comments_format=None, dataset_folder=None):
 
     # Combines multiple Parquet files from a specified folder into a single DataFrame,
     # removes duplicates, adjusts the 'Group' and 'Comments' columns, and saves the result as a Parquet file.
@@ -12,21 +19,26 @@ def combine_parquet_files(folder_path, duplicate_columns, output_file_path):
     # folder_path (str): Path to the folder containing the Parquet files to be combined.
     # duplicate_columns (list of str): List of column names to check for duplicates.
     # output_file_path (str): Path to save the combined Parquet file.
+    # comments_format (str): None to keep 'Comments List' as stored in the files, or 'nested' to convert JSON strings
+    #                        to the typed list<struct<...>> column (required if the folder mixes both formats).
+    # dataset_folder (str): Optional folder where the combined data is also written as a dataset partitioned by
+    #                       Group and month (see partitioned_dataset.py); an existing dataset there is replaced.
     #
     # Returns:
     # None
     #
     # Steps:
-    # 1. Read each Parquet file in the specified folder.
+    # 1. Read each Parquet file in the specified folder and count the comments of each row from 'Comments List'
+    #    (a columnar count, no JSON decoding).
     # 2. Concatenate the data from all Parquet files into a single DataFrame.
     # 3. Convert 'Message ID' column to string type.
     # 4. Ensure items in 'Group' column start with '@'.
     # 5. Remove duplicate rows based on specified columns.
-    # 6. Recalculate the 'Comments' column by counting occurrences of 'Type': 'comment' in 'Comments List'.
+    # 6. Use the 'Comments' column counted in step 1 (occurrences of 'Type': 'comment' in 'Comments List').
     # 7. Convert 'Media' column to boolean type.
     # 8. Sort the DataFrame by 'Date' in descending order.
     # 9. Print the number of rows, number of comments, and total contents.
-    # 10. Save the combined DataFrame to a Parquet file.
+    # 10. Save the combined DataFrame to a Parquet file (and to the partitioned dataset, if requested).
     #
     # Usage:
     # Place all .parquet files to be unified in the specified folder path.
@@ -39,7 +51,16 @@ def combine_parquet_files(folder_path, duplicate_columns, output_file_path):
     # combine_parquet_files(folder_path, duplicate_columns, output_file_path)
 
     def read_parquet(file_path):
-        return pd.read_parquet(file_path)
+        table = pq.read_table(file_path)
+        if 'Comments List' in table.column_names:
+            if comments_format == 'nested':
+                table = to_nested_comments(table)
+            df = table.to_pandas()
+            df['Comments'] = count_comments(table.column('Comments List'))
+            return df
+        df = table.to_pandas()
+        df['Comments'] = 0
+        return df
 
     file_paths = [os.path.join(folder_path, file) for file in os.listdir(folder_path) if file.endswith('.parquet')]
 
@@ -60,20 +81,11 @@ def combine_parquet_files(folder_path, duplicate_columns, output_file_path):
 
     print(f"Number of rows after removing duplicates: {len(combined_df)}")
 
-    def count_comments(comments_list):
-        if pd.isna(comments_list):
-            return 0
-        comments_list = json.loads(comments_list)
-        return sum(1 for item in comments_list if item.get('Type') == 'comment')
-
     if 'Comments' not in combined_df.columns:
         combined_df['Comments'] = 0
 
-    combined_df['Comments'] = [count_comments(row['Comments List']) for row in
-                               tqdm(combined_df.to_dict(orient="records"), desc="Calculating Comments")]
-
-    combined_df['Comments'] = combined_df['Comments'].astype(int)
-    combined_df['Media'] = combined_df['Media'].astype(bool)
+    combined_df['Comments'] = combined_df['Comments'].fillna(0).astype(int)
+    combined_df['Media'] = media_to_bool(combined_df['Media'])
 
     combined_df['Date'] = pd.to_datetime(combined_df['Date'])
     combined_df = combined_df.sort_values(by='Date', ascending=False)
@@ -85,14 +97,307 @@ def combine_parquet_files(folder_path, duplicate_columns, output_file_path):
     print(f" / Number of comments: {num_comments}")
     print(f" / Total contents (rows + comments): {len(combined_df) + num_comments}")
 
-    combined_df.to_parquet(output_file_path, index=False)
+    # Typed inputs keep their storage: pandas turns 'Group' into strings and the reaction counts into int64
+    if any(has_typed_columns(pq.read_schema(file)) for file in file_paths):
+        pq.write_table(to_typed_table(pa.Table.from_pandas(combined_df, preserve_index=False)), output_file_path)
+    else:
+        combined_df.to_parquet(output_file_path, index=False)
+
+    print(f" / Combined file saved at: {output_file_path}")
+
+    if dataset_folder:
+        write_partitioned_dataset([output_file_path], dataset_folder, replace=True)
+        print(f" / Partitioned dataset saved at: {dataset_folder}")
+
+
+def is_empty_parquet(file_path):
+
+    # Check, without loading the whole file, whether a Parquet file has no rows or only missing values.
+
+    # Parameters:
+    # file_path (str): Path of the Parquet file.
+
+    # Returns:
+    # bool: True if the file would be skipped by combine_parquet_files (empty, or every value is missing).
+
+    parquet_file = pq.ParquetFile(file_path)
+    if parquet_file.metadata.num_rows == 0:
+        return True
+    for batch in parquet_file.iter_batches():
+        if any(column.null_count < len(column) for column in batch.columns):
+            return False
+    return True
+
+def date_sort_key(dates):
+
+    # Turn a datetime column into an int64 key that sorts ascending like the dates sort descending (missing dates last).
+
+    # Parameters:
+    # dates (Series): The 'Date' column after pd.to_datetime.
+
+    # Returns:
+    # numpy.ndarray: The sort key of each row.
+
+    if getattr(dates.dt, 'tz', None) is not None:
+        dates = dates.dt.tz_convert('UTC').dt.tz_localize(None)
+    values = dates.to_numpy(dtype='datetime64[ns]').view('int64')
+    key = -values
+    key[dates.isna().to_numpy()] = np.iinfo(np.int64).max
+    return key
+
+def combined_schema(schemas, comments_format=None):
+
+    # Union of the columns of several files in order of appearance, like pd.concat; 'Message ID' and 'Group' become strings.
+
+    schemas = [schema.remove_metadata() for schema in schemas]
+    if comments_format == 'nested':
+        schemas = [to_nested_comments(schema.empty_table()).schema for schema in schemas]
+    schema = pa.unify_schemas(schemas, promote_options='permissive')
+    for column in ['Message ID', 'Group']:
+        if column in schema.names:
+            schema = schema.set(schema.get_field_index(column), pa.field(column, pa.string()))
+    return schema
+
+class StreamingCombiner:
+
+    # The passes of combine_parquet_files_streaming, fed one Arrow table at a time: add() spreads the rows into the
+    # buckets (pass 1), finish() deduplicates, sorts and merges them into the output file (passes 2 and 3).
+    # pipeline_runner.py feeds it the batches it also sends to the other scripts, so the folder is read only once.
+
+    # Parameters:
+    # schema (pyarrow.Schema): The combined schema of the inputs (see combined_schema).
+    # duplicate_columns (list of str): List of column names to check for duplicates.
+    # output_file_path (str): Path to save the combined Parquet file.
+    # total_rows (int): Number of input rows, to choose the number of buckets.
+    # comments_format (str): None to keep 'Comments List' as stored, or 'nested' to convert JSON strings.
+    # rows_per_bucket (int): Approximate number of rows per bucket.
+    # batch_size (int): Number of rows per row group of the sorted buckets.
+    # temp_folder (str): Folder for the temporary buckets (default: the system temporary folder).
+
+    # Example:
+    # combiner = StreamingCombiner(schema, ['Group', 'Message ID'], 'unified_data_telegram.parquet', total_rows)
+    # for batch in batches:
+    #     combiner.add(pa.Table.from_batches([batch]))
+    # combiner.finish()
+
+    def __init__(self, schema, duplicate_columns, output_file_path, total_rows, comments_format=None,
+                 rows_per_bucket=1000000, batch_size=100000, temp_folder=None):
+        self.schema = schema
+        self.duplicate_columns = duplicate_columns
+        self.output_file_path = output_file_path
+        self.total_rows = total_rows
+        self.comments_format = comments_format
+        self.batch_size = batch_size
+        self.num_buckets = max(1, -(-total_rows // rows_per_bucket))
+        self.bucket_schema = schema.append(pa.field('__position', pa.int64()))
+        self.work_folder = tempfile.mkdtemp(prefix='combine_', dir=temp_folder)
+        self.bucket_writers = {}
+        self.position = 0
+
+    def add(self, table):
+
+        # Pass 1: spread the rows into buckets by the hash of the duplicate columns.
+
+        if self.comments_format == 'nested':
+            table = to_nested_comments(table)
+        df = table.to_pandas()
+        for column in self.schema.names:
+            if column not in df.columns:
+                df[column] = None
+        df = df[self.schema.names]
+
+        df['Message ID'] = df['Message ID'].astype(str)
+        df['Group'] = df['Group'].apply(lambda x: x if x.startswith('@') else '@' + x)
+        df['__position'] = np.arange(self.position, self.position + len(df), dtype=np.int64)
+        self.position += len(df)
+
+        buckets = pd.util.hash_pandas_object(df[self.duplicate_columns], index=False).to_numpy() % self.num_buckets
+        for bucket in np.unique(buckets):
+            part = pa.Table.from_pandas(df[buckets == bucket], preserve_index=False).select(self.bucket_schema.names)
+            if bucket not in self.bucket_writers:
+                self.bucket_writers[bucket] = pq.ParquetWriter(os.path.join(self.work_folder, f'bucket_{bucket:05}.parquet'), self.bucket_schema)
+            self.bucket_writers[bucket].write_table(part.cast(self.bucket_schema))
+
+    def finish(self):
+
+        # Passes 2 and 3: deduplicate and sort each bucket, then merge the buckets into the output file.
+
+        # Returns:
+        # tuple: (number of rows written, number of comments).
+
+        duplicate_columns, output_file_path, batch_size, work_folder = self.duplicate_columns, self.output_file_path, self.batch_size, self.work_folder
+        for writer in self.bucket_writers.values():
+            writer.close()
+
+        try:
+            print(f"Number of rows before removing duplicates: {self.total_rows}")
+            print(f"Checking duplicates based on columns {duplicate_columns}...")
+
+            # Pass 2: deduplicate, adjust and sort each bucket on its own
+            num_duplicates = 0
+            num_comments = 0
+            num_rows = 0
+            run_paths = []
+            for bucket in tqdm(sorted(self.bucket_writers), desc="Deduplicating buckets"):
+                bucket_path = os.path.join(work_folder, f'bucket_{bucket:05}.parquet')
+                bucket_df = pq.read_table(bucket_path).to_pandas()
+                os.remove(bucket_path)
+
+                duplicated = bucket_df.duplicated(subset=duplicate_columns)
+                num_duplicates += int(duplicated.sum())
+                bucket_df = bucket_df[~duplicated]
+
+                if 'Comments List' in bucket_df.columns:
+                    bucket_df['Comments'] = count_comments(bucket_df['Comments List'])
+                else:
+                    bucket_df['Comments'] = 0
+                bucket_df['Comments'] = bucket_df['Comments'].astype(int)
+                bucket_df['Media'] = media_to_bool(bucket_df['Media'])
+                bucket_df['Date'] = pd.to_datetime(bucket_df['Date'])
+                bucket_df['__key'] = date_sort_key(bucket_df['Date'])
+                bucket_df = bucket_df.sort_values(by=['__key', '__position'])
+
+                num_comments += int(bucket_df['Comments'].sum())
+                num_rows += len(bucket_df)
+
+                run_path = os.path.join(work_folder, f'run_{bucket:05}.parquet')
+                bucket_df.to_parquet(run_path, index=False, row_group_size=batch_size)
+                run_paths.append(run_path)
+
+            print(num_duplicates, "duplicated rows found.")
+            print(f"Number of rows after removing duplicates: {num_rows}")
+
+            # Pass 3: k-way merge of the sorted buckets, one batch per bucket in memory
+            merge_rows_per_run = max(1000, batch_size // max(1, len(run_paths)))
+            runs = [pq.ParquetFile(run_path).iter_batches(batch_size=merge_rows_per_run) for run_path in run_paths]
+            buffers = [None] * len(runs)
+            output_columns = [column for column in pq.read_schema(run_paths[0]).names if not column.startswith('__')] if run_paths else []
+            output_schema = None
+            writer = None
+
+            def refill(index):
+                batch = next(runs[index], None)
+                buffers[index] = batch.to_pandas() if batch is not None else None
+
+            for index in range(len(runs)):
+                refill(index)
+
+            with tqdm(total=num_rows, desc="Merging buckets") as progress:
+                while any(buffer is not None for buffer in buffers):
+                    active = [index for index, buffer in enumerate(buffers) if buffer is not None]
+
+                    # Every row up to the smallest 'last key' of the buffers can be written: no later batch can precede it
+                    cutoff = min((buffers[index]['__key'].iat[-1], buffers[index]['__position'].iat[-1]) for index in active)
+                    chunks = []
+                    for index in active:
+                        buffer = buffers[index]
+                        ready = (buffer['__key'] < cutoff[0]) | ((buffer['__key'] == cutoff[0]) & (buffer['__position'] <= cutoff[1]))
+                        chunks.append(buffer[ready])
+                        buffers[index] = buffer[~ready]
+                        if buffers[index].empty:
+                            refill(index)
+
+                    chunk = pd.concat(chunks, ignore_index=True).sort_values(by=['__key', '__position'], kind='stable')
+                    table = pa.Table.from_pandas(chunk[output_columns], preserve_index=False)
+                    if has_typed_columns(self.schema):
+                        table = to_typed_table(table)
+                    if writer is None:
+                        output_schema = table.schema
+                        writer = pq.ParquetWriter(output_file_path, output_schema)
+                    writer.write_table(table.cast(output_schema))
+                    progress.update(len(chunk))
+
+            if writer is not None:
+                writer.close()
+        finally:
+            self.close()
+        return num_rows, num_comments
+
+    def close(self):
+
+        # Close the bucket writers and remove the temporary buckets.
+
+        for writer in self.bucket_writers.values():
+            writer.close()
+        self.bucket_writers = {}
+        shutil.rmtree(self.work_folder, ignore_errors=True)
+
+def combine_parquet_files_streaming(folder_path, duplicate_columns, output_file_path, comments_format=None,
+                                    rows_per_bucket=1000000, batch_size=100000, temp_folder=None, dataset_folder=None):
+
+    # Out-of-core version of combine_parquet_files: same output, bounded memory.
+
+    # Instead of concatenating every file in memory, rows are streamed in Arrow batches and spread by a hash of
+    # 'duplicate_columns' into buckets on disk, so all copies of a row land in the same bucket. Each bucket is then
+    # deduplicated exactly (keeping the first copy in file order, like drop_duplicates), adjusted and sorted on its own,
+    # and the sorted buckets are combined by an external k-way merge on 'Date'. Peak memory is about one bucket
+    # ('rows_per_bucket' rows) plus one batch per bucket during the merge.
+
+    # Parameters:
+    # folder_path (str): Path to the folder containing the Parquet files to be combined.
+    # duplicate_columns (list of str): List of column names to check for duplicates.
+    # output_file_path (str): Path to save the combined Parquet file.
+    # comments_format (str): None to keep 'Comments List' as stored in the files, or 'nested' to convert JSON strings
+    #                        to the typed list<struct<...>> column (required if the folder mixes both formats).
+    # rows_per_bucket (int): Approximate number of rows per bucket, i.e. the number of rows held in memory at once.
+    # batch_size (int): Number of rows read from the input files at a time.
+    # temp_folder (str): Folder for the temporary buckets (default: the system temporary folder).
+    # dataset_folder (str): Optional folder where the combined data is also written as a partitioned dataset.
+
+    # Returns:
+    # None
+
+    # Steps:
+    # 1. List the non-empty Parquet files of the folder and unify their schemas.
+    # 2. Stream each file in batches: convert 'Message ID' to string, add '@' to 'Group', and append each row
+    #    (with its position in the input) to the bucket chosen by the hash of 'duplicate_columns'.
+    # 3. For each bucket: remove duplicates, count the comments of 'Comments List', cast 'Media' to boolean,
+    #    convert 'Date' to datetime and sort by 'Date' in descending order.
+    # 4. Merge the sorted buckets into the output file, in descending order of 'Date'
+    #    (rows with the same 'Date' keep their input order).
+    # 5. Print the number of rows, number of comments, and total contents.
+
+    # Example:
+    # combine_parquet_files_streaming(folder_path, ['Group', 'Message ID'], output_file_path, rows_per_bucket=2000000)
+
+    file_paths = [os.path.join(folder_path, file) for file in os.listdir(folder_path) if file.endswith('.parquet')]
+    file_paths = [file for file in tqdm(file_paths, desc="Checking files") if not is_empty_parquet(file)]
+
+    schema = combined_schema([pq.read_schema(file) for file in file_paths], comments_format)
+    total_rows = sum(pq.ParquetFile(file).metadata.num_rows for file in file_paths)
+    combiner = StreamingCombiner(schema, duplicate_columns, output_file_path, total_rows, comments_format, rows_per_bucket,
+                                 batch_size, temp_folder)
+    try:
+        for file_path in tqdm(file_paths, desc="Reading files"):
+            for batch in pq.ParquetFile(file_path).iter_batches(batch_size=batch_size):
+                combiner.add(pa.Table.from_batches([batch]))
+    except BaseException:
+        combiner.close()
+        raise
+    num_rows, num_comments = combiner.finish()
+
+    print("\n")
+    print(f" / Number of rows in the combined dataframe: {num_rows}")
+    print(f" / Number of comments: {num_comments}")
+    print(f" / Total contents (rows + comments): {num_rows + num_comments}")
 
     print(f" / Combined file saved at: {output_file_path}")
 
+    if dataset_folder:
+        write_partitioned_dataset([output_file_path], dataset_folder, replace=True)
+        print(f" / Partitioned dataset saved at: {dataset_folder}")
+
 
 # Usage
-folder_path = r'C:\Users\Public\PyCharmProjects\Data_Conspira' # Example
-duplicate_columns = ['Group', 'Message ID']
-output_file_path = os.path.join(folder_path, 'unified_data_telegram.parquet') # Example
+if __name__ == '__main__':
+    folder_path = r'C:\Users\Public\PyCharmProjects\Data_Conspira' # Example
+    duplicate_columns = ['Group', 'Message ID']
+    output_file_path = os.path.join(folder_path, 'unified_data_telegram.parquet') # Example
+
+    combine_parquet_files(folder_path, duplicate_columns, output_file_path)
+
+    # For folders too large to fit in memory, use the streaming version instead (same output, bounded memory):
+    # combine_parquet_files_streaming(folder_path, duplicate_columns, output_file_path)
 
-combine_parquet_files(folder_path, duplicate_columns, output_file_path)
+    # To also write a dataset partitioned by group and month, read by the other scripts with group and date filters:
+    # combine_parquet_files(folder_path, duplicate_columns, output_file_path, dataset_folder=os.path.join(folder_path, 'telegram_dataset'))
@@ -0,0 +1,172 @@
+import json
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+# Typed storage for the 'Comments List' column.
+#
+# The scraper stores 'Comments List' either as a JSON string per post ('json', the default and the historical format)
+# or as a native Parquet list<struct<...>> column ('nested'). With 'nested', counting comments or filtering them
+# are columnar operations and nothing has to be decoded with json.loads.
+
+COMMENT_STRUCT = pa.struct([
+    ('Type', pa.string()),
+    ('Comment Group', pa.string()),
+    ('Comment Author ID', pa.int64()),
+    ('Comment Content', pa.string()),
+    ('Comment Date', pa.string()),
+    ('Comment Message ID', pa.int64()),
+    ('Comment Author', pa.string()),
+    ('Comment Views', pa.int64()),
+    ('Comment Reactions', pa.string()),
+    ('Comment Shares', pa.int64()),
+    ('Comment Media', pa.string()),
+    ('Comment Url', pa.string()),
+])
+
+COMMENTS_LIST_TYPE = pa.list_(COMMENT_STRUCT)
+
+# Only the 'Type' of each comment, enough to count comments whatever the types of the other fields
+COMMENT_TYPES_LIST_TYPE = pa.list_(pa.struct([('Type', pa.string())]))
+
+# How json.dumps writes the type of each comment; quotes inside comment texts are escaped, so this never
+# matches inside a text
+COMMENT_TYPE_PATTERN = r'"Type":\s*"comment"'
+
+def comments_to_nested(values, list_type=COMMENTS_LIST_TYPE):
+
+    # Convert 'Comments List' values to a typed list<struct> Arrow array.
+
+    # Parameters:
+    # values (iterable): JSON strings, already decoded lists of dicts, or None.
+    # list_type (pyarrow.DataType): The list<struct> type of the result (keys missing from the struct are ignored).
+
+    # Returns:
+    # pyarrow.Array: The comments as a COMMENTS_LIST_TYPE array.
+
+    decoded = []
+    for value in values:
+        if value is None or (isinstance(value, float) and np.isnan(value)):
+            decoded.append(None)
+        elif isinstance(value, str):
+            decoded.append(json.loads(value))
+        else:
+            decoded.append(list(value))
+    return pa.array(decoded, type=list_type)
+
+def to_nested_comments(table):
+
+    # Return the table with its 'Comments List' column stored as list<struct>.
+
+    # Parameters:
+    # table (pyarrow.Table): A table in the scraper's schema.
+
+    # Returns:
+    # pyarrow.Table: The same table, with 'Comments List' converted if it was a JSON string column
+    #                (nested columns, e.g. the typed comments of typed_columns.py, are kept as they are).
+
+    if 'Comments List' not in table.column_names or is_nested(table.schema.field('Comments List')):
+        return table
+    index = table.column_names.index('Comments List')
+    nested = comments_to_nested(table.column('Comments List').to_pylist())
+    # The pandas metadata still describes the old string column, so it is dropped
+    table = table.set_column(index, pa.field('Comments List', COMMENTS_LIST_TYPE), nested)
+    return table.replace_schema_metadata(None)
+
+def is_nested(column):
+
+    # Returns True if an Arrow 'Comments List' column (or array) is stored as a list.
+
+    return pa.types.is_list(column.type) or pa.types.is_large_list(column.type)
+
+def count_comments(column):
+
+    # Count the items with 'Type' == 'comment' in each 'Comments List' value, without decoding JSON.
+
+    # Parameters:
+    # column (pyarrow.Array, pyarrow.ChunkedArray or pandas.Series): The 'Comments List' column, nested or JSON.
+
+    # Returns:
+    # numpy.ndarray: The number of comments of each row (0 for missing values).
+
+    if isinstance(column, pd.Series):
+        if column.map(lambda value: isinstance(value, (list, np.ndarray))).any():
+            column = comments_to_nested(column, COMMENT_TYPES_LIST_TYPE)
+        else:
+            column = pa.array(column.astype(object).where(column.notna(), None), type=pa.string())
+
+    if isinstance(column, pa.ChunkedArray):
+        column = column.combine_chunks()
+
+    if is_nested(column):
+        flat = pc.list_flatten(column)
+        is_comment = pc.fill_null(pc.equal(pc.struct_field(flat, 'Type'), 'comment'), False)
+        parents = pc.list_parent_indices(column).to_numpy()
+        return np.bincount(parents, weights=is_comment.to_numpy(zero_copy_only=False), minlength=len(column)).astype(int)
+
+    return pc.fill_null(pc.count_substring_regex(column, COMMENT_TYPE_PATTERN), 0).to_numpy(zero_copy_only=False).astype(int)
+
+def decode_comments_list(series):
+
+    # Decode a 'Comments List' pandas column into Python lists of dicts, whatever its storage.
+
+    # Parameters:
+    # series (pandas.Series): The 'Comments List' column as read by pandas.
+
+    # Returns:
+    # pandas.Series: The decoded lists (missing values are kept as they are).
+
+    def decode(value):
+        if isinstance(value, str):
+            return json.loads(value)
+        if isinstance(value, (list, np.ndarray)):
+            return list(value)
+        return value
+
+    return series.map(decode)
+
+def flatten_comments(table):
+
+    # Flatten a nested 'Comments List' column into one row per comment, for comment-level filters.
+
+    # Parameters:
+    # table (pyarrow.Table): A table with a nested 'Comments List' column.
+
+    # Returns:
+    # pyarrow.Table: One row per comment, with the comment fields plus 'Row Index' (the index of its post in 'table').
+
+    column = table.column('Comments List').combine_chunks()
+    flat = pc.list_flatten(column)
+    comments = pa.Table.from_arrays(flat.flatten(), names=[field.name for field in flat.type])
+    return comments.append_column('Row Index', pc.list_parent_indices(column))
+
+def convert_parquet_comments(input_file_path, output_file_path):
+
+    # Convert an existing Parquet file with JSON 'Comments List' strings to the nested storage, one row group at a time.
+
+    # Parameters:
+    # input_file_path (str): Path of the Parquet file to convert.
+    # output_file_path (str): Path of the converted Parquet file.
+
+    # Returns:
+    # int: The number of rows converted.
+
+    # Example:
+    # convert_parquet_comments('unified_data_telegram.parquet', 'unified_data_telegram_nested.parquet')
+
+    parquet_file = pq.ParquetFile(input_file_path)
+    writer = None
+    total_rows = 0
+    for row_group in range(parquet_file.num_row_groups):
+        table = to_nested_comments(parquet_file.read_row_group(row_group))
+        if writer is None:
+            writer = pq.ParquetWriter(output_file_path, table.schema)
+        writer.write_table(table)
+        total_rows += table.num_rows
+    if writer is None:
+        pq.write_table(to_nested_comments(parquet_file.schema_arrow.empty_table()), output_file_path)
+    else:
+        writer.close()
+    return total_rows
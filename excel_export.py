@@ -0,0 +1,216 @@
+import os
+import re
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font
+from tqdm import tqdm
+from typed_columns import is_reactions_type, reactions_text
+
+# Constant-memory .xlsx export.
+#
+# Workbooks are written with openpyxl in write-only mode: rows are streamed to the file as they come, one Parquet
+# batch at a time, instead of building the whole workbook in memory like DataFrame.to_excel. Exports split in part
+# files (Excel sheets hold at most 1,048,576 rows) write their parts at the same time, in worker processes.
+# openpyxl writes much faster when lxml is installed (pip install lxml).
+
+# Characters that are not allowed in XML, and therefore in .xlsx files (same as remove_unsupported_characters)
+XML_INVALID_CHARACTERS = re.compile('[^%s]' % ''.join([
+    '\t\n\r',
+    chr(0x20) + '-' + chr(0xD7FF),
+    chr(0xE000) + '-' + chr(0xFFFD),
+    chr(0x10000) + '-' + chr(0x10FFFF),
+]))
+
+MAX_EXCEL_ROWS = 1048575  # 1,048,576 rows per sheet, minus the header
+
+def excel_value(value):
+
+    # Convert a value read from Arrow to something a cell can hold.
+
+    if isinstance(value, str):
+        return XML_INVALID_CHARACTERS.sub('', value)
+    if isinstance(value, datetime) and value.tzinfo is not None:
+        # Excel has no time zones: dates are written in UTC
+        return pd.Timestamp(value).tz_convert('UTC').tz_localize(None).to_pydatetime()
+    if isinstance(value, (list, dict)):
+        return XML_INVALID_CHARACTERS.sub('', str(value))
+    return value
+
+def excel_column(column):
+
+    # Prepare a whole Arrow column for the cells (vectorized version of excel_value for text and dates).
+
+    if pa.types.is_string(column.type) or pa.types.is_large_string(column.type):
+        return pc.replace_substring_regex(column, XML_INVALID_CHARACTERS.pattern, '').to_pylist()
+    if pa.types.is_timestamp(column.type) and column.type.tz is not None:
+        return column.cast(pa.timestamp(column.type.unit)).to_pylist()
+    if pa.types.is_dictionary(column.type):
+        return excel_column(column.dictionary_decode())
+    if is_reactions_type(column.type):
+        # Typed reactions are shown as the scraper's text ('👍 3 ❤ 2 '), like the files written before
+        return [None if value is None else excel_value(reactions_text(value)) for value in column.to_pylist()]
+    return [excel_value(value) for value in column.to_pylist()]
+
+def dataframe_to_table(df):
+
+    # Convert a DataFrame to Arrow; object columns Arrow cannot type (mixed values) are exported as text, as
+    # DataFrame.to_excel would show them.
+
+    try:
+        return pa.Table.from_pandas(df, preserve_index=False)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        df = df.copy()
+        for column in df.columns:
+            if df[column].dtype == object:
+                try:
+                    pa.array(df[column], from_pandas=True)
+                except (pa.ArrowInvalid, pa.ArrowTypeError):
+                    df[column] = df[column].map(lambda value: value if value is None or value is pd.NA else str(value))
+        return pa.Table.from_pandas(df, preserve_index=False)
+
+def write_excel_batches(batches, output_path, columns):
+
+    # Stream record batches into a new .xlsx file (write-only workbook, one sheet, bold header).
+
+    # Parameters:
+    # batches (iterable of pyarrow.RecordBatch): The rows.
+    # output_path (str): Path of the .xlsx file.
+    # columns (list of str): Column names, written as the header.
+
+    # Returns:
+    # int: The number of rows written.
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    header = []
+    for column in columns:
+        cell = WriteOnlyCell(sheet, value=excel_value(str(column)))
+        cell.font = Font(bold=True)
+        header.append(cell)
+    sheet.append(header)
+
+    rows = 0
+    for batch in batches:
+        for row in zip(*[excel_column(batch.column(index)) for index in range(batch.num_columns)]):
+            sheet.append(row)
+        rows += batch.num_rows
+    workbook.save(output_path)
+    return rows
+
+def iter_row_range(file_path, start, end, columns=None, batch_size=10000):
+
+    # Yield the rows [start, end) of a Parquet file as record batches, reading only the row groups that hold them.
+
+    parquet_file = pq.ParquetFile(file_path)
+    group_start = 0
+    for group in range(parquet_file.num_row_groups):
+        group_rows = parquet_file.metadata.row_group(group).num_rows
+        group_end = group_start + group_rows
+        if group_end > start and group_start < end:
+            table = parquet_file.read_row_group(group, columns=columns)
+            table = table.slice(max(start - group_start, 0), min(end, group_end) - max(start, group_start))
+            yield from table.to_batches(max_chunksize=batch_size)
+        group_start = group_end
+        if group_start >= end:
+            break
+
+def write_excel_part(file_path, start, end, output_path, columns=None, batch_size=10000):
+
+    # Worker task: write the rows [start, end) of a Parquet file to one .xlsx part file.
+
+    names = columns or pq.ParquetFile(file_path).schema_arrow.names
+    return write_excel_batches(iter_row_range(file_path, start, end, columns, batch_size), output_path, names)
+
+def excel_part_paths(output_base, num_parts):
+
+    # Names of the part files: '{output_base}_unique.xlsx' for a single part, '{output_base}_part_{n}.xlsx' otherwise.
+
+    if num_parts == 1:
+        return [f'{output_base}_unique.xlsx']
+    return [f'{output_base}_part_{part + 1}.xlsx' for part in range(num_parts)]
+
+def export_parquet_to_excel(file_path, output_base, max_rows_per_file=1000000, columns=None, workers=None, batch_size=10000):
+
+    # Export a Parquet file to .xlsx part files of up to max_rows_per_file rows, writing the parts in parallel.
+
+    # Parameters:
+    # file_path (str): Path of the Parquet file.
+    # output_base (str): Path of the output files, without extension (see excel_part_paths).
+    # max_rows_per_file (int): Maximum number of rows per part file (at most 1,048,575).
+    # columns (list of str): Columns to export (default: all).
+    # workers (int): Number of processes writing part files at the same time (default: number of CPUs).
+    # batch_size (int): Number of rows converted at a time.
+
+    # Returns:
+    # list of str: The paths of the part files.
+
+    # Example:
+    # export_parquet_to_excel('filtered.parquet', 'filtered_keywords', max_rows_per_file=1000000)
+
+    max_rows_per_file = min(max_rows_per_file, MAX_EXCEL_ROWS)
+    num_rows = pq.ParquetFile(file_path).metadata.num_rows
+    num_parts = max(1, -(-num_rows // max_rows_per_file))
+    output_paths = excel_part_paths(output_base, num_parts)
+    tasks = [(file_path, part * max_rows_per_file, min((part + 1) * max_rows_per_file, num_rows), output_path, columns, batch_size)
+             for part, output_path in enumerate(output_paths)]
+
+    workers = min(workers or os.cpu_count() or 1, num_parts)
+    if workers == 1:
+        for task in tqdm(tasks, desc="Saving files"):
+            write_excel_part(*task)
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(write_excel_part, *task) for task in tasks]
+            for future in tqdm(futures, desc="Saving files"):
+                future.result()
+    return output_paths
+
+def export_dataframe_to_excel(df, output_base, max_rows_per_file=1000000, workers=None, batch_size=10000):
+
+    # Export a DataFrame to .xlsx part files (see export_parquet_to_excel), through a temporary Parquet file.
+
+    # Parameters:
+    # df (DataFrame): The rows to export (the index is not exported).
+    # output_base (str): Path of the output files, without extension.
+    # max_rows_per_file (int): Maximum number of rows per part file.
+    # workers (int): Number of processes writing part files at the same time.
+    # batch_size (int): Number of rows converted at a time.
+
+    # Returns:
+    # list of str: The paths of the part files.
+
+    temp_folder = tempfile.mkdtemp(prefix='excel_export_')
+    try:
+        temp_path = os.path.join(temp_folder, 'export.parquet')
+        pq.write_table(dataframe_to_table(df), temp_path, row_group_size=batch_size)
+        return export_parquet_to_excel(temp_path, output_base, max_rows_per_file, workers=workers, batch_size=batch_size)
+    finally:
+        shutil.rmtree(temp_folder, ignore_errors=True)
+
+def write_excel(data, output_path, batch_size=10000):
+
+    # Write a DataFrame, a pyarrow.Table or a list of dicts to a single .xlsx file, streaming its rows.
+
+    # Parameters:
+    # data (DataFrame, pyarrow.Table or list of dict): The rows (the index of a DataFrame is not written).
+    # output_path (str): Path of the .xlsx file.
+    # batch_size (int): Number of rows converted at a time.
+
+    # Returns:
+    # int: The number of rows written.
+
+    if isinstance(data, pd.DataFrame):
+        table = dataframe_to_table(data)
+    elif isinstance(data, pa.Table):
+        table = data
+    else:
+        table = pa.Table.from_pylist(list(data))
+    return write_excel_batches(table.to_batches(max_chunksize=batch_size), output_path, table.column_names)
@@ -0,0 +1,242 @@
+import asyncio
+import math
+import random
+import time
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+from rate_limiter import FloodWaitError
+
+def make_fake_message(message_id, date, text, reply_to=None, rng=None):
+
+    # Create an object with the same attributes the scraper reads from a Telethon message.
+
+    # Parameters:
+    # message_id (int): The message ID.
+    # date (datetime): The message date (timezone-aware, UTC).
+    # text (str): The message text.
+    # reply_to (int): ID of the post this message replies to, if it is a comment.
+    # rng (random.Random): Random generator used for views, shares, media and reactions.
+
+    # Returns:
+    # SimpleNamespace: The fake message.
+
+    rng = rng or random.Random(message_id)
+    reactions = None
+    if rng.random() < 0.5:
+        results = [
+            SimpleNamespace(reaction=SimpleNamespace(emoticon=emoji), count=rng.randint(1, 500))
+            for emoji in rng.sample(['👍', '❤', '🔥', '😂', '😡'], rng.randint(1, 3))
+        ]
+        reactions = SimpleNamespace(results=results)
+
+    return SimpleNamespace(
+        id=message_id,
+        date=date,
+        text=text,
+        media=rng.random() < 0.3,
+        reactions=reactions,
+        sender_id=rng.randint(10 ** 8, 10 ** 9),
+        post_author=None,
+        views=rng.randint(0, 100000),
+        forwards=rng.randint(0, 1000),
+        reply_to_msg_id=reply_to,
+    )
+
+class FakeTelegramClient:
+
+    # Offline stand-in for TelegramClient that serves deterministic synthetic channels.
+
+    # Messages are served newest first, like Telethon, in pages of 'page_size'; every page costs
+    # 'latency' seconds of (asynchronous) waiting, which simulates the network round-trip.
+
+    # Parameters:
+    # channels (dict): Maps channel name to the number of posts it has, e.g. {'@channel_a': 500}.
+    # comments_per_post (int): Number of comments every post has.
+    # latency (float): Seconds waited per page of messages.
+    # page_size (int): Number of messages per simulated request (Telethon uses 100).
+    # date_max (datetime): Date of the newest post of every channel.
+    # post_interval (timedelta): Time between two consecutive posts.
+    # seed (int): Seed for the synthetic data.
+    # link_probability (float): Probability that a post also links to another channel of 'channels' (for snowball crawls).
+    # flood_rate (float): If set, requests beyond this many per second (over the last second) fail with a
+    #                     FloodWaitError, like Telegram's flood control.
+    # flood_probability (float): Probability that any request fails with a FloodWaitError (seeded, reproducible).
+    # flood_seconds (int): Wait time reported by the injected FloodWaitErrors.
+
+    # Example:
+    # client = FakeTelegramClient({'@channel_a': 1000, '@channel_b': 300}, comments_per_post=2, latency=0.05)
+    # data = await scrape_channels(client, ['@channel_a', '@channel_b'], date_min, date_max)
+    # flooding_client = FakeTelegramClient({'@channel_a': 1000}, flood_rate=5, flood_seconds=1)
+
+    def __init__(self, channels, comments_per_post=0, latency=0.0, page_size=100,
+                 date_max=datetime(2025, 1, 15, tzinfo=timezone.utc), post_interval=timedelta(minutes=30), seed=0,
+                 link_probability=0.0, flood_rate=None, flood_probability=0.0, flood_seconds=1):
+        self.channels = channels
+        self.comments_per_post = comments_per_post
+        self.latency = latency
+        self.page_size = page_size
+        self.date_max = date_max
+        self.post_interval = post_interval
+        self.seed = seed
+        self.link_probability = link_probability
+        self.flood_rate = flood_rate
+        self.flood_probability = flood_probability
+        self.flood_seconds = flood_seconds
+        self.flood_rng = random.Random(f'{seed}:floods')
+        self.recent_requests = []
+        self.floods = 0
+        self.requests = 0
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        return False
+
+    async def _request(self):
+        self.requests += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        now = time.monotonic()
+        self.recent_requests = [moment for moment in self.recent_requests if now - moment < 1]
+        self.recent_requests.append(now)
+        flooded = self.flood_rate is not None and len(self.recent_requests) > self.flood_rate
+        if flooded or self.flood_probability and self.flood_rng.random() < self.flood_probability:
+            self.floods += 1
+            raise FloodWaitError(request=None, capture=self.flood_seconds)
+
+    def _channel(self, entity):
+
+        # Channel name of an entity: a name given as is, or an entity returned by get_entity.
+
+        channel = getattr(entity, 'username', None)
+        channel = '@' + channel if channel else entity
+        if channel not in self.channels:
+            raise ValueError(f'No user has "{entity}" as username')
+        return channel
+
+    async def get_entity(self, entity):
+
+        # Resolve a channel name like TelegramClient.get_entity (one request).
+
+        channel = self._channel(entity)
+        await self._request()
+        return SimpleNamespace(id=sorted(self.channels).index(channel) + 1, username=channel[1:])
+
+    def _post(self, channel, message_id):
+        rng = random.Random(f'{self.seed}:{channel}:{message_id}')
+        date = self.date_max - (self.channels[channel] - message_id) * self.post_interval
+        text = f'Post {message_id} from {channel} https://t.me/{channel[1:]}'
+        if self.link_probability and rng.random() < self.link_probability:
+            text += f' https://t.me/{rng.choice(sorted(self.channels))[1:]}'
+        message = make_fake_message(message_id, date, text, rng=rng)
+        message.replies = SimpleNamespace(replies=self.comments_per_post)
+        return message
+
+    def _comment(self, channel, post_id, index):
+        rng = random.Random(f'{self.seed}:{channel}:{post_id}:{index}')
+        comment_id = self.channels[channel] + post_id * self.comments_per_post + index
+        date = self._post(channel, post_id).date + timedelta(minutes=index + 1)
+        return make_fake_message(comment_id, date, f'Comment {index} on post {post_id}', reply_to=post_id, rng=rng)
+
+    def _id_bounds(self, channel, min_id=0, max_id=0, offset_id=0, offset_date=None, reverse=False):
+
+        # Oldest and newest post IDs served by a request, computed from the ID and date offsets like Telegram
+        # does on the server side (the skipped posts cost no request).
+
+        count = self.channels[channel]
+        oldest, newest = 1, count
+        if min_id:
+            oldest = max(oldest, min_id + 1)
+        if max_id:
+            newest = min(newest, max_id - 1)
+        # Posts are 'post_interval' apart: post 'count - k' was posted k intervals before date_max
+        intervals = (self.date_max - offset_date) / self.post_interval if offset_date is not None else None
+        if reverse:
+            if offset_id:
+                oldest = max(oldest, offset_id + 1)
+            if intervals is not None:
+                oldest = max(oldest, math.floor(count - intervals) + 1)
+        else:
+            if offset_id:
+                newest = min(newest, offset_id - 1)
+            if intervals is not None:
+                newest = min(newest, math.ceil(count - intervals) - 1)
+        return oldest, newest
+
+    async def iter_messages(self, entity, limit=None, search=None, reply_to=None, min_id=0, max_id=0, offset_id=0,
+                            offset_date=None, reverse=False, **kwargs):
+
+        # Async generator mirroring TelegramClient.iter_messages for the arguments the scraper uses.
+        # Without reverse, 'offset_date' serves the posts older than that date; with reverse, the posts newer than it.
+
+        entity = self._channel(entity)
+
+        if reply_to is not None:
+            ids = [self._comment(entity, reply_to, index) for index in range(self.comments_per_post)]
+            messages = sorted(ids, key=lambda message: message.id, reverse=not reverse)
+            messages = [message for message in messages
+                        if not (min_id and message.id <= min_id or max_id and message.id >= max_id
+                                or offset_id and (message.id <= offset_id if reverse else message.id >= offset_id))]
+        else:
+            oldest, newest = self._id_bounds(entity, min_id, max_id, offset_id, offset_date, reverse)
+            message_ids = range(oldest, newest + 1) if reverse else range(newest, oldest - 1, -1)
+            messages = (self._post(entity, message_id) for message_id in message_ids)
+
+        served = 0
+        for message in messages:
+            if search and search not in message.text:
+                continue
+            if limit is not None and served >= limit:
+                break
+            if served % self.page_size == 0:
+                await self._request()
+            served += 1
+            yield message
+
+async def measure_scrape_throughput(num_channels=20, posts_per_channel=500, comments_per_post=2, latency=0.05, concurrency=5,
+                                    max_comment_requests=10):
+
+    # Measure the offline throughput of scrape_channels against a FakeTelegramClient.
+
+    # Parameters:
+    # num_channels (int): Number of synthetic channels.
+    # posts_per_channel (int): Number of posts in each channel.
+    # comments_per_post (int): Number of comments of each post.
+    # latency (float): Simulated seconds per request.
+    # concurrency (int): Number of channels scraped at the same time.
+    # max_comment_requests (int): Number of reply threads fetched at the same time.
+
+    # Returns:
+    # dict: Number of posts, elapsed seconds, posts per second and number of simulated requests.
+
+    from telegram_scraper import scrape_channels
+    from rate_limiter import AdaptiveRateLimiter
+
+    channels = {f'@fake_channel_{i:03}': posts_per_channel for i in range(num_channels)}
+    client = FakeTelegramClient(channels, comments_per_post=comments_per_post, latency=latency)
+    date_max = client.date_max
+    date_min = date_max - posts_per_channel * client.post_interval
+
+    start_time = time.time()
+    # The fake client has no flood control here: the limiter must not be the bottleneck being measured
+    limiter = AdaptiveRateLimiter(rate=100000, burst=100000, max_rate=100000)
+    data = await scrape_channels(client, list(channels), date_min, date_max, concurrency=concurrency,
+                                 max_comment_requests=max_comment_requests, rate_limiter=limiter)
+    elapsed_time = time.time() - start_time
+
+    return {
+        'posts': len(data),
+        'seconds': elapsed_time,
+        'posts_per_second': len(data) / elapsed_time if elapsed_time else float('inf'),
+        'requests': client.requests,
+    }
+
+
+# Usage
+if __name__ == '__main__':
+    for concurrency, max_comment_requests in [(1, 1), (5, 1), (5, 10), (20, 50)]:
+        result = asyncio.run(measure_scrape_throughput(concurrency=concurrency, max_comment_requests=max_comment_requests))
+        print(f"Concurrency {concurrency}, comment requests {max_comment_requests}: {result['posts']} posts in {result['seconds']:.2f}s "
+              f"({result['posts_per_second']:.1f} posts/s, {result['requests']} requests)")
@@ -1,10 +1,13 @@
-import pandas as pd
-from tqdm import tqdm
 import os
+from group_month_rollup import update_rollup_store, render_rollup_reports
 
-def create_group_month_summary(folder_path, input_filename, output_filename_base, date_col, group_col, comments_col):
+def create_group_month_summary(folder_path, input_filename, output_filename_base, date_col, group_col, comments_col,
+                               store_path=None, file_format='xlsx', metrics=('Contents', 'Comments', 'Total'),
+                               groups=None, date_min=None, date_max=None):
     
     # Creates summary tables showing the number of contents, comments, and total (contents + comments) each group had per month.
+    # The totals are kept in a rollup store (see group_month_rollup.py): the input file is only read again when it
+    # changed, and only its date, group and metric columns are read.
 
     # Parameters:
     # folder_path (str): The path to the folder containing the Parquet file.
@@ -13,20 +16,22 @@ def create_group_month_summary(folder_path, input_filename, output_filename_base
     # group_col (str): The column name containing the group data.
     # comments_col (str): The column name containing the comments data.
     # output_filename_base (str): The base name of the output Excel files.
+    # store_path (str): Path of the rollup store (default: '{output_filename_base}_rollup.parquet' in folder_path).
+    #                   input_filename may also be a list of newly combined files, added to the store as they come,
+    #                   or a dataset folder partitioned by group and month (see partitioned_dataset.py).
+    # file_format (str): 'xlsx' (default) or 'csv'.
+    # metrics (tuple of str): Tables to write: 'Contents', 'Comments', 'Total', 'Views', 'Shares' and/or 'Reactions'.
+    # groups (list of str): Only report these groups (default: all).
+    # date_min, date_max (datetime or str): Only report the months of this period (default: all).
 
     # Returns:
     # None
 
     # Steps:
-    # 1. Load the Parquet file into a DataFrame.
-    # 2. Convert the date column to datetime.
-    # 3. Add a new column with the month and year of the date.
-    # 4. Group the DataFrame by 'Group' and 'MonthYear' and count the number of items.
-    # 5. Group the DataFrame by 'Group' and 'MonthYear' and sum the comments.
-    # 6. Sum contents and comments.
-    # 7. Reindex to include all months from the first to the last.
-    # 8. Convert the PeriodIndex back to string format for Excel compatibility.
-    # 9. Save the resulting DataFrames to Excel files.
+    # 1. Add the input file(s) to the rollup store, if new or changed: a single grouped pass counts the contents and
+    #    sums the comments, views, shares and reactions of each group per month ('YYYY-MM' of the date column).
+    # 2. Pivot each metric of the store to a Group x month table, including all months from the first to the last.
+    # 3. Save the resulting tables to Excel (or CSV) files.
 
     # Usage:
     # Place the Parquet file to be summarized in the specified folder path and specify the appropriate column names and output file base name.
@@ -42,59 +47,27 @@ def create_group_month_summary(folder_path, input_filename, output_filename_base
     # )
     
     try:
-        # Load the Parquet file into a DataFrame
-        input_file_path = os.path.join(folder_path, input_filename)
-        df = pd.read_parquet(input_file_path)
-
-        # Convert the 'Date' column to datetime
-        df[date_col] = pd.to_datetime(df[date_col])
-
-        # Add a new column with the month and year of the date
-        df['MonthYear'] = df[date_col].dt.to_period('M')
-
-        # Group the DataFrame by 'Group' and 'MonthYear' and count the number of items
-        df_contents = df.groupby([group_col, 'MonthYear']).size().unstack().fillna(0)
-
-        # Group the DataFrame by 'Group' and 'MonthYear' and sum the comments
-        df_comments = df.groupby([group_col, 'MonthYear'])[comments_col].sum().unstack().fillna(0)
-
-        # Sum contents and comments
-        df_total = df_contents.add(df_comments, fill_value=0)
-
-        # Reindex to include all months from the first to the last
-        all_months = pd.period_range(start=df_contents.columns.min(), end=df_contents.columns.max(), freq='M')
-        df_contents = df_contents.reindex(columns=all_months, fill_value=0)
-        df_comments = df_comments.reindex(columns=all_months, fill_value=0)
-        df_total = df_total.reindex(columns=all_months, fill_value=0)
-
-        # Convert the PeriodIndex back to string format for Excel compatibility
-        df_contents.columns = df_contents.columns.astype(str)
-        df_comments.columns = df_comments.columns.astype(str)
-        df_total.columns = df_total.columns.astype(str)
-
-        # Save the resulting DataFrames to Excel files
-        output_file_path_contents = os.path.join(folder_path, f"{output_filename_base}_contents.xlsx")
-        df_contents.to_excel(output_file_path_contents, index=True)
-
-        output_file_path_comments = os.path.join(folder_path, f"{output_filename_base}_comments.xlsx")
-        df_comments.to_excel(output_file_path_comments, index=True)
-
-        output_file_path_total = os.path.join(folder_path, f"{output_filename_base}_total.xlsx")
-        df_total.to_excel(output_file_path_total, index=True)
-
-        print(f"Contents summary table saved as: {output_file_path_contents}")
-        print(f"Comments summary table saved as: {output_file_path_comments}")
-        print(f"Total summary table saved as: {output_file_path_total}")
+        # Add the input file(s) to the rollup store
+        input_filenames = [input_filename] if isinstance(input_filename, str) else list(input_filename)
+        input_file_paths = [os.path.join(folder_path, filename) for filename in input_filenames]
+        store_path = store_path or os.path.join(folder_path, f"{output_filename_base}_rollup.parquet")
+        updated = update_rollup_store(store_path, input_file_paths, date_col=date_col, group_col=group_col, comments_col=comments_col)
+        print(f"{updated} file(s) added to the rollup store: {store_path}")
+
+        # Render the summary tables from the store
+        render_rollup_reports(store_path, folder_path, output_filename_base, metrics=metrics, file_format=file_format,
+                              groups=groups, date_min=date_min, date_max=date_max)
     except Exception as e:
         print(f"An error occurred: {e}")
 
 
 # Usage
-create_group_month_summary(
-    folder_path=r'C:\Users\Public\PyCharmProjects\Data_Conspira', # Example
-    input_filename='unified_data_telegram.parquet', # Example
-    output_filename_base='resume', # Example
-    date_col='Date',
-    group_col='Group',
-    comments_col='Comments'
-)
+if __name__ == '__main__':
+    create_group_month_summary(
+        folder_path=r'C:\Users\Public\PyCharmProjects\Data_Conspira', # Example
+        input_filename='unified_data_telegram.parquet', # Example
+        output_filename_base='resume', # Example
+        date_col='Date',
+        group_col='Group',
+        comments_col='Comments'
+    )
@@ -0,0 +1,278 @@
+import os
+import json
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from tqdm import tqdm
+from comments_schema import count_comments
+from partitioned_dataset import open_dataset, iter_dataset_batches, dataset_files, as_utc
+from typed_columns import sum_reaction_counts
+
+# Materialized group x month rollups of scraped Parquet files.
+#
+# The store is a small Parquet table with one row per (Source File, Group, Month) and the totals of that month:
+# 'Contents', 'Comments', 'Views', 'Shares' and 'Reactions'. Updating it only reads the files that are new or were
+# rewritten since the last update (tracked by size and modification time in '<store>.json'), and only the columns
+# the rollup needs. Reports are pivots of the store and do not read the scraped data at all.
+#
+# The totals of the files are added up, so the files given to the store must not overlap: use either the unified
+# file or the newly combined files of each run, not both.
+
+ROLLUP_METRICS = ['Contents', 'Comments', 'Views', 'Shares', 'Reactions']
+
+ROLLUP_SCHEMA = pa.schema([
+    ('Source File', pa.string()),
+    ('Group', pa.string()),
+    ('Month', pa.string()),
+    ('Contents', pa.int64()),
+    ('Comments', pa.int64()),
+    ('Views', pa.int64()),
+    ('Shares', pa.int64()),
+    ('Reactions', pa.int64()),
+])
+
+# A reaction count is a number between spaces in 'emoji count emoji count ...' (see format_reactions)
+REACTION_COUNT_PATTERN = r'(?:^|\s)(\d+)(?=\s|$)'
+
+def month_of(dates):
+
+    # Return the 'YYYY-MM' month of an Arrow 'Date' column, stored as timestamps or as the scraper's date strings.
+
+    if pa.types.is_timestamp(dates.type):
+        return pc.strftime(dates, format='%Y-%m')
+    return pc.utf8_slice_codeunits(pc.cast(dates, pa.string()), 0, 7)
+
+def sum_reactions(reactions):
+
+    # Return the total number of reactions of each 'Reactions' value: a string, e.g. '👍 3 ❤ 2 ' -> 5, or a typed
+    # list of {'Emoji', 'Count'} (see typed_columns.py), summed without parsing.
+
+    if pa.types.is_list(reactions.type):
+        return sum_reaction_counts(reactions)
+    reactions = reactions.to_pandas()
+    totals = reactions.astype(object).where(reactions.notna(), '').astype(str).str.extractall(REACTION_COUNT_PATTERN)[0]
+    totals = totals.astype(np.int64).groupby(level=0).sum()
+    return totals.reindex(range(len(reactions)), fill_value=0).to_numpy()
+
+def rollup_file(file_path, date_col='Date', group_col='Group', comments_col='Comments', batch_size=100000, base_dir=None):
+
+    # Compute the group x month totals of one Parquet file in a single grouped pass over the needed columns.
+
+    # Parameters:
+    # file_path (str): Path of the Parquet file.
+    # date_col (str): The column name containing the date data.
+    # group_col (str): The column name containing the group data.
+    # comments_col (str): The column name containing the number of comments; if the file has none (files
+    #                     straight from the scraper), the comments of 'Comments List' are counted instead.
+    # batch_size (int): Number of rows read at a time.
+    # base_dir (str): Root of the partitioned dataset, when file_path is one of its files (its group comes from its folder).
+
+    # Returns:
+    # pyarrow.Table: One row per (Group, Month) with the metrics of ROLLUP_METRICS.
+
+    names = open_dataset(file_path, base_dir).schema.names
+    comments_source = comments_col if comments_col in names else 'Comments List' if 'Comments List' in names else None
+    columns = [group_col, date_col] + [column for column in [comments_source, 'Views', 'Shares', 'Reactions'] if column and column in names]
+
+    partials = []
+    for batch in iter_dataset_batches(file_path, columns=columns, batch_size=batch_size, base_dir=base_dir):
+        partials.append(rollup_batch(batch, date_col, group_col, comments_source))
+
+    if not partials:
+        return ROLLUP_SCHEMA.empty_table().drop_columns(['Source File'])
+    return aggregate(pa.concat_tables(partials))
+
+def rollup_batch(batch, date_col='Date', group_col='Group', comments_source='Comments', comment_counts=None, months=None, sources=None):
+
+    # Compute the group x month totals of one batch of rows (see rollup_file).
+
+    # Parameters:
+    # batch (pyarrow.RecordBatch): The rows, with at least the group and date columns.
+    # date_col, group_col (str): Column names.
+    # comments_source (str): The column with the number of comments, 'Comments List' to count them, or None.
+    # comment_counts (numpy.ndarray): The comments of each row, if already counted (e.g. by pipeline_runner.py).
+    # months (pyarrow.Array): The 'YYYY-MM' month of each row, if already computed.
+    # sources (pyarrow.Array): Optional 'Source File' of each row, for batches holding the rows of several files.
+
+    # Returns:
+    # pyarrow.Table: One row per (Group, Month) of the batch with the metrics of ROLLUP_METRICS
+    #                (per ('Source File', Group, Month) with sources).
+
+    rows = batch.num_rows
+    zeros = pa.array(np.zeros(rows, dtype=np.int64))
+
+    def metric(column):
+        if column not in batch.schema.names:
+            return zeros
+        return pc.fill_null(pc.cast(batch.column(column), pa.int64()), 0)
+
+    if comment_counts is not None:
+        comments = pa.array(np.asarray(comment_counts, dtype=np.int64))
+    elif comments_source == 'Comments List':
+        comments = pa.array(count_comments(batch.column('Comments List')).astype(np.int64))
+    else:
+        comments = metric(comments_source) if comments_source else zeros
+
+    table = pa.table({
+        'Group': pc.cast(batch.column(group_col), pa.string()),
+        'Month': months if months is not None else month_of(batch.column(date_col)),
+        'Contents': pa.array(np.ones(rows, dtype=np.int64)),
+        'Comments': comments,
+        'Views': metric('Views'),
+        'Shares': metric('Shares'),
+        'Reactions': pa.array(sum_reactions(batch.column('Reactions'))) if 'Reactions' in batch.schema.names else zeros,
+    })
+    if sources is not None:
+        return aggregate(table.append_column('Source File', sources), keys=('Source File', 'Group', 'Month'))
+    return aggregate(table)
+
+def aggregate(table, keys=('Group', 'Month')):
+
+    # Sum the metrics of a rollup table by the given keys.
+
+    grouped = table.group_by(list(keys), use_threads=False).aggregate([(metric, 'sum') for metric in ROLLUP_METRICS])
+    return grouped.rename_columns([name[:-len('_sum')] if name.endswith('_sum') else name for name in grouped.column_names])
+
+def load_rollup_store(store_path):
+
+    # Return the store table and its manifest ({file path: {'size', 'mtime_ns'}}); both empty if it does not exist.
+
+    manifest = {}
+    if os.path.exists(f'{store_path}.json'):
+        with open(f'{store_path}.json', 'r', encoding='utf-8') as file:
+            manifest = json.load(file)
+    if os.path.exists(store_path):
+        return pq.read_table(store_path), manifest
+    return ROLLUP_SCHEMA.empty_table(), {}
+
+def update_rollup_store(store_path, file_paths, date_col='Date', group_col='Group', comments_col='Comments', batch_size=100000):
+
+    # Add the group x month totals of new or rewritten Parquet files to the rollup store.
+
+    # Parameters:
+    # store_path (str): Path of the rollup store (a Parquet file; created if missing).
+    # file_paths (list of str): Parquet files to roll up, e.g. the newly combined files of each run, or partitioned
+    #                           dataset folders (each of their files is tracked on its own).
+    # date_col, group_col, comments_col (str): Column names, as in create_group_month_summary.
+    # batch_size (int): Number of rows read at a time.
+
+    # Returns:
+    # int: The number of files rolled up by this update (unchanged files are skipped).
+
+    # Example:
+    # update_rollup_store('rollup.parquet', [os.path.join(folder_path, 'unified_data_telegram.parquet')])
+
+    _, manifest = load_rollup_store(store_path)
+    rollups = {}
+    sources = [(file, path if os.path.isdir(path) else None) for path in file_paths for file in dataset_files(path)]
+    for file_path, base_dir in tqdm(sources, desc="Rolling up files"):
+        if not rollup_needed(manifest, file_path):
+            continue
+        rollups[file_path] = rollup_file(file_path, date_col, group_col, comments_col, batch_size, base_dir)
+
+    save_rollups(store_path, rollups)
+    return len(rollups)
+
+def rollup_needed(manifest, file_path):
+
+    # Returns True if a file is new or was rewritten since the store rolled it up (by size and modification time).
+
+    stat = os.stat(file_path)
+    entry = manifest.get(os.path.abspath(file_path))
+    return not (entry and entry['size'] == stat.st_size and entry['mtime_ns'] == stat.st_mtime_ns)
+
+def save_rollups(store_path, rollups):
+
+    # Add the group x month totals of files to the rollup store; the totals of rewritten files replace the old ones.
+
+    # Parameters:
+    # store_path (str): Path of the rollup store (created if missing).
+    # rollups (dict): {file path: rollup table (see rollup_file)}.
+
+    if not rollups:
+        return
+    store, manifest = load_rollup_store(store_path)
+    updated = []
+    partials = []
+    for file_path, rollup in rollups.items():
+        key = os.path.abspath(file_path)
+        stat = os.stat(file_path)
+        partials.append(rollup.add_column(0, 'Source File', pa.array([key] * rollup.num_rows, type=pa.string())).select(ROLLUP_SCHEMA.names).cast(ROLLUP_SCHEMA))
+        manifest[key] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+        updated.append(key)
+
+    # Rewritten files replace their previous totals
+    keep = pc.invert(pc.is_in(store.column('Source File'), value_set=pa.array(updated, type=pa.string())))
+    store = pa.concat_tables([store.filter(keep).cast(ROLLUP_SCHEMA)] + partials)
+    store = store.sort_by([('Group', 'ascending'), ('Month', 'ascending'), ('Source File', 'ascending')])
+
+    pq.write_table(store, f'{store_path}.tmp')
+    os.replace(f'{store_path}.tmp', store_path)
+    with open(f'{store_path}.json.tmp', 'w', encoding='utf-8') as file:
+        json.dump(manifest, file, indent=2, ensure_ascii=False)
+    os.replace(f'{store_path}.json.tmp', f'{store_path}.json')
+
+def pivot_rollup(store, metric, groups=None, date_min=None, date_max=None):
+
+    # Pivot one metric of the store into a Group x month table, with every month from the first to the last.
+
+    # Parameters:
+    # store (pyarrow.Table): The rollup store.
+    # metric (str): One of ROLLUP_METRICS, or 'Total' (contents + comments).
+    # groups (list of str): Only report these groups (default: all).
+    # date_min, date_max (datetime or str): Only report the months of this period.
+
+    # Returns:
+    # DataFrame: One row per group, one column per month ('YYYY-MM').
+
+    df = aggregate(store.drop_columns(['Source File'])).to_pandas()
+    if groups is not None:
+        df = df[df['Group'].isin(groups)]
+    if date_min is not None:
+        df = df[df['Month'] >= as_utc(date_min).strftime('%Y-%m')]
+    if date_max is not None:
+        df = df[df['Month'] <= as_utc(date_max).strftime('%Y-%m')]
+    df['Total'] = df['Contents'] + df['Comments']
+    table = df.pivot(index='Group', columns='Month', values=metric).fillna(0).astype(np.int64)
+    table.index.name = 'Group'
+
+    months = pd.PeriodIndex(table.columns, freq='M')
+    if len(months):
+        all_months = pd.period_range(start=months.min(), end=months.max(), freq='M')
+        table.columns = months
+        table = table.reindex(columns=all_months, fill_value=0)
+        table.columns = table.columns.astype(str)
+    table.columns.name = 'MonthYear'
+    return table
+
+def render_rollup_reports(store_path, folder_path, output_filename_base, metrics=('Contents', 'Comments', 'Total'),
+                          file_format='xlsx', groups=None, date_min=None, date_max=None):
+
+    # Write the Group x month reports of the rollup store, one file per metric.
+
+    # Parameters:
+    # store_path (str): Path of the rollup store.
+    # folder_path (str): Folder of the reports.
+    # output_filename_base (str): Base name of the reports: '{base}_contents.xlsx', '{base}_comments.xlsx', ...
+    # metrics (tuple of str): Metrics to report (ROLLUP_METRICS and 'Total').
+    # file_format (str): 'xlsx' or 'csv'.
+    # groups (list of str): Only report these groups (default: all).
+    # date_min, date_max (datetime or str): Only report the months of this period.
+
+    # Returns:
+    # list of str: The paths of the reports.
+
+    store, _ = load_rollup_store(store_path)
+    output_paths = []
+    for metric in metrics:
+        table = pivot_rollup(store, metric, groups, date_min, date_max)
+        output_path = os.path.join(folder_path, f"{output_filename_base}_{metric.lower()}.{file_format}")
+        if file_format == 'csv':
+            table.to_csv(output_path, index=True)
+        else:
+            table.to_excel(output_path, index=True)
+        print(f"{metric} summary table saved as: {output_path}")
+        output_paths.append(output_path)
+    return output_paths
@@ -0,0 +1,373 @@
+import os
+import re
+import json
+import shutil
+import uuid
+from bisect import bisect_left
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from tqdm import tqdm
+from keyword_matcher import normalize_text
+
+# Build-once, on-disk inverted index over the text of scraped Parquet files.
+#
+# The index is made of documents: the distinct texts of the indexed columns of a row, identified by a 64-bit hash
+# of these texts. For every indexed column the index maps each token (lowercase, without accents) to the sorted list
+# of the documents that contain it, and each indexed file maps its rows to their documents. Posting lists are stored
+# as flat numpy arrays (memory-mapped when queried), split in segments: updates only add segments, they never
+# rewrite the existing ones.
+#
+# Since documents are keyed by their content and not by their position in a file, rewriting a file (e.g. combining
+# new parts into 'unified_data_telegram.parquet', which also sorts it again) only tokenizes the messages that are
+# new or whose text changed; the other rows are mapped to their existing documents with a hash lookup. Identical
+# texts (forwards) are indexed once. Documents no longer used by any file are dropped by rebuilding the index when
+# they are more than half of it.
+#
+# A query returns candidate rows, a superset of the rows that contain the keywords (a keyword is looked up through
+# every indexed token that contains it, so 'Trump' also finds '#TrumpWins'). Candidates must still be checked with
+# the real matcher; filter_and_save_by_keywords does that on the few rows it reads back from Parquet.
+#
+# Layout of the index folder:
+#   index.json                                 version, columns, number of documents, segments, indexed files
+#   documents.npy                              hash (uint64) of each document
+#   files/<id>.npy                             document (uint32) of each row of an indexed file
+#   segments/<id>/<column>.tokens.arrow        sorted tokens of the segment (Arrow IPC file, memory-mapped)
+#   segments/<id>/<column>.offsets.npy         start of the postings of each token (len(tokens) + 1 values)
+#   segments/<id>/<column>.postings.npy        documents (uint32) of all tokens
+
+INDEX_VERSION = 3
+
+TOKEN_PATTERN = re.compile(r'\w+')
+
+def tokenize(text):
+
+    # Split a text into normalized tokens (casefolded, accents removed).
+
+    # Parameters:
+    # text (str): The text to tokenize.
+
+    # Returns:
+    # set of str: The distinct tokens of the text.
+
+    return set(TOKEN_PATTERN.findall(normalize_text(text, case_insensitive=True, fold_accents=True)))
+
+def comment_texts(value):
+
+    # Return the texts of a 'Comments List' value (JSON string or nested list), joined by new lines.
+
+    if isinstance(value, str):
+        value = json.loads(value)
+    if value is None or isinstance(value, float):
+        return ''
+    return '\n'.join(str(comment.get('Comment Content') or '') for comment in value)
+
+def empty_index_meta(columns=None):
+    return {'version': INDEX_VERSION, 'columns': columns, 'num_documents': 0, 'segments': [], 'files': {}}
+
+def load_index_meta(index_folder):
+    meta_path = os.path.join(index_folder, 'index.json')
+    if os.path.exists(meta_path):
+        with open(meta_path, 'r', encoding='utf-8') as file:
+            return json.load(file)
+    return empty_index_meta()
+
+def save_index_meta(index_folder, meta):
+    meta_path = os.path.join(index_folder, 'index.json')
+    with open(f'{meta_path}.tmp', 'w', encoding='utf-8') as file:
+        json.dump(meta, file, indent=2, ensure_ascii=False)
+    os.replace(f'{meta_path}.tmp', meta_path)
+
+def reset_index(index_folder, columns):
+
+    # Delete the documents, segments and file maps of an index and return the metadata of an empty index.
+
+    for folder in ('segments', 'files'):
+        shutil.rmtree(os.path.join(index_folder, folder), ignore_errors=True)
+    if os.path.exists(os.path.join(index_folder, 'documents.npy')):
+        os.remove(os.path.join(index_folder, 'documents.npy'))
+    meta = empty_index_meta(columns)
+    save_index_meta(index_folder, meta)
+    return meta
+
+def remove_unreferenced(index_folder, meta):
+
+    # Remove the segments and file maps written by an update that was interrupted before saving the metadata.
+
+    referenced = {'segments': {segment['id'] for segment in meta['segments']},
+                  'files': {f"{entry['documents']}.npy" for entry in meta['files'].values()}}
+    for folder, names in referenced.items():
+        for name in os.listdir(os.path.join(index_folder, folder)):
+            if name not in names:
+                path = os.path.join(index_folder, folder, name)
+                shutil.rmtree(path) if os.path.isdir(path) else os.remove(path)
+
+def load_documents(index_folder, meta):
+    documents_path = os.path.join(index_folder, 'documents.npy')
+    if not os.path.exists(documents_path):
+        return np.empty(0, dtype=np.uint64)
+    return np.load(documents_path)[:meta['num_documents']]
+
+def document_keys(batch, columns):
+
+    # Hash the indexed texts of each row of a batch into one 64-bit key per row (the key of its document).
+
+    # Parameters:
+    # batch (pyarrow.RecordBatch): Rows of an indexed file.
+    # columns (list of str): Indexed columns; the ones missing from the batch count as empty.
+
+    # Returns:
+    # numpy.ndarray: uint64 keys, one per row.
+
+    keys = np.zeros(batch.num_rows, dtype=np.uint64)
+    for column in columns:
+        if column in batch.schema.names:
+            values = batch.column(column)
+            if column == 'Comments List':
+                texts = np.array([comment_texts(value) for value in values.to_pylist()], dtype=object)
+            elif pa.types.is_string(values.type) or pa.types.is_large_string(values.type):
+                texts = values.to_numpy(zero_copy_only=False)
+            else:
+                texts = np.array([str(value) for value in values.to_pylist()], dtype=object)
+            column_keys = pd.util.hash_array(texts)
+        else:
+            column_keys = np.zeros(batch.num_rows, dtype=np.uint64)
+        keys = keys * np.uint64(1000003) + column_keys
+    return keys
+
+def write_segment(segment_folder, column, postings):
+
+    # Write the postings of one column of a segment ({token: [document, ...]}, documents in increasing order).
+
+    tokens = sorted(postings)
+    lengths = np.fromiter((len(postings[token]) for token in tokens), dtype=np.int64, count=len(tokens))
+    offsets = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+    flat = np.fromiter((document for token in tokens for document in postings[token]), dtype=np.uint32, count=int(offsets[-1]))
+
+    tokens_table = pa.table({'token': pa.array(tokens, pa.string())})
+    with pa.OSFile(os.path.join(segment_folder, f'{column}.tokens.arrow'), 'wb') as sink:
+        with pa.ipc.new_file(sink, tokens_table.schema) as writer:
+            writer.write_table(tokens_table)
+    np.save(os.path.join(segment_folder, f'{column}.offsets.npy'), offsets)
+    np.save(os.path.join(segment_folder, f'{column}.postings.npy'), flat)
+
+def update_keyword_index(index_folder, file_paths, columns=('Content',), segment_rows=2000000, batch_size=100000):
+
+    # Index the Parquet files that are new or changed since the last update; unchanged files are not read again.
+    # A changed file is hashed row by row, but only its rows with a text that is not in the index yet are tokenized,
+    # so indexing the unified file again after a combine costs about the number of new messages.
+
+    # Parameters:
+    # index_folder (str): Folder of the index (created if missing).
+    # file_paths (list of str): Parquet files to index, e.g. the unified file or the files of a combined folder.
+    # columns (tuple of str): Text columns to index; 'Comments List' indexes the text of the comments.
+    # segment_rows (int): Maximum number of documents per segment (bounds the memory used while indexing).
+    # batch_size (int): Number of rows read at a time.
+
+    # Returns:
+    # int: The number of new documents (distinct texts) indexed by this update.
+
+    # Example:
+    # update_keyword_index('keyword_index', [os.path.join(folder_path, 'unified_data_telegram.parquet')])
+
+    os.makedirs(index_folder, exist_ok=True)
+    meta = load_index_meta(index_folder)
+    columns = list(columns)
+    if meta.get('version') != INDEX_VERSION or meta['columns'] not in (None, columns):
+        # Other columns were indexed before, or the index has an older layout: start over
+        meta = reset_index(index_folder, columns)
+    meta['columns'] = columns
+    for folder in ('segments', 'files'):
+        os.makedirs(os.path.join(index_folder, folder), exist_ok=True)
+    remove_unreferenced(index_folder, meta)
+
+    documents = load_documents(index_folder, meta)
+    order = np.argsort(documents, kind='stable')
+    sorted_documents = documents[order]
+
+    indexed_documents = 0
+    for file_path in file_paths:
+        key = os.path.abspath(file_path)
+        stat = os.stat(file_path)
+        entry = meta['files'].get(key)
+        if entry and entry['size'] == stat.st_size and entry['mtime_ns'] == stat.st_mtime_ns:
+            continue
+
+        # First pass: hash the texts of every row and look the hashes up in the index
+        parquet_file = pq.ParquetFile(file_path)
+        available = [column for column in columns if column in parquet_file.schema_arrow.names]
+        batches = parquet_file.iter_batches(batch_size=batch_size, columns=available)
+        keys = [document_keys(batch, columns) for batch in tqdm(batches, desc=f"Hashing {os.path.basename(file_path)}")]
+        keys = np.concatenate(keys) if keys else np.empty(0, dtype=np.uint64)
+
+        positions = np.minimum(np.searchsorted(sorted_documents, keys), max(len(sorted_documents) - 1, 0))
+        known = sorted_documents[positions] == keys if len(sorted_documents) else np.zeros(len(keys), dtype=bool)
+        row_documents = np.empty(len(keys), dtype=np.uint32)
+        row_documents[known] = order[positions[known]]
+
+        # New texts become new documents, numbered in the order of their first row
+        new_keys, first_rows, inverse = np.unique(keys[~known], return_index=True, return_inverse=True)
+        appearance = np.argsort(first_rows)
+        new_documents = np.empty(len(new_keys), dtype=np.uint32)
+        new_documents[appearance] = meta['num_documents'] + np.arange(len(new_keys))
+        row_documents[~known] = new_documents[inverse]
+        new_rows = np.flatnonzero(~known)[first_rows[appearance]]
+
+        # Second pass: tokenize only the first row of each new document
+        postings = {column: {} for column in columns}
+        document = segment_start = meta['num_documents']
+        row = 0
+
+        def flush_segment(end_document):
+            segment_id = uuid.uuid4().hex
+            segment_folder = os.path.join(index_folder, 'segments', segment_id)
+            os.makedirs(segment_folder)
+            for column in columns:
+                write_segment(segment_folder, column, postings[column])
+                postings[column] = {}
+            meta['segments'].append({'id': segment_id, 'start_document': segment_start, 'end_document': end_document})
+
+        if len(new_rows):
+            batches = parquet_file.iter_batches(batch_size=batch_size, columns=available)
+            for batch in tqdm(batches, desc=f"Indexing {os.path.basename(file_path)}"):
+                batch_rows = new_rows[np.searchsorted(new_rows, row):np.searchsorted(new_rows, row + batch.num_rows)]
+                batch, row = batch.take(pa.array(batch_rows - row)), row + batch.num_rows
+                for column in available:
+                    column_postings = postings[column]
+                    for offset, value in enumerate(batch.column(column).to_pylist()):
+                        # Missing contents are indexed as 'None', the text the filter sees after str()
+                        text = comment_texts(value) if column == 'Comments List' else str(value)
+                        for token in tokenize(text):
+                            column_postings.setdefault(token, []).append(document + offset)
+                document += batch.num_rows
+                if document - segment_start >= segment_rows:
+                    flush_segment(document)
+                    segment_start = document
+            if document > segment_start:
+                flush_segment(document)
+
+        # Save the documents before the metadata that counts them, then the map of the rows of the file
+        documents = np.concatenate([documents, new_keys[appearance]])
+        np.save(os.path.join(index_folder, 'documents.npy'), documents)
+        order = np.argsort(documents, kind='stable')
+        sorted_documents = documents[order]
+
+        file_id = uuid.uuid4().hex
+        np.save(os.path.join(index_folder, 'files', f'{file_id}.npy'), row_documents)
+        meta['num_documents'] = len(documents)
+        meta['files'][key] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'num_rows': len(keys), 'documents': file_id}
+        save_index_meta(index_folder, meta)
+        if entry:
+            os.remove(os.path.join(index_folder, 'files', f"{entry['documents']}.npy"))
+        indexed_documents += len(new_keys)
+
+    if indexed_documents:
+        # Rewritten files leave documents that no row uses anymore: rebuild the index once they are the majority
+        used = [np.load(os.path.join(index_folder, 'files', f"{entry['documents']}.npy")) for entry in meta['files'].values()]
+        used_documents = len(np.unique(np.concatenate(used))) if used else 0
+        if used_documents < meta['num_documents'] / 2:
+            print(f"Rebuilding the keyword index: {meta['num_documents'] - used_documents} of {meta['num_documents']} documents are not used anymore")
+            indexed_paths = [path for path in meta['files'] if os.path.exists(path)]
+            reset_index(index_folder, columns)
+            return update_keyword_index(index_folder, indexed_paths, columns, segment_rows, batch_size)
+
+    return indexed_documents
+
+def load_segment(index_folder, segment_id, column):
+    segment_folder = os.path.join(index_folder, 'segments', segment_id)
+    with pa.memory_map(os.path.join(segment_folder, f'{column}.tokens.arrow')) as source:
+        tokens = pa.ipc.open_file(source).read_all().column('token').combine_chunks()
+    offsets = np.load(os.path.join(segment_folder, f'{column}.offsets.npy'), mmap_mode='r')
+    postings = np.load(os.path.join(segment_folder, f'{column}.postings.npy'), mmap_mode='r')
+    return tokens, offsets, postings
+
+def segment_documents_for_token(tokens, offsets, postings, query_token, exact=False):
+
+    # Documents of a segment containing a token equal to (exact) or containing (default) the query token.
+    # Exact tokens are found by bisection of the sorted tokens, substrings by a vectorised scan of the tokens.
+
+    if exact:
+        position = bisect_left(tokens, query_token, key=lambda token: token.as_py())
+        matches = np.array([position] if position < len(tokens) and tokens[position].as_py() == query_token else [], dtype=np.int64)
+    else:
+        matches = np.flatnonzero(pc.match_substring(tokens, query_token).to_numpy(zero_copy_only=False))
+    if not len(matches):
+        return np.empty(0, dtype=np.uint32)
+
+    # Gather the postings of all matching tokens at once
+    starts = np.asarray(offsets[matches])
+    lengths = np.asarray(offsets[matches + 1]) - starts
+    positions = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+    return np.unique(postings[positions])
+
+def query_keyword_index(index_folder, keywords, column='Content', file_path=None, exact_tokens=False):
+
+    # Find the candidate rows of the keywords: every row containing at least one keyword is returned.
+
+    # Parameters:
+    # index_folder (str): Folder of the index.
+    # keywords (list of str): The keywords.
+    # column (str): The indexed column to search.
+    # file_path (str): Only search this file (default: every indexed file).
+    # exact_tokens (bool): Look up the keyword tokens exactly (for whole-word queries) instead of as substrings.
+
+    # Returns:
+    # dict: {file path: sorted numpy array of row numbers}. If a keyword has no word characters (e.g. '!!'),
+    # the index cannot help and every row of the file is a candidate.
+
+    meta = load_index_meta(index_folder)
+    keyword_tokens = [TOKEN_PATTERN.findall(normalize_text(keyword, case_insensitive=True, fold_accents=True)) for keyword in keywords]
+    files = meta['files'] if file_path is None else {os.path.abspath(file_path): meta['files'][os.path.abspath(file_path)]}
+    if any(not tokens for tokens in keyword_tokens):
+        return {key: np.arange(entry['num_rows']) for key, entry in files.items()}
+
+    # Documents containing at least one keyword
+    matches = []
+    for segment in meta['segments']:
+        tokens, offsets, postings = load_segment(index_folder, segment['id'], column)
+        for query_tokens in keyword_tokens:
+            keyword_documents = None
+            for query_token in query_tokens:
+                token_documents = segment_documents_for_token(tokens, offsets, postings, query_token, exact_tokens)
+                keyword_documents = token_documents if keyword_documents is None else np.intersect1d(keyword_documents, token_documents, assume_unique=True)
+                if not len(keyword_documents):
+                    break
+            matches.append(keyword_documents)
+    matches = np.unique(np.concatenate(matches)) if matches else np.empty(0, dtype=np.uint32)
+
+    # Rows of each file whose document matches
+    candidates = {}
+    for key, entry in files.items():
+        row_documents = np.load(os.path.join(index_folder, 'files', f"{entry['documents']}.npy"), mmap_mode='r')
+        candidates[key] = np.flatnonzero(np.isin(row_documents, matches)).astype(np.int64)
+    return candidates
+
+def read_rows(file_path, rows, columns=None):
+
+    # Read only the given rows of a Parquet file, touching only the row groups that contain them.
+
+    # Parameters:
+    # file_path (str): Path of the Parquet file.
+    # rows (numpy.ndarray): Sorted row numbers.
+    # columns (list of str): Columns to read (default: all).
+
+    # Returns:
+    # DataFrame: The rows, in file order.
+
+    parquet_file = pq.ParquetFile(file_path)
+    if not len(rows):
+        empty_table = parquet_file.schema_arrow.empty_table()
+        return (empty_table.select(columns) if columns else empty_table).to_pandas()
+
+    group_starts = np.cumsum([0] + [parquet_file.metadata.row_group(group).num_rows for group in range(parquet_file.num_row_groups)])
+    groups = np.unique(np.searchsorted(group_starts, rows, side='right') - 1)
+    table = parquet_file.read_row_groups(groups.tolist(), columns=columns)
+
+    # Row numbers relative to the concatenation of the selected row groups
+    selected_starts = group_starts[groups]
+    selected_offsets = np.concatenate([[0], np.cumsum(group_starts[groups + 1] - selected_starts)])[:-1]
+    group_of_row = np.searchsorted(selected_starts, rows, side='right') - 1
+    local_rows = selected_offsets[group_of_row] + (rows - selected_starts[group_of_row])
+    return table.take(local_rows).to_pandas()
@@ -0,0 +1,200 @@
+import os
+import unicodedata
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+
+try:
+    import ahocorasick  # Optional: pip install pyahocorasick (C implementation, much faster)
+except ImportError:
+    ahocorasick = None
+
+# URLs, removed from the texts before sampling and before comparing messages for near duplicates
+URL_PATTERN = r'http\S+|www\S+'
+
+def normalize_text(text, case_insensitive=False, fold_accents=False):
+
+    # Normalize a text before matching.
+
+    # Parameters:
+    # text (str): The text to normalize.
+    # case_insensitive (bool): Lowercase the text (str.casefold), so 'Lula' matches 'LULA'.
+    # fold_accents (bool): Remove accents, so 'eleicao' matches 'eleição'.
+
+    # Returns:
+    # str: The normalized text.
+
+    if fold_accents:
+        text = ''.join(char for char in unicodedata.normalize('NFKD', text) if not unicodedata.combining(char))
+    if case_insensitive:
+        text = text.casefold()
+    return text
+
+def is_word_char(char):
+    return char.isalnum() or char == '_'
+
+class KeywordMatcher:
+
+    # Aho-Corasick automaton that finds every keyword of a list in a single scan of each text.
+
+    # Matching a list of keywords costs one pass over the text, whatever the number of keywords, instead of one
+    # 'keyword in text' per keyword. The C implementation of pyahocorasick is used when it is installed; otherwise
+    # a pure Python automaton is used.
+
+    # Parameters:
+    # keywords (list of str): The keywords to find.
+    # case_insensitive (bool): Ignore case.
+    # fold_accents (bool): Ignore accents (useful for Portuguese content).
+    # whole_words (bool): Only match keywords delimited by non-word characters ('ato' does not match 'contato').
+
+    # Example:
+    # matcher = KeywordMatcher(['Trump', 'Biden', 'Kamala'], case_insensitive=True)
+    # matcher.match('trump and biden')  ->  [0, 1]
+
+    def __init__(self, keywords, case_insensitive=False, fold_accents=False, whole_words=False):
+        self.keywords = list(keywords)
+        self.case_insensitive = case_insensitive
+        self.fold_accents = fold_accents
+        self.whole_words = whole_words
+        self.patterns = [normalize_text(keyword, case_insensitive, fold_accents) for keyword in self.keywords]
+
+        # An empty keyword is found in every text, like '' in text
+        self.always = [index for index, pattern in enumerate(self.patterns) if not pattern]
+
+        if ahocorasick is not None:
+            self.automaton = ahocorasick.Automaton()
+            for index, pattern in enumerate(self.patterns):
+                if pattern:
+                    indexes = self.automaton.get(pattern, (pattern, []))[1]
+                    self.automaton.add_word(pattern, (pattern, indexes + [index]))
+            if len(self.automaton):
+                self.automaton.make_automaton()
+            else:
+                self.automaton = None
+        else:
+            self.automaton = None
+            self.build()
+
+    def build(self):
+
+        # Builds the pure Python automaton: a trie of the patterns plus failure links (breadth-first).
+
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [[]]
+        for index, pattern in enumerate(self.patterns):
+            if not pattern:
+                continue
+            state = 0
+            for char in pattern:
+                next_state = self.goto[state].get(char)
+                if next_state is None:
+                    next_state = len(self.goto)
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append([])
+                    self.goto[state][char] = next_state
+                state = next_state
+            self.output[state].append(index)
+
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self.goto[state].items():
+                queue.append(next_state)
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[next_state] = self.goto[fallback].get(char, 0)
+                self.output[next_state] = self.output[next_state] + self.output[self.fail[next_state]]
+
+    def iter_matches(self, text):
+
+        # Yields (keyword index, end position) for every occurrence of every keyword in a normalized text.
+
+        if self.automaton is not None:
+            for end, (pattern, indexes) in self.automaton.iter(text):
+                for index in indexes:
+                    yield index, end
+            return
+        if not hasattr(self, 'goto'):
+            return
+
+        goto, fail, output = self.goto, self.fail, self.output
+        state = 0
+        for position, char in enumerate(text):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            for index in output[state]:
+                yield index, position
+
+    def match(self, text):
+
+        # Returns the sorted indexes of the keywords found in a text.
+
+        text = normalize_text(text, self.case_insensitive, self.fold_accents)
+        found = set(self.always)
+        for index, end in self.iter_matches(text):
+            if index in found:
+                continue
+            if self.whole_words:
+                start = end - len(self.patterns[index]) + 1
+                if start > 0 and is_word_char(text[start - 1]):
+                    continue
+                if end + 1 < len(text) and is_word_char(text[end + 1]):
+                    continue
+            found.add(index)
+        return sorted(found)
+
+    def match_many(self, texts):
+
+        # Returns a (len(texts) x len(keywords)) uint8 matrix with 1 where a keyword was found in a text.
+
+        hits = np.zeros((len(texts), len(self.keywords)), dtype=np.uint8)
+        for row, text in enumerate(texts):
+            indexes = self.match(text)
+            if indexes:
+                hits[row, indexes] = 1
+        return hits
+
+# Matcher of each worker process, built once by the pool initializer
+worker_matcher = None
+
+def init_worker(keywords, case_insensitive, fold_accents, whole_words):
+    global worker_matcher
+    worker_matcher = KeywordMatcher(keywords, case_insensitive, fold_accents, whole_words)
+
+def match_chunk(texts):
+    return worker_matcher.match_many(texts)
+
+def match_keywords(texts, keywords, case_insensitive=False, fold_accents=False, whole_words=False,
+                   workers=None, chunk_size=50000):
+
+    # Find all keywords in a column of texts, in a single pass per text, in parallel over chunks of rows.
+
+    # Parameters:
+    # texts (Series): The texts (each value is converted with str(), like astype(str) in the original filter).
+    # keywords (list of str): The keywords to find.
+    # case_insensitive (bool): Ignore case.
+    # fold_accents (bool): Ignore accents.
+    # whole_words (bool): Only match whole words.
+    # workers (int): Number of worker processes (default: number of CPUs); 1 matches in the current process.
+    # chunk_size (int): Number of rows sent to a worker at a time.
+
+    # Returns:
+    # DataFrame: One 0/1 indicator column per keyword, with the same index as 'texts'.
+
+    values = [str(text) for text in texts.tolist()]
+    workers = workers or os.cpu_count() or 1
+    matcher_args = (keywords, case_insensitive, fold_accents, whole_words)
+
+    if workers == 1 or len(values) <= chunk_size:
+        hits = KeywordMatcher(*matcher_args).match_many(values)
+    else:
+        chunks = [values[start:start + chunk_size] for start in range(0, len(values), chunk_size)]
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=matcher_args) as executor:
+            hits = np.vstack(list(executor.map(match_chunk, chunks)))
+
+    return pd.DataFrame(hits.astype(np.int64), index=texts.index, columns=keywords)
@@ -0,0 +1,336 @@
+import os
+import re
+import shutil
+import tempfile
+import zlib
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from tqdm import tqdm
+from keyword_index import TOKEN_PATTERN
+from keyword_matcher import URL_PATTERN, normalize_text
+
+# Near-duplicate detection (forwards, reposts, copies with small edits) with MinHash and locality-sensitive hashing.
+#
+# Each 'Content' is normalized (casefolded, accents and URLs removed) and cut into shingles of 'shingle_size'
+# consecutive words. A MinHash signature of 'num_perm' values summarizes the set of shingles: two texts agree on
+# a signature value with a probability equal to the Jaccard similarity of their shingles. Signatures are computed
+# in parallel batches and kept in a memory-mapped file, so the corpus never has to fit in memory.
+#
+# Instead of comparing every pair of messages, the signature is cut into 'bands': messages with an identical band
+# land in the same bucket and become candidates. Candidates whose signatures agree on at least 'threshold' of
+# their values are linked, and the connected components of the links are the clusters. Each cluster's canonical
+# message is its oldest one (the original post, the others being forwards or reposts).
+#
+# Columns added by add_near_duplicate_columns:
+#   'Cluster ID'    row number (in the file) of the canonical message of the cluster
+#   'Cluster Size'  number of messages of the cluster (1 for unique messages)
+#   'Canonical'     True for the canonical message of each cluster (and for every unique message)
+
+CLUSTER_COLUMNS = ['Cluster ID', 'Cluster Size', 'Canonical']
+
+MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+MAX_HASH = np.uint64(0xFFFFFFFF)
+SHINGLE_MULTIPLIER = np.uint64(1000003)
+
+URL_REGEX = re.compile(URL_PATTERN)
+
+def content_tokens(text):
+
+    # Normalized words of a message: casefolded, without accents and URLs.
+
+    if not isinstance(text, str):
+        return []
+    return TOKEN_PATTERN.findall(normalize_text(URL_REGEX.sub(' ', text), case_insensitive=True, fold_accents=True))
+
+def hash_permutations(num_perm, seed=0):
+
+    # Parameters (a, b) of the 'num_perm' hash functions (a * x + b) mod p used as permutations.
+
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, int(MERSENNE_PRIME), num_perm, dtype=np.uint64)
+    b = rng.integers(0, int(MERSENNE_PRIME), num_perm, dtype=np.uint64)
+    return a, b
+
+def minhash_signatures(texts, num_perm=64, shingle_size=3, min_tokens=5, seed=0, chunk_shingles=50000):
+
+    # Compute the MinHash signatures of a batch of texts.
+
+    # Parameters:
+    # texts (list of str): The texts (None and non-strings have no tokens).
+    # num_perm (int): Number of hash functions (values per signature).
+    # shingle_size (int): Number of consecutive words per shingle.
+    # min_tokens (int): Texts with fewer words are too short to be compared and get no signature.
+    # seed (int): Seed of the hash functions (every batch of a run must use the same one).
+    # chunk_shingles (int): Number of shingles hashed at a time (bounds the memory used).
+
+    # Returns:
+    # tuple: (signatures, valid): a (len(texts), num_perm) uint32 array and a bool array that is False for the
+    # texts without a signature.
+
+    a, b = hash_permutations(num_perm, seed)
+    token_hashes = {}
+    hashes = []
+    lengths = np.zeros(len(texts), dtype=np.int64)
+    for index, text in enumerate(texts):
+        tokens = content_tokens(text)
+        if len(tokens) < min_tokens:
+            continue
+        for token in tokens:
+            if token not in token_hashes:
+                token_hashes[token] = zlib.crc32(token.encode('utf-8'))
+        hashes.append(np.fromiter((token_hashes[token] for token in tokens), dtype=np.uint64, count=len(tokens)))
+        lengths[index] = len(tokens)
+
+    signatures = np.full((len(texts), num_perm), MAX_HASH, dtype=np.uint32)
+    valid = lengths > 0
+    if not valid.any():
+        return signatures, valid
+
+    # Shingle hashes, computed for every text at once: a shingle starts at each word that has
+    # 'shingle_size' - 1 words after it in the same text
+    tokens = np.concatenate(hashes)
+    ends = np.cumsum(lengths[valid])
+    starts = ends - lengths[valid]
+    shingles_per_text = np.maximum(lengths[valid] - shingle_size + 1, 1)
+    shingle_offsets = np.concatenate([[0], np.cumsum(shingles_per_text)])
+    first_shingle = np.repeat(starts - shingle_offsets[:-1], shingles_per_text) + np.arange(shingle_offsets[-1])
+    shingle_ends = np.repeat(ends, shingles_per_text)
+    shingles = tokens[first_shingle].copy()
+    for offset in range(1, shingle_size):
+        position = first_shingle + offset
+        inside = position < shingle_ends
+        shingles[inside] = shingles[inside] * SHINGLE_MULTIPLIER + tokens[position[inside]]
+    shingles &= MAX_HASH
+
+    # Minimum of each hash function over the shingles of each text, a chunk of texts at a time
+    valid_rows = np.flatnonzero(valid)
+    text = 0
+    while text < len(valid_rows):
+        last = max(text + 1, int(np.searchsorted(shingle_offsets, shingle_offsets[text] + chunk_shingles, side='right')) - 1)
+        last = min(last, len(valid_rows))
+        chunk = shingles[shingle_offsets[text]:shingle_offsets[last]]
+        permuted = ((chunk[:, None] * a + b) % MERSENNE_PRIME) & MAX_HASH
+        minimums = np.minimum.reduceat(permuted, shingle_offsets[text:last] - shingle_offsets[text], axis=0)
+        signatures[valid_rows[text:last]] = minimums.astype(np.uint32)
+        text = last
+    return signatures, valid
+
+def signature_batch(arguments):
+    texts, num_perm, shingle_size, min_tokens, seed = arguments
+    return minhash_signatures(texts, num_perm, shingle_size, min_tokens, seed)
+
+def connected_components(num_rows, sources, targets):
+
+    # Label the connected components of a graph given by its edges (smallest row of each component as label).
+
+    labels = np.arange(num_rows, dtype=np.int64)
+    if not len(sources):
+        return labels
+    while True:
+        smallest = np.minimum(labels[sources], labels[targets])
+        updated = labels.copy()
+        np.minimum.at(updated, sources, smallest)
+        np.minimum.at(updated, targets, smallest)
+        # Pointer jumping: follow the labels until they point to themselves
+        while True:
+            jumped = updated[updated]
+            if np.array_equal(jumped, updated):
+                break
+            updated = jumped
+        if np.array_equal(updated, labels):
+            return labels
+        labels = updated
+
+def find_near_duplicates(file_path, text_column='Content', date_column='Date', num_perm=64, bands=16, threshold=0.8,
+                         shingle_size=3, min_tokens=5, batch_size=100000, workers=None, seed=0, temp_folder=None):
+
+    # Cluster the near-identical messages of a Parquet file.
+
+    # Parameters:
+    # file_path (str): The Parquet file (e.g. 'unified_data_telegram.parquet').
+    # text_column (str): The column compared.
+    # date_column (str): The column used to choose the canonical (oldest) message of each cluster.
+    # num_perm (int): Number of MinHash values per message (more values: more precise, slower).
+    # bands (int): Number of LSH bands (num_perm must be a multiple of it). With r = num_perm / bands values per
+    #              band, messages with a similarity s become candidates with a probability 1 - (1 - s^r)^bands:
+    #              64 values in 16 bands of 4 make almost every pair above 0.7 a candidate; 'threshold' then
+    #              removes the candidates that are not similar enough.
+    # threshold (float): Minimum estimated Jaccard similarity of the shingles of two linked messages.
+    # shingle_size (int): Number of consecutive words per shingle.
+    # min_tokens (int): Messages with fewer words (e.g. 'Amém', 'Bom dia!') are never clustered.
+    # batch_size (int): Number of rows read and hashed at a time.
+    # workers (int): Number of processes computing signatures (default: number of CPUs).
+    # seed (int): Seed of the hash functions.
+    # temp_folder (str): Folder of the memory-mapped signatures (num_perm * 4 bytes per row; default: system temp folder).
+
+    # Returns:
+    # DataFrame: 'Cluster ID', 'Cluster Size' and 'Canonical' for every row of the file, in file order.
+
+    if num_perm % bands:
+        raise ValueError(f'num_perm ({num_perm}) must be a multiple of bands ({bands})')
+    parquet_file = pq.ParquetFile(file_path)
+    num_rows = parquet_file.metadata.num_rows
+    workers = workers or os.cpu_count() or 1
+    work_folder = tempfile.mkdtemp(prefix='near_duplicates_', dir=temp_folder)
+
+    signatures = None
+    try:
+        signatures = np.lib.format.open_memmap(os.path.join(work_folder, 'signatures.npy'), mode='w+', dtype=np.uint32,
+                                               shape=(num_rows, num_perm))
+        valid = np.zeros(num_rows, dtype=bool)
+
+        # 1. Signatures, in parallel batches (at most two batches per worker in flight)
+        batches = (batch.column(0).to_pylist() for batch in parquet_file.iter_batches(batch_size=batch_size, columns=[text_column]))
+        with tqdm(total=num_rows, desc="Computing MinHash signatures") as progress:
+            row = 0
+
+            def store(result):
+                nonlocal row
+                batch_signatures, batch_valid = result
+                signatures[row:row + len(batch_valid)] = batch_signatures
+                valid[row:row + len(batch_valid)] = batch_valid
+                row += len(batch_valid)
+                progress.update(len(batch_valid))
+
+            if workers == 1:
+                for texts in batches:
+                    store(minhash_signatures(texts, num_perm, shingle_size, min_tokens, seed))
+            else:
+                with ProcessPoolExecutor(max_workers=workers) as executor:
+                    pending = deque()
+                    for texts in batches:
+                        pending.append(executor.submit(signature_batch, (texts, num_perm, shingle_size, min_tokens, seed)))
+                        if len(pending) >= 2 * workers:
+                            store(pending.popleft().result())
+                    while pending:
+                        store(pending.popleft().result())
+        signatures.flush()
+
+        # 2. Candidates: rows with an identical band, linked to the first row of their bucket if similar enough
+        rows_per_band = num_perm // bands
+        multipliers = np.random.default_rng(seed + 1).integers(1, 2 ** 63, rows_per_band, dtype=np.uint64) | np.uint64(1)
+        candidates = np.flatnonzero(valid)
+        sources, targets = [], []
+        for band in tqdm(range(bands) if len(candidates) else [], desc="Bucketing LSH bands"):
+            band_values = np.asarray(signatures[candidates, band * rows_per_band:(band + 1) * rows_per_band], dtype=np.uint64)
+            keys = (band_values * multipliers).sum(axis=1)  # Wraps around modulo 2^64, like a hash
+            order = np.argsort(keys, kind='stable')
+            sorted_keys = keys[order]
+            bucket_start = np.r_[True, sorted_keys[1:] != sorted_keys[:-1]]
+            first = np.maximum.accumulate(np.where(bucket_start, np.arange(len(order)), 0))
+            linked = ~bucket_start
+            sources.append(candidates[order[first[linked]]])
+            targets.append(candidates[order[linked]])
+        sources = np.concatenate(sources) if sources else np.empty(0, dtype=np.int64)
+        targets = np.concatenate(targets) if targets else np.empty(0, dtype=np.int64)
+
+        # Keep one edge per pair, and only the pairs whose estimated similarity reaches the threshold
+        if len(sources):
+            pairs = np.unique(np.stack([sources, targets], axis=1), axis=0)
+            sources, targets = pairs[:, 0], pairs[:, 1]
+            similar = np.zeros(len(sources), dtype=bool)
+            for start in range(0, len(sources), batch_size):
+                end = start + batch_size
+                agreement = (signatures[sources[start:end]] == signatures[targets[start:end]]).mean(axis=1)
+                similar[start:end] = agreement >= threshold
+            sources, targets = sources[similar], targets[similar]
+        print(f"Near-duplicate pairs linked: {len(sources)}")
+
+        # 3. Clusters and their canonical (oldest) message
+        labels = connected_components(num_rows, sources, targets)
+    finally:
+        signatures = None  # Closes the memory-mapped file before its folder is removed
+        shutil.rmtree(work_folder, ignore_errors=True)
+
+    dates = pd.to_datetime(parquet_file.read(columns=[date_column]).column(0).to_pandas(), utc=True, errors='coerce', format='mixed')
+    date_key = dates.dt.tz_localize(None).to_numpy(dtype='datetime64[ns]').view('int64').copy()
+    date_key[dates.isna().to_numpy()] = np.iinfo(np.int64).max
+    rows = np.arange(num_rows, dtype=np.int64)
+    order = np.lexsort((rows, date_key, labels))
+    first = np.r_[True, labels[order][1:] != labels[order][:-1]] if num_rows else np.empty(0, dtype=bool)
+    canonical_of_label = np.zeros(num_rows, dtype=np.int64)
+    canonical_of_label[labels[order][first]] = order[first]
+    cluster_ids = canonical_of_label[labels]
+    sizes = np.bincount(labels, minlength=num_rows)[labels]
+
+    clusters = pd.DataFrame({'Cluster ID': cluster_ids, 'Cluster Size': sizes.astype(np.int64), 'Canonical': cluster_ids == rows})
+    print(f"Clusters: {int(clusters['Canonical'].sum())} for {num_rows} messages "
+          f"({int((sizes > 1).sum())} messages have near-duplicates)")
+    return clusters
+
+def add_near_duplicate_columns(input_file_path, output_file_path, text_column='Content', batch_size=100000, **kwargs):
+
+    # Find the near-duplicates of a Parquet file and write a copy of it with the cluster columns added.
+
+    # Parameters:
+    # input_file_path (str): The Parquet file, e.g. 'unified_data_telegram.parquet'.
+    # output_file_path (str): The Parquet file written (must be different from the input).
+    # text_column (str): The column compared.
+    # batch_size (int): Number of rows read and written at a time.
+    # **kwargs: Options of find_near_duplicates (num_perm, bands, threshold, workers, ...).
+
+    # Returns:
+    # DataFrame: The cluster columns (see find_near_duplicates).
+
+    # Example:
+    # add_near_duplicate_columns('unified_data_telegram.parquet', 'unified_data_telegram_clusters.parquet', threshold=0.8)
+    # filter_and_save_by_keywords(folder, 'unified_data_telegram_clusters.parquet', ..., dedupe_clusters=True)
+
+    if os.path.abspath(input_file_path) == os.path.abspath(output_file_path):
+        raise ValueError('The output file must be different from the input file')
+    clusters = find_near_duplicates(input_file_path, text_column=text_column, batch_size=batch_size, **kwargs)
+
+    parquet_file = pq.ParquetFile(input_file_path)
+    columns = [name for name in parquet_file.schema_arrow.names if name not in CLUSTER_COLUMNS]
+    schema = pa.schema([parquet_file.schema_arrow.field(name) for name in columns]
+                       + [pa.field('Cluster ID', pa.int64()), pa.field('Cluster Size', pa.int64()), pa.field('Canonical', pa.bool_())])
+    row = 0
+    with pq.ParquetWriter(output_file_path, schema) as writer:
+        for batch in tqdm(parquet_file.iter_batches(batch_size=batch_size, columns=columns), desc="Writing cluster columns"):
+            part = clusters.iloc[row:row + batch.num_rows]
+            arrays = batch.columns + [pa.array(part[name].to_numpy()) for name in CLUSTER_COLUMNS]
+            writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+            row += batch.num_rows
+    print(f"File with cluster columns saved at: {output_file_path}")
+    return clusters
+
+def cluster_representatives(cluster_ids, canonical):
+
+    # Choose one row per cluster: its canonical message if it is among the rows, otherwise its first row.
+
+    # Parameters:
+    # cluster_ids (array-like): The 'Cluster ID' of each row.
+    # canonical (array-like of bool): The 'Canonical' column of each row.
+
+    # Returns:
+    # numpy.ndarray of bool: True for the rows to keep.
+
+    cluster_ids = np.asarray(cluster_ids, dtype=np.int64)
+    canonical = np.asarray(canonical, dtype=bool)
+    order = np.lexsort((np.arange(len(cluster_ids)), ~canonical, cluster_ids))
+    keep = np.zeros(len(cluster_ids), dtype=bool)
+    if len(order):
+        sorted_ids = cluster_ids[order]
+        keep[order[np.r_[True, sorted_ids[1:] != sorted_ids[:-1]]]] = True
+    return keep
+
+def dedupe_by_cluster(df):
+
+    # Keep one row per near-duplicate cluster of a DataFrame (see cluster_representatives), in the original order.
+
+    missing = [name for name in ['Cluster ID', 'Canonical'] if name not in df.columns]
+    if missing:
+        raise ValueError(f"Missing columns {missing}: run add_near_duplicate_columns (near_duplicates.py) first")
+    return df[cluster_representatives(df['Cluster ID'].to_numpy(), df['Canonical'].to_numpy())]
+
+
+# Usage
+if __name__ == '__main__':  # Required by the process pool that computes the signatures
+    input_file_path = 'unified_data_telegram.parquet' # Example
+    output_file_path = 'unified_data_telegram_clusters.parquet' # Example
+
+    add_near_duplicate_columns(input_file_path, output_file_path, threshold=0.8)
@@ -0,0 +1,137 @@
+import os
+import re
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+class StreamingParquetWriter:
+
+    # Append-only Parquet sink that keeps a constant memory footprint.
+
+    # Rows are buffered until 'row_group_size' rows are collected, then written as one row group to the
+    # current part file and freed from memory. When a part reaches 'rows_per_part' rows it is closed and
+    # renamed from '.parquet.tmp' to '.parquet', so every '.parquet' file in the folder is always complete
+    # and readable (by combine_parquet_files, for example), even if the session dies. At most one
+    # unfinished part ('rows_per_part' rows) is lost in a crash.
+
+    # Parameters:
+    # folder_path (str): Folder where the part files are written (created if missing).
+    # file_name (str): Base name of the part files: '{file_name}_part_00001.parquet', '{file_name}_part_00002.parquet', ...
+    # schema (pyarrow.Schema): Schema of the rows; if None, it is inferred from the first row group.
+    # row_group_size (int): Number of rows kept in memory before they are written.
+    # rows_per_part (int): Number of rows per part file.
+
+    # Example:
+    # writer = StreamingParquetWriter('scraped_parts', 'Test', schema=MESSAGE_SCHEMA)
+    # for row in rows:
+    #     writer.append(row)
+    # writer.close()
+    # writer.consolidate('FINAL_Test.parquet')
+
+    def __init__(self, folder_path, file_name, schema=None, row_group_size=1000, rows_per_part=1000):
+        self.folder_path = folder_path
+        self.file_name = file_name
+        self.schema = schema
+        self.row_group_size = row_group_size
+        self.rows_per_part = rows_per_part
+        self.rows_written = 0
+        self.bytes_written = 0
+        self.buffer = []
+        self.writer = None
+        self.part_rows = 0
+        self.part_path = None
+        os.makedirs(folder_path, exist_ok=True)
+
+        # Continue the numbering of parts left by previous sessions instead of overwriting them
+        part_pattern = re.compile(rf'^{re.escape(file_name)}_part_(\d+)\.parquet$')
+        existing_parts = [int(match.group(1)) for match in map(part_pattern.match, os.listdir(folder_path)) if match]
+        self.part_number = max(existing_parts, default=0)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+        return False
+
+    def append(self, row):
+
+        # Adds a row; returns True if this completed a part file (i.e. every row appended so far is on disk).
+
+        self.buffer.append(row)
+        if len(self.buffer) >= self.row_group_size or self.part_rows + len(self.buffer) >= self.rows_per_part:
+            self.flush()
+            if self.part_rows >= self.rows_per_part:
+                self.write_part()
+                return True
+        return False
+
+    def flush(self):
+
+        # Writes the buffered rows as one row group of the current part file.
+
+        if not self.buffer:
+            return
+        table = pa.Table.from_pylist(self.buffer, schema=self.schema)
+        if self.schema is None:
+            self.schema = table.schema
+        if self.writer is None:
+            self.part_number += 1
+            self.part_path = os.path.join(self.folder_path, f'{self.file_name}_part_{self.part_number:05}.parquet')
+            self.writer = pq.ParquetWriter(f'{self.part_path}.tmp', self.schema)
+        self.writer.write_table(table, row_group_size=len(self.buffer))
+        self.part_rows += len(self.buffer)
+        self.rows_written += len(self.buffer)
+        self.buffer = []
+
+    def write_part(self):
+
+        # Flushes the buffer and closes the current part file, making it durable. The writer can keep being used.
+
+        self.flush()
+        if self.writer is None:
+            return None
+        self.writer.close()
+        os.replace(f'{self.part_path}.tmp', self.part_path)
+        self.bytes_written += os.path.getsize(self.part_path)
+        part_path = self.part_path
+        self.writer = None
+        self.part_rows = 0
+        self.part_path = None
+        return part_path
+
+    def close(self):
+        self.write_part()
+
+    def part_paths(self):
+
+        # Returns the paths of all complete part files of this writer, in order.
+
+        part_pattern = re.compile(rf'^{re.escape(self.file_name)}_part_(\d+)\.parquet$')
+        parts = sorted((int(match.group(1)), match.group(0)) for match in map(part_pattern.match, os.listdir(self.folder_path)) if match)
+        return [os.path.join(self.folder_path, name) for _, name in parts]
+
+    def consolidate(self, output_file_path):
+
+        # Streams every part file into a single Parquet file, one row group at a time.
+
+        # Parameters:
+        # output_file_path (str): Path of the consolidated Parquet file.
+
+        # Returns:
+        # int: The number of rows in the consolidated file.
+
+        total_rows = 0
+        writer = None
+        for part_path in self.part_paths():
+            part_file = pq.ParquetFile(part_path)
+            for row_group in range(part_file.num_row_groups):
+                table = part_file.read_row_group(row_group)
+                if writer is None:
+                    writer = pq.ParquetWriter(output_file_path, table.schema)
+                writer.write_table(table.cast(writer.schema))
+                total_rows += table.num_rows
+        if writer is None:
+            pq.write_table(pa.Table.from_pylist([], schema=self.schema or pa.schema([])), output_file_path)
+        else:
+            writer.close()
+        return total_rows
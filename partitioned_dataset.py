@@ -0,0 +1,249 @@
+import os
+import shutil
+import uuid
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from tqdm import tqdm
+
+# Hive-partitioned layout of the scraped data, plus the loader shared by the analysis scripts.
+#
+# Layout of a dataset folder (one folder per group, one sub-folder per month of 'Date'):
+#   Group=%40channel_a/Month=2024-12/part-<id>-0.parquet
+#   Group=%40channel_a/Month=2025-01/part-<id>-0.parquet
+#   Group=%40channel_b/...
+#
+# 'Date' is stored as timestamp[us, UTC]. Reading one group or one period only opens the matching folders
+# (partition pruning), and the min/max statistics of 'Date' skip the row groups outside the date range.
+#
+# load_dataset and iter_dataset_batches accept either a dataset folder or a plain Parquet file (such as the
+# unified file written by combine_parquet_files), so scripts can use them whatever layout the data has.
+
+DATE_TYPE = pa.timestamp('us', tz='UTC')
+PARTITIONING = ds.partitioning(pa.schema([('Group', pa.string()), ('Month', pa.string())]), flavor='hive')
+
+def to_timestamp(dates):
+
+    # Convert an Arrow 'Date' column (scraper strings such as '2025-01-15 10:00:00', in UTC, or timestamps) to DATE_TYPE.
+
+    if pa.types.is_timestamp(dates.type):
+        return pc.cast(dates, DATE_TYPE) if dates.type.tz else pc.assume_timezone(pc.cast(dates, pa.timestamp('us')), 'UTC')
+    return pa.array(pd.to_datetime(dates.to_pandas(), utc=True, format='ISO8601'), type=DATE_TYPE)
+
+def write_partitioned_dataset(file_paths, dataset_folder, batch_size=100000, max_rows_per_file=1000000, replace=False):
+
+    # Write Parquet files to a dataset folder partitioned by Group and year-month of 'Date'.
+
+    # By default new files are added next to the existing ones (partitions are never overwritten), so the dataset
+    # can grow with each batch of new data. Do not add the same file twice: its rows would be duplicated.
+
+    # Parameters:
+    # file_paths (list of str): Parquet files in the scraper's schema (raw parts or combined files).
+    # dataset_folder (str): Root folder of the dataset (created if missing).
+    # batch_size (int): Number of rows read at a time.
+    # max_rows_per_file (int): Maximum number of rows per partition file.
+    # replace (bool): Replace the whole dataset (e.g. by a new unified file); the old dataset is only removed
+    #                 once the new one is completely written.
+
+    # Returns:
+    # int: The number of rows written.
+
+    # Example:
+    # write_partitioned_dataset([os.path.join(folder_path, 'unified_data_telegram.parquet')], 'telegram_dataset')
+
+    total_rows = 0
+
+    def batches():
+        nonlocal total_rows
+        for file_path in file_paths:
+            parquet_file = pq.ParquetFile(file_path)
+            for batch in tqdm(parquet_file.iter_batches(batch_size=batch_size), desc=f"Partitioning {os.path.basename(file_path)}"):
+                table = pa.Table.from_batches([batch]).replace_schema_metadata(None)
+                dates = to_timestamp(table.column('Date').combine_chunks())
+                table = table.set_column(table.column_names.index('Date'), pa.field('Date', DATE_TYPE), dates)
+                table = table.set_column(table.column_names.index('Group'), pa.field('Group', pa.string()),
+                                         pc.cast(table.column('Group'), pa.string()))
+                table = table.append_column('Month', pc.strftime(dates, format='%Y-%m'))
+                total_rows += table.num_rows
+                yield from table.to_batches()
+
+    if not file_paths:
+        return 0
+    target_folder = f'{dataset_folder}.tmp' if replace else dataset_folder
+    if replace:
+        shutil.rmtree(target_folder, ignore_errors=True)
+    ds.write_dataset(batches(), target_folder, schema=dataset_schema(file_paths[0]), format='parquet', partitioning=PARTITIONING,
+                     basename_template=f'part-{uuid.uuid4().hex}-{{i}}.parquet', existing_data_behavior='overwrite_or_ignore',
+                     max_rows_per_file=max_rows_per_file, max_rows_per_group=min(batch_size, max_rows_per_file))
+    if replace:
+        shutil.rmtree(dataset_folder, ignore_errors=True)
+        os.replace(target_folder, dataset_folder)
+    return total_rows
+
+def dataset_schema(file_path):
+
+    # Return the schema the rows of a file have once partitioned (Date as timestamp, Group as string, plus 'Month').
+
+    schema = pq.ParquetFile(file_path).schema_arrow.remove_metadata()
+    schema = schema.set(schema.get_field_index('Date'), pa.field('Date', DATE_TYPE))
+    schema = schema.set(schema.get_field_index('Group'), pa.field('Group', pa.string()))
+    return schema.append(pa.field('Month', pa.string()))
+
+def open_dataset(source, base_dir=None):
+
+    # Open a dataset folder, a plain Parquet file, or one file of a dataset folder (with base_dir, its root).
+
+    if os.path.isdir(source):
+        return ds.dataset(source, format='parquet', partitioning=PARTITIONING)
+    if base_dir is not None:
+        return ds.dataset([source], format='parquet', partitioning=PARTITIONING, partition_base_dir=base_dir)
+    return ds.dataset(source, format='parquet')
+
+def as_utc(date):
+    date = pd.Timestamp(date)
+    return (date.tz_localize('UTC') if date.tzinfo is None else date.tz_convert('UTC')).to_pydatetime()
+
+def dataset_filter(dataset, groups=None, date_min=None, date_max=None):
+
+    # Build the filter expression of the loader: Group in groups and date_min <= Date <= date_max.
+
+    # On a dataset folder the 'Group' and 'Month' conditions prune whole folders; the 'Date' condition uses the
+    # row-group statistics. On a plain file with 'Date' stored as scraper strings ('%Y-%m-%d %H:%M:%S', UTC),
+    # the dates are compared as strings in the same format, which orders them correctly.
+
+    names = dataset.schema.names
+    expression = None
+
+    def add(condition):
+        nonlocal expression
+        expression = condition if expression is None else expression & condition
+
+    if groups is not None:
+        groups = [group if group.startswith('@') else '@' + group for group in groups]
+        add(ds.field('Group').isin(groups + [group[1:] for group in groups]))
+
+    date_type = dataset.schema.field('Date').type if 'Date' in names else None
+    for date, is_min in [(date_min, True), (date_max, False)]:
+        if date is None:
+            continue
+        date = as_utc(date)
+        if 'Month' in names:
+            month = date.strftime('%Y-%m')
+            add(ds.field('Month') >= month if is_min else ds.field('Month') <= month)
+        if date_type is not None and pa.types.is_timestamp(date_type):
+            value = pa.scalar(date, type=DATE_TYPE).cast(date_type) if date_type.tz else pa.scalar(date.replace(tzinfo=None), type=date_type)
+        else:
+            value = date.strftime('%Y-%m-%d %H:%M:%S')
+        add(ds.field('Date') >= value if is_min else ds.field('Date') <= value)
+    return expression
+
+def iter_dataset_batches(source, columns=None, groups=None, date_min=None, date_max=None, batch_size=100000, base_dir=None):
+
+    # Stream the rows of a dataset folder or Parquet file, with filters and a column projection.
+
+    # Parameters:
+    # source (str): Dataset folder or Parquet file.
+    # columns (list of str): Columns to read (default: all).
+    # groups (list of str): Only read these groups ('@' is optional).
+    # date_min (datetime or str): Only read messages from this date on (naive dates are UTC).
+    # date_max (datetime or str): Only read messages up to this date.
+    # batch_size (int): Maximum number of rows per batch.
+    # base_dir (str): Root of the dataset folder, when source is one of its files.
+
+    # Returns:
+    # iterator of pyarrow.RecordBatch: The filtered rows, in file order.
+
+    dataset = open_dataset(source, base_dir)
+    expression = dataset_filter(dataset, groups, date_min, date_max)
+    scanner = dataset.scanner(columns=columns, filter=expression, batch_size=batch_size)
+    for batch in scanner.to_batches():
+        if batch.num_rows:
+            yield batch
+
+def load_dataset(source, columns=None, groups=None, date_min=None, date_max=None, as_table=False):
+
+    # Load the rows of a dataset folder or Parquet file, reading only the partitions, row groups and columns needed.
+
+    # Parameters:
+    # source (str): Dataset folder or Parquet file.
+    # columns (list of str): Columns to read (default: all; the 'Month' partition column is left out).
+    # groups (list of str): Only load these groups ('@' is optional).
+    # date_min (datetime or str): Only load messages from this date on (naive dates are UTC).
+    # date_max (datetime or str): Only load messages up to this date.
+    # as_table (bool): Return a pyarrow.Table instead of a DataFrame.
+
+    # Returns:
+    # DataFrame (or pyarrow.Table): The filtered rows.
+
+    # Example:
+    # df = load_dataset('telegram_dataset', columns=['Group', 'Date', 'Content'], groups=['@channel_a'],
+    #                   date_min='2024-10-01', date_max='2024-12-31 23:59:59')
+
+    dataset = open_dataset(source)
+    if columns is None:
+        columns = dataset_columns(dataset, source)
+    table = dataset.to_table(columns=columns, filter=dataset_filter(dataset, groups, date_min, date_max))
+    return table if as_table else table.to_pandas()
+
+def dataset_columns(dataset, source):
+
+    # Default columns of the loader: the columns of the files, with the 'Group' partition column back at its place
+    # in the scraper's schema (after 'Type') and without the 'Month' partition column.
+
+    names = dataset.schema.names
+    if not os.path.isdir(source):
+        return names
+    names = [name for name in names if name not in ('Group', 'Month')]
+    position = names.index('Type') + 1 if 'Type' in names else 0
+    return names[:position] + ['Group'] + names[position:]
+
+def partition_values(file_path, dataset_folder):
+
+    # Return the partition values of a file of a dataset folder, e.g. {'Group': '@channel_a', 'Month': '2025-01'}.
+
+    relative_folder = os.path.relpath(os.path.dirname(os.path.abspath(file_path)), os.path.abspath(dataset_folder))
+    # The last segment is only parsed when followed by a separator
+    return ds.get_partition_keys(PARTITIONING.parse(relative_folder.replace(os.sep, '/') + '/'))
+
+def filter_dataframe(df, groups=None, date_min=None, date_max=None):
+
+    # Apply the loader's group and date filters to an already loaded DataFrame (e.g. rows read by row number).
+
+    mask = pd.Series(True, index=df.index)
+    if groups is not None:
+        groups = [group if group.startswith('@') else '@' + group for group in groups]
+        mask &= df['Group'].isin(groups + [group[1:] for group in groups])
+    if date_min is not None or date_max is not None:
+        dates = pd.to_datetime(df['Date'], utc=True, format='ISO8601')
+        if date_min is not None:
+            mask &= dates >= as_utc(date_min)
+        if date_max is not None:
+            mask &= dates <= as_utc(date_max)
+    return df[mask]
+
+def dataset_files(source, groups=None, date_min=None, date_max=None):
+
+    # Return the Parquet files of a dataset folder (or [source] for a plain file), skipping the partitions
+    # outside the group and date filters.
+
+    if not os.path.isdir(source):
+        return [source]
+    file_paths = sorted(os.path.join(root, name) for root, _, names in os.walk(source) for name in names if name.endswith('.parquet'))
+    if groups is not None:
+        groups = {group if group.startswith('@') else '@' + group for group in groups}
+    month_min = as_utc(date_min).strftime('%Y-%m') if date_min is not None else None
+    month_max = as_utc(date_max).strftime('%Y-%m') if date_max is not None else None
+
+    selected = []
+    for file_path in file_paths:
+        values = partition_values(file_path, source)
+        if groups is not None and values.get('Group') not in groups:
+            continue
+        if month_min is not None and values.get('Month', month_min) < month_min:
+            continue
+        if month_max is not None and values.get('Month', month_max) > month_max:
+            continue
+        selected.append(file_path)
+    return selected
@@ -0,0 +1,307 @@
+import bisect
+import contextlib
+import cProfile
+import io
+import json
+import os
+import pstats
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+# Counters, histograms and throttled progress for long runs (scraping sessions, Parquet scripts).
+#
+# Instead of printing every message, the scraper updates a PipelineMetrics object: a progress line is printed
+# at most every 'progress_interval' seconds, and the metrics can be exported as a JSON lines file (one snapshot
+# per line, easy to load with pandas) or as a Prometheus text file (for node_exporter's textfile collector).
+# profile_run adds cProfile and tracemalloc around any block of code.
+
+# Histogram buckets, in seconds, for request latencies and channel durations
+LATENCY_BUCKETS = [0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30]
+DURATION_BUCKETS = [1, 5, 15, 60, 300, 900, 1800, 3600, 10800, 21600]
+
+def format_time(seconds):
+
+    # Format a number of seconds as 'days:hours:minutes:seconds'.
+
+    # Parameters:
+    # seconds (float): The number of seconds to format.
+
+    # Returns:
+    # str: The formatted time string.
+
+    days = seconds // 86400
+    hours = (seconds % 86400) // 3600
+    minutes = (seconds % 3600) // 60
+    seconds = seconds % 60
+    return f'{int(days):02}:{int(hours):02}:{int(minutes):02}:{int(seconds):02}'
+
+class Histogram:
+
+    # Fixed-bucket histogram (like Prometheus): counts of observations up to each bucket bound, plus count, sum,
+    # min and max. Quantiles are estimated from the buckets.
+
+    def __init__(self, buckets):
+        self.buckets = list(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # The last bucket is +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def quantile(self, q):
+
+        # Upper bound of the bucket holding the q-quantile (the max for the +Inf bucket).
+
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets + [self.max], self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'min': self.min,
+            'max': self.max,
+            'mean': self.sum / self.count if self.count else None,
+            'p50': self.quantile(0.5),
+            'p95': self.quantile(0.95),
+        }
+
+class PipelineMetrics:
+
+    # Named counters, gauges and histograms, with optional labels, a throttled progress line and exports.
+
+    # Parameters:
+    # name (str): Prefix of the metric names in the Prometheus export, e.g. 'telegram_scraper'.
+    # progress_interval (float): Minimum number of seconds between two progress lines (0 prints every update,
+    #                            None never prints).
+    # jsonl_path (str): If set, a snapshot of every metric is appended to this JSON lines file on each export.
+    # prometheus_path (str): If set, this file is rewritten in the Prometheus text format on each export.
+    # export_interval (float): Minimum number of seconds between two periodic exports (the final export is always written).
+
+    # Example:
+    # metrics = PipelineMetrics('telegram_scraper', progress_interval=10, jsonl_path='scrape_metrics.jsonl')
+    # metrics.inc('messages_total')
+    # metrics.observe('api_latency_seconds', 0.2)
+    # metrics.maybe_report()
+    # metrics.export()
+
+    def __init__(self, name='pipeline', progress_interval=10.0, jsonl_path=None, prometheus_path=None, export_interval=60.0):
+        self.name = name
+        self.progress_interval = progress_interval
+        self.jsonl_path = jsonl_path
+        self.prometheus_path = prometheus_path
+        self.export_interval = export_interval
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self.start_time = time.time()
+        self.last_progress = 0.0
+        self.last_export = time.time()
+        self.progress = None
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted(labels.items()))
+
+    def inc(self, name, value=1, **labels):
+        key = self._key(name, labels)
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        self.gauges[self._key(name, labels)] = value
+
+    def observe(self, name, value, buckets=LATENCY_BUCKETS, **labels):
+        key = self._key(name, labels)
+        if key not in self.histograms:
+            self.histograms[key] = Histogram(buckets)
+        self.histograms[key].observe(value)
+
+    def counter(self, name, **labels):
+        return self.counters.get(self._key(name, labels), 0)
+
+    @contextlib.contextmanager
+    def timer(self, name, buckets=LATENCY_BUCKETS, **labels):
+
+        # Observes the duration of the 'with' block in the histogram 'name'.
+
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start_time, buckets, **labels)
+
+    def elapsed(self):
+        return time.time() - self.start_time
+
+    def rate(self, name):
+
+        # Average number of events of counter 'name' per second since the start.
+
+        elapsed = self.elapsed()
+        return self.counter(name) / elapsed if elapsed else 0.0
+
+    def eta(self):
+
+        # Seconds left, from the fraction of the work done set in self.progress (None if unknown).
+
+        if not self.progress or self.progress <= 0:
+            return None
+        elapsed = self.elapsed()
+        return elapsed / min(self.progress, 1.0) - elapsed
+
+    def progress_line(self):
+
+        # One-line summary: progress, rates, requests, flood waits, elapsed and remaining time.
+
+        parts = []
+        if self.progress is not None:
+            parts.append(f'{min(self.progress, 1.0) * 100:.1f}%')
+        parts.append(f'{self.counter("messages_total")} posts ({self.rate("messages_total"):.1f}/s)')
+        parts.append(f'{self.counter("comments_total")} comments ({self.rate("comments_total"):.1f}/s)')
+        if self.counter('api_calls_total'):
+            latency = self.histograms.get(self._key('api_latency_seconds', {}))
+            p50 = f', p50 {latency.quantile(0.5) * 1000:.0f}ms' if latency and latency.count else ''
+            parts.append(f'{self.counter("api_calls_total")} requests{p50}')
+        if self.counter('flood_waits_total'):
+            parts.append(f'{self.counter("flood_waits_total")} flood waits ({self.counter("flood_wait_seconds_total"):.0f}s)')
+        if self.counter('bytes_written_total'):
+            parts.append(f'{self.counter("bytes_written_total") / 1024 ** 2:.1f} MB written')
+        eta = self.eta()
+        parts.append(f'Elapsed {format_time(self.elapsed())}' + (f' | Remaining {format_time(eta)}' if eta is not None else ''))
+        return 'Progress: ' + ' | '.join(parts)
+
+    def maybe_report(self, force=False):
+
+        # Prints the progress line and exports the metrics, if their intervals have passed since the last time.
+
+        now = time.time()
+        if self.progress_interval is not None and (force or now - self.last_progress >= self.progress_interval):
+            self.last_progress = now
+            print(self.progress_line())
+        if (self.jsonl_path or self.prometheus_path) and (force or now - self.last_export >= self.export_interval):
+            self.export()
+
+    def snapshot(self):
+
+        # Every metric as a JSON-serializable dict; labeled metrics are keyed 'name{label="value"}'.
+
+        def label(key):
+            name, labels = key
+            return name + ('{' + ','.join(f'{k}="{v}"' for k, v in labels) + '}' if labels else '')
+
+        return {
+            'time': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'elapsed_seconds': self.elapsed(),
+            'progress': self.progress,
+            'counters': {label(key): value for key, value in sorted(self.counters.items())},
+            'gauges': {label(key): value for key, value in sorted(self.gauges.items())},
+            'histograms': {label(key): histogram.summary() for key, histogram in sorted(self.histograms.items())},
+        }
+
+    def prometheus_text(self):
+
+        # The metrics in the Prometheus text exposition format.
+
+        def labels_text(labels, extra=()):
+            pairs = [(k, str(v).replace('\\', '\\\\').replace('"', '\\"')) for k, v in list(labels) + list(extra)]
+            return '{' + ','.join(f'{k}="{v}"' for k, v in pairs) + '}' if pairs else ''
+
+        lines = []
+        for kind, metrics in [('counter', self.counters), ('gauge', self.gauges)]:
+            typed = set()
+            for (name, labels), value in sorted(metrics.items()):
+                if name not in typed:
+                    typed.add(name)
+                    lines.append(f'# TYPE {self.name}_{name} {kind}')
+                lines.append(f'{self.name}_{name}{labels_text(labels)} {value}')
+        typed = set()
+        for (name, labels), histogram in sorted(self.histograms.items()):
+            if name not in typed:
+                typed.add(name)
+                lines.append(f'# TYPE {self.name}_{name} histogram')
+            cumulative = 0
+            for bound, count in zip(histogram.buckets + ['+Inf'], histogram.counts):
+                cumulative += count
+                lines.append(f'{self.name}_{name}_bucket{labels_text(labels, [("le", bound)])} {cumulative}')
+            lines.append(f'{self.name}_{name}_sum{labels_text(labels)} {histogram.sum}')
+            lines.append(f'{self.name}_{name}_count{labels_text(labels)} {histogram.count}')
+        return '\n'.join(lines) + '\n'
+
+    def export(self):
+
+        # Appends a snapshot to the JSON lines file and rewrites the Prometheus file (atomically, so a collector
+        # never reads half a file).
+
+        self.last_export = time.time()
+        if self.jsonl_path:
+            with open(self.jsonl_path, 'a', encoding='utf-8') as file:
+                file.write(json.dumps(self.snapshot(), ensure_ascii=False) + '\n')
+        if self.prometheus_path:
+            with open(f'{self.prometheus_path}.tmp', 'w', encoding='utf-8') as file:
+                file.write(self.prometheus_text())
+            os.replace(f'{self.prometheus_path}.tmp', self.prometheus_path)
+
+@contextlib.contextmanager
+def profile_run(profile_path=None, trace_memory=False, top=20):
+
+    # Profile the time (cProfile) and, optionally, the memory allocations (tracemalloc) of a block of code.
+
+    # Parameters:
+    # profile_path (str): If set, the cProfile statistics are saved there (open them with snakeviz or pstats).
+    # trace_memory (bool): Also trace the Python allocations: prints the peak and the lines that allocated the
+    #                      most memory still held at the end (tracemalloc slows the code down noticeably).
+    # top (int): Number of functions / lines printed.
+
+    # Example:
+    # with profile_run('combine.prof', trace_memory=True):
+    #     combine_parquet_files_streaming('scraped_parts', ['Group', 'Message ID'], 'unified_data_telegram.parquet')
+    #
+    # with profile_run('scrape.prof'):
+    #     data = await scrape_channels(client, channels, date_min, date_max)
+
+    profiler = cProfile.Profile()
+    if trace_memory:
+        tracemalloc.start()
+    profiler.enable()
+    try:
+        yield profiler
+    finally:
+        profiler.disable()
+        if profile_path:
+            profiler.dump_stats(profile_path)
+        output = io.StringIO()
+        pstats.Stats(profiler, stream=output).sort_stats('cumulative').print_stats(top)
+        print(output.getvalue())
+        if trace_memory:
+            snapshot = tracemalloc.take_snapshot()
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            print(f'Peak traced memory: {peak / 1024 ** 2:.1f} MB')
+            for statistic in snapshot.statistics('lineno')[:top]:
+                print(statistic)
+
+# Usage
+if __name__ == '__main__':
+    metrics = PipelineMetrics('example', progress_interval=0, jsonl_path='example_metrics.jsonl', prometheus_path='example_metrics.prom')
+    with profile_run(trace_memory=True, top=5):
+        for index in range(1000):
+            with metrics.timer('api_latency_seconds'):
+                sum(range(1000))
+            metrics.inc('messages_total')
+    metrics.progress = 1.0
+    metrics.maybe_report(force=True)
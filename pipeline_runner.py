@@ -0,0 +1,775 @@
+import argparse
+import os
+import sys
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+# Single-scan pipeline for the post-processing scripts.
+#
+# The keyword filter, the group x month rollup, the link extraction, the sampler and the combine script each read
+# the whole dataset and decode the same columns again. run_pipeline reads the dataset once, as a stream of Arrow
+# batches, and hands each batch to every consumer. The decoded columns a consumer asks for ('Date' months, comment
+# counts, texts as strings, the batch as a DataFrame, ...) are computed once per batch (see SharedBatch) and reused
+# by the other consumers. The consumers of a batch run at the same time in a thread pool, while the next batch is
+# being read.
+#
+# Threads share the decoded columns, but only the Arrow and numpy work runs in parallel in them: the keyword
+# matching and the link extraction are Python loops and regular expressions, which hold the GIL and take turns.
+# With processes=N (--processes N), these two consumers send their rows to a pool of N worker processes instead
+# (the keyword matcher is built once per process), and their threads only wait for the results.
+#
+# Consumers are small classes with start / consume / finish methods (see PipelineConsumer): any other analysis can
+# be plugged in the same way. Modules are only imported when a consumer is used, so the command line starts fast.
+#
+# Command line, e.g. for the nightly job on the unified file:
+#   python pipeline_runner.py unified_data_telegram.parquet --output-folder reports --keywords Trump Biden Kamala
+#       --rollup --links --include-comments --sample 10000 --min-length 20 --seed 42
+#
+# Or straight from the scraped parts, combining them in the same scan (the other consumers then see each
+# message once, see run_pipeline's dedupe_columns):
+#   python pipeline_runner.py scraped_parts --combine unified_data_telegram.parquet --rollup --links
+
+PIPELINE_CONSUMERS = ['combine', 'keywords', 'rollup', 'links', 'sample']
+
+# A file of the scan: path, dataset root (or None), number of its first row in the scan, number of rows, and schema
+ScanFile = namedtuple('ScanFile', ['path', 'base_dir', 'first_row', 'num_rows', 'schema'])
+
+class SharedBatch:
+
+    # A batch of the scan, with the decoded columns shared by the consumers. Each decoded column is computed by the
+    # first consumer asking for it and cached for the others (consumers run in threads: one lock per column).
+
+    # Attributes:
+    # batch (pyarrow.RecordBatch): The rows (small files that follow each other are read as one batch).
+    # rows (numpy.ndarray): The row number of each row in the scan (across files, before deduplication).
+    # files (numpy.ndarray): The index of the file of each row in the list of ScanFile given to start().
+
+    def __init__(self, batch, rows, files):
+        self.batch = batch
+        self.rows = rows
+        self.files = files
+        self.cache = {}
+        self.lock = threading.Lock()
+        self.locks = {}
+
+    @property
+    def num_rows(self):
+        return self.batch.num_rows
+
+    @property
+    def names(self):
+        return self.batch.schema.names
+
+    def shared(self, name, compute):
+
+        # Return the cached value 'name', computing it with compute() if no consumer did yet.
+
+        with self.lock:
+            lock = self.locks.setdefault(name, threading.Lock())
+        with lock:
+            if name not in self.cache:
+                self.cache[name] = compute()
+            return self.cache[name]
+
+    def table(self):
+        import pyarrow as pa
+        return self.shared('table', lambda: pa.Table.from_batches([self.batch]))
+
+    def dataframe(self):
+        return self.shared('dataframe', lambda: self.batch.to_pandas())
+
+    def strings(self, column):
+
+        # The values of a column converted with str(), like the keyword filter always matched them.
+
+        return self.shared(f'strings:{column}', lambda: [str(value) for value in self.dataframe()[column].tolist()])
+
+    def groups(self):
+
+        # '@'-prefixed groups (numpy array of str).
+
+        from snowballing_scrape_telegram_links_from_data import source_groups
+        return self.shared('groups', lambda: source_groups(self.batch.column('Group')))
+
+    def months(self):
+
+        # 'YYYY-MM' of 'Date' (Arrow strings).
+
+        from group_month_rollup import month_of
+        return self.shared('months', lambda: month_of(self.batch.column('Date')))
+
+    def comment_counts(self):
+
+        # Number of comments of each row, counted from 'Comments List' without decoding JSON.
+
+        from comments_schema import count_comments
+        return self.shared('comment_counts', lambda: count_comments(self.batch.column('Comments List')))
+
+class PipelineConsumer:
+
+    # Base class of the consumers of run_pipeline.
+
+    # name (str): Key of the consumer's result in the dict returned by run_pipeline.
+    # columns (list of str): Columns the consumer reads (None: all columns); the scan only reads the columns of its consumers.
+    # deduplicated (bool): Receive the batches after run_pipeline removed the duplicated rows (if it does).
+    # processes (int): Number of worker processes of the consumer's CPU-bound work (None: run it in the consumer's thread).
+
+    # Subclasses override consume (the base class ignores the batches) and, if needed, start, finish and close.
+
+    name = 'consumer'
+    columns = None
+    deduplicated = True
+    processes = None
+    pool = None
+
+    def start(self, scan_files):
+
+        # Called once before the scan, with the list of ScanFile.
+
+        pass
+
+    def consume(self, shared):
+
+        # Called once per batch, with a SharedBatch.
+
+        pass
+
+    def start_pool(self, initializer=None, initargs=()):
+
+        # Start the worker processes of the consumer, if it has any (spawned: the scan's threads are not forked).
+
+        import multiprocessing
+        if self.processes and self.pool is None:
+            self.pool = ProcessPoolExecutor(max_workers=self.processes, mp_context=multiprocessing.get_context('spawn'),
+                                            initializer=initializer, initargs=initargs)
+
+    def stop_pool(self):
+        if self.pool is not None:
+            self.pool.shutdown(cancel_futures=True)
+            self.pool = None
+
+    def row_slices(self, num_rows):
+
+        # (start, end) of the slices of a batch's rows sent to the worker processes: one slice per process.
+
+        size = max(-(-num_rows // self.processes), 1)
+        return [(start, min(start + size, num_rows)) for start in range(0, num_rows, size)]
+
+    def finish(self):
+
+        # Called once after the scan: write the outputs and return the result of the consumer.
+
+        return None
+
+    def close(self):
+
+        # Called instead of finish if the scan failed: release temporary files.
+
+        self.stop_pool()
+
+class KeywordFilterConsumer(PipelineConsumer):
+
+    # Keyword filter of scrape_and_filter_by_keywords_from_parquet_to_excel.py: keeps the rows whose content has at
+    # least one keyword, with one 0/1 column per keyword and 'Keyword_Count', and saves them to Excel part files.
+
+    # Parameters:
+    # keywords (list of str): The keywords to find.
+    # output_base (str): Path of the output files, without extension ('filtered_keywords' -> 'filtered_keywords_unique.xlsx').
+    # content_col (str): The column name containing the content data.
+    # max_rows_per_file (int): The maximum number of rows per output file.
+    # case_insensitive, fold_accents, whole_words (bool): Matching options (see keyword_matcher.py).
+    # workers (int): Number of processes writing the Excel parts.
+    # dedupe_clusters (bool): Keep one row per near-duplicate cluster.
+    # processes (int): Number of processes matching the keywords (None: match in the consumer's thread).
+
+    name = 'keywords'
+
+    def __init__(self, keywords, output_base, content_col='Content', max_rows_per_file=1000000, case_insensitive=False,
+                 fold_accents=False, whole_words=False, workers=None, dedupe_clusters=False, processes=None):
+        from keyword_matcher import KeywordMatcher
+        self.keywords = list(keywords)
+        self.output_base = output_base
+        self.content_col = content_col
+        self.max_rows_per_file = max_rows_per_file
+        self.workers = workers
+        self.dedupe_clusters = dedupe_clusters
+        self.processes = processes
+        self.matcher_args = (self.keywords, case_insensitive, fold_accents, whole_words)
+        self.matcher = KeywordMatcher(*self.matcher_args)
+        self.parts = []
+
+    def start(self, scan_files):
+        from keyword_matcher import init_worker
+        self.start_pool(init_worker, self.matcher_args)
+
+    def consume(self, shared):
+        import numpy as np
+        from keyword_matcher import match_chunk
+        texts = shared.strings(self.content_col)
+        if self.pool is None or not texts:
+            hits = self.matcher.match_many(texts)
+        else:
+            futures = [self.pool.submit(match_chunk, texts[start:end]) for start, end in self.row_slices(len(texts))]
+            hits = np.vstack([future.result() for future in futures])
+        hits = hits.astype(np.int64)
+        matched = hits.any(axis=1)
+        if self.parts and not matched.any():
+            return
+        # The first batch is always kept (possibly empty), so the output has its columns even without matches
+        part = shared.dataframe()[matched].copy()
+        for index, keyword in enumerate(self.keywords):
+            part[keyword] = hits[matched, index]
+        part['Keyword_Count'] = part[self.keywords].sum(axis=1)
+        self.parts.append(part)
+
+    def finish(self):
+        import pandas as pd
+        from scrape_and_filter_by_keywords_from_parquet_to_excel import save_filtered_rows
+        self.stop_pool()
+        if not self.parts:
+            print("Number of rows in the filtered dataframe: 0")
+            return []
+        parts = [part for part in self.parts if len(part)] or self.parts[:1]
+        filtered_df = pd.concat(parts, ignore_index=True)
+        self.parts = []
+        return save_filtered_rows(filtered_df, self.output_base, self.max_rows_per_file, self.workers, self.dedupe_clusters)
+
+class RollupConsumer(PipelineConsumer):
+
+    # Group x month rollup of group_month_rollup.py: adds the totals of the new or rewritten files of the scan to the
+    # rollup store (unchanged files are skipped) and, optionally, writes the reports.
+
+    # Parameters:
+    # store_path (str): Path of the rollup store.
+    # report_folder (str): Folder of the reports (None: only update the store).
+    # output_filename_base (str): Base name of the reports.
+    # metrics (tuple of str): Metrics to report.
+    # file_format (str): 'xlsx' or 'csv'.
+
+    name = 'rollup'
+    columns = ['Group', 'Date', 'Comments', 'Comments List', 'Views', 'Shares', 'Reactions']
+
+    def __init__(self, store_path, report_folder=None, output_filename_base='resume', metrics=('Contents', 'Comments', 'Total'),
+                 file_format='xlsx'):
+        self.store_path = store_path
+        self.report_folder = report_folder
+        self.output_filename_base = output_filename_base
+        self.metrics = metrics
+        self.file_format = file_format
+        self.scan_files = []
+        self.needed = None
+        self.partials = []
+
+    def start(self, scan_files):
+        import numpy as np
+        from group_month_rollup import load_rollup_store, rollup_needed
+        _, manifest = load_rollup_store(self.store_path)
+        self.scan_files = scan_files
+        self.needed = np.array([rollup_needed(manifest, scan_file.path) for scan_file in scan_files], dtype=bool)
+
+    def consume(self, shared):
+        import pyarrow as pa
+        from group_month_rollup import rollup_batch
+        needed = self.needed[shared.files]
+        if not needed.any():
+            return
+        batch, files, months = shared.batch, shared.files, shared.months()
+        if not needed.all():
+            mask = pa.array(needed)
+            batch, files, months = batch.filter(mask), files[needed], months.filter(mask)
+        if 'Comments' in batch.schema.names:
+            comment_counts, comments_source = None, 'Comments'
+        elif 'Comments List' in batch.schema.names:
+            comment_counts, comments_source = shared.comment_counts()[needed], 'Comments List'
+        else:
+            comment_counts, comments_source = None, None
+        # The files of the batch are rolled up at once, with the file as a third key
+        self.partials.append(rollup_batch(batch, comments_source=comments_source, comment_counts=comment_counts, months=months,
+                                          sources=pa.array(files, type=pa.int64())))
+
+    def finish(self):
+        import numpy as np
+        import pyarrow as pa
+        import pyarrow.compute as pc
+        from group_month_rollup import ROLLUP_SCHEMA, aggregate, render_rollup_reports, save_rollups
+        totals = aggregate(pa.concat_tables(self.partials), keys=('Source File', 'Group', 'Month')) if self.partials else None
+        rollups = {}
+        for index in np.flatnonzero(self.needed):
+            if totals is None:
+                rollups[self.scan_files[index].path] = ROLLUP_SCHEMA.empty_table().drop_columns(['Source File'])
+            else:
+                rollups[self.scan_files[index].path] = totals.filter(pc.equal(totals.column('Source File'), index)).drop_columns(['Source File'])
+        self.partials = []
+        save_rollups(self.store_path, rollups)
+        print(f"{len(rollups)} file(s) added to the rollup store: {self.store_path}")
+        if self.report_folder is None:
+            return []
+        return render_rollup_reports(self.store_path, self.report_folder, self.output_filename_base, metrics=self.metrics,
+                                     file_format=self.file_format)
+
+class LinkConsumer(PipelineConsumer):
+
+    # Link extraction of snowballing_scrape_telegram_links_from_data.py: counts the normalized Telegram links and,
+    # optionally, builds the weighted link graph 'Source Group -> Target Channel'.
+
+    # Parameters:
+    # output_path (str): Path of the Excel file of the links and their frequency.
+    # edges_path (str): Optional path of the link graph (.parquet, .csv or .xlsx).
+    # include_comments (bool): Also extract the links found in the comments.
+    # processes (int): Number of processes extracting the links (None: extract them in the consumer's thread).
+
+    name = 'links'
+
+    def __init__(self, output_path, edges_path=None, include_comments=False, processes=None):
+        self.output_path = output_path
+        self.edges_path = edges_path
+        self.include_comments = include_comments
+        self.processes = processes
+        self.columns = ['Group', 'Content'] + (['Comments List'] if include_comments else [])
+        self.links = []
+        self.edges = []
+
+    def start(self, scan_files):
+        self.start_pool()
+
+    def consume(self, shared):
+        from snowballing_scrape_telegram_links_from_data import batch_link_results
+        groups = shared.groups() if self.edges_path else None
+        if self.pool is None:
+            results = [batch_link_results(shared.batch, self.include_comments, groups)]
+        else:
+            futures = [self.pool.submit(batch_link_results, shared.batch.slice(start, end - start), self.include_comments,
+                                        None if groups is None else groups[start:end])
+                       for start, end in self.row_slices(shared.num_rows)]
+            results = [future.result() for future in futures]
+        for links, edges in results:
+            self.links.extend(links)
+            self.edges.extend(edges)
+
+    def finish(self):
+        import pandas as pd
+        self.stop_pool()
+        normalized_links = pd.concat(self.links, ignore_index=True) if self.links else pd.Series([], dtype=object)
+        link_counts = normalized_links.value_counts().reset_index()
+        link_counts.columns = ['Telegram Link', 'Frequency']
+        print(f"Saving the Telegram links to '{self.output_path}'...")
+        link_counts.to_excel(self.output_path, index=False)
+        output_paths = [self.output_path]
+
+        if self.edges_path:
+            if self.edges:
+                edges = pd.concat(self.edges, ignore_index=True)
+                edges = edges.groupby(['Source Group', 'Target Channel']).size().reset_index(name='Weight')
+                edges = edges.sort_values(by='Weight', ascending=False, kind='stable').reset_index(drop=True)
+            else:
+                edges = pd.DataFrame(columns=['Source Group', 'Target Channel', 'Weight'])
+            if self.edges_path.endswith('.parquet'):
+                edges.to_parquet(self.edges_path, index=False)
+            elif self.edges_path.endswith('.csv'):
+                edges.to_csv(self.edges_path, index=False)
+            else:
+                edges.to_excel(self.edges_path, index=False)
+            print(f"Link graph with {len(edges)} edges saved to '{self.edges_path}'")
+            output_paths.append(self.edges_path)
+        self.links, self.edges = [], []
+        return output_paths
+
+class SampleConsumer(PipelineConsumer):
+
+    # Proportional stratified sample of sample_data_from_parquet_to_excel.py: the scan fills the reservoir, and only
+    # the sampled rows are read back from their files at the end.
+
+    # Parameters:
+    # output_path (str): Path of the Excel file of the sample.
+    # sample_size (int): The maximum number of rows to sample.
+    # text_column, category_column (str): Column names.
+    # min_length (int): Minimum length of text content to include in the sample.
+    # seed (int): Seed for a reproducible sample.
+
+    name = 'sample'
+
+    def __init__(self, output_path, sample_size, text_column='Content', category_column='Group', min_length=0, seed=None):
+        from sample_data_from_parquet_to_excel import StratifiedReservoir
+        self.output_path = output_path
+        self.text_column = text_column
+        self.category_column = category_column
+        self.min_length = min_length
+        self.columns = [category_column, text_column]
+        self.reservoir = StratifiedReservoir(sample_size, seed)
+        self.scan_files = []
+
+    def start(self, scan_files):
+        self.scan_files = scan_files
+
+    def consume(self, shared):
+        from sample_data_from_parquet_to_excel import add_batch_to_reservoir
+        add_batch_to_reservoir(self.reservoir, shared.batch, self.text_column, self.category_column, self.min_length, shared.rows)
+
+    def finish(self):
+        import numpy as np
+        import pandas as pd
+        from sample_data_from_parquet_to_excel import save_sample
+        selected = self.reservoir.select()
+        unique_rows, positions = np.unique(selected, return_inverse=True)
+        parts = [read_scan_rows(scan_file, unique_rows[(unique_rows >= scan_file.first_row) & (unique_rows < scan_file.first_row + scan_file.num_rows)]
+                                - scan_file.first_row) for scan_file in self.scan_files]
+        parts = [part for part in parts if len(part)]
+        sample_df = pd.concat(parts, ignore_index=True) if parts else pd.DataFrame(columns=self.columns)
+        save_sample(sample_df.iloc[positions].reset_index(drop=True), self.text_column, self.output_path)
+        return [self.output_path]
+
+class CombineConsumer(PipelineConsumer):
+
+    # Streaming combine of combine_scraped_parquet_files.py (see StreamingCombiner): removes the duplicates exactly,
+    # counts the comments, converts 'Media' and writes the rows sorted by 'Date' in descending order.
+
+    # Parameters:
+    # output_file_path (str): Path to save the combined Parquet file.
+    # duplicate_columns (list of str): List of column names to check for duplicates.
+    # comments_format (str): None to keep 'Comments List' as stored, or 'nested' to convert JSON strings.
+    # rows_per_bucket (int): Approximate number of rows held in memory at once.
+    # temp_folder (str): Folder for the temporary buckets.
+
+    name = 'combine'
+    deduplicated = False  # Deduplicates exactly on its own
+
+    def __init__(self, output_file_path, duplicate_columns=('Group', 'Message ID'), comments_format=None, rows_per_bucket=1000000,
+                 temp_folder=None):
+        self.output_file_path = output_file_path
+        self.duplicate_columns = list(duplicate_columns)
+        self.comments_format = comments_format
+        self.rows_per_bucket = rows_per_bucket
+        self.temp_folder = temp_folder
+        self.combiner = None
+        self.skipped = []
+
+    def start(self, scan_files):
+        from combine_scraped_parquet_files import StreamingCombiner, combined_schema, is_empty_parquet
+        # Like combine_parquet_files, files that are empty or hold only missing values are left out
+        self.skipped = [index for index, scan_file in enumerate(scan_files) if is_empty_parquet(scan_file.path)]
+        kept = [scan_file for index, scan_file in enumerate(scan_files) if index not in self.skipped]
+        schema = combined_schema([scan_file.schema for scan_file in kept], self.comments_format)
+        self.combiner = StreamingCombiner(schema, self.duplicate_columns, self.output_file_path,
+                                          sum(scan_file.num_rows for scan_file in kept), self.comments_format, self.rows_per_bucket,
+                                          temp_folder=self.temp_folder)
+
+    def consume(self, shared):
+        import numpy as np
+        kept = ~np.isin(shared.files, self.skipped)
+        if kept.all():
+            self.combiner.add(shared.table())
+        elif kept.any():
+            self.combiner.add(shared.table().filter(kept))
+
+    def close(self):
+        if self.combiner is not None:
+            self.combiner.close()
+
+    def finish(self):
+        num_rows, num_comments = self.combiner.finish()
+        print(f" / Number of rows in the combined dataframe: {num_rows}")
+        print(f" / Number of comments: {num_comments}")
+        print(f" / Combined file saved at: {self.output_file_path}")
+        return [self.output_file_path]
+
+def read_scan_rows(scan_file, rows):
+
+    # Read the given rows (numbers within the file, sorted) of a file of the scan, as the scan returned them.
+
+    from keyword_index import read_rows
+    from partitioned_dataset import partition_values
+    df = read_rows(scan_file.path, rows)
+    if scan_file.base_dir is not None:
+        # Files of a partitioned dataset get their group from their folder
+        df['Group'] = partition_values(scan_file.path, scan_file.base_dir)['Group']
+    return df[[name for name in scan_file.schema.names if name in df.columns]]
+
+def scan_files_of(source):
+
+    # List the files of a scan: a Parquet file, a folder of Parquet files (e.g. the scraped parts) or a dataset
+    # folder partitioned by group and month (whose files get their 'Group' from their folder).
+
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    from partitioned_dataset import dataset_files, partition_values
+
+    scan_files = []
+    first_row = 0
+    for file_path in dataset_files(source):
+        base_dir = source if os.path.isdir(source) and partition_values(file_path, source) else None
+        schema = pq.read_schema(file_path).remove_metadata()
+        if base_dir is not None and 'Group' not in schema.names:
+            # At its place in the scraper's schema, after 'Type' (see partitioned_dataset.dataset_columns)
+            position = schema.get_field_index('Type') + 1 if 'Type' in schema.names else 0
+            schema = schema.insert(position, pa.field('Group', pa.string()))
+        num_rows = pq.ParquetFile(file_path).metadata.num_rows
+        scan_files.append(ScanFile(file_path, base_dir, first_row, num_rows, schema))
+        first_row += num_rows
+    return scan_files
+
+class RowDeduplicator:
+
+    # Drops the rows whose duplicate columns were already seen in the scan (the first copy is kept, like the combine
+    # scripts), so the consumers do not count a message scraped twice twice.
+
+    # Only a 64-bit hash of the key of each seen row is kept (8 bytes per row, in a sorted numpy array); two different
+    # keys with the same hash are practically impossible at the sizes of a scan (a chance of about 3 in a million for 10 million rows).
+    # 'Group' is compared with its '@' and 'Message ID' as text, as in the combine scripts.
+
+    def __init__(self, columns):
+        import numpy as np
+        self.columns = list(columns)
+        self.seen = np.empty(0, dtype=np.uint64)
+        self.duplicates = 0
+
+    def keep(self, shared):
+
+        # Return the mask of the rows of a SharedBatch seen for the first time.
+
+        import numpy as np
+        import pandas as pd
+        keys = pd.DataFrame({column: shared.batch.column(column).to_pandas().astype(str) for column in self.columns})
+        if 'Group' in keys.columns:
+            keys['Group'] = shared.groups()
+        hashes = pd.util.hash_pandas_object(keys, index=False).to_numpy()
+
+        mask = np.zeros(len(hashes), dtype=bool)
+        mask[np.unique(hashes, return_index=True)[1]] = True
+        if len(self.seen):
+            positions = np.minimum(np.searchsorted(self.seen, hashes), len(self.seen) - 1)
+            mask &= self.seen[positions] != hashes
+        self.seen = np.union1d(self.seen, hashes[mask])
+        self.duplicates += int(len(mask) - mask.sum())
+        return mask
+
+def scan_columns(scan_file, consumers, extra_columns=()):
+
+    # Columns read from a file: those of its consumers (all if one of them needs all), in the order of the file.
+
+    if any(consumer.columns is None for consumer in consumers):
+        return scan_file.schema.names
+    needed = set(extra_columns).union(*[consumer.columns for consumer in consumers])
+    return [name for name in scan_file.schema.names if name in needed]
+
+def run_pipeline(source, consumers, batch_size=100000, workers=None, dedupe_columns=None, progress_interval=10, metrics=None,
+                 processes=None):
+
+    # Read a dataset once, as a stream of Arrow batches, and feed every batch to every consumer.
+
+    # Parameters:
+    # source (str): A Parquet file (e.g. the unified file), a folder of Parquet files (e.g. the scraped parts) or a
+    #               dataset folder partitioned by group and month. Consumers get the rows as stored in these files.
+    # consumers (list of PipelineConsumer): The consumers, e.g. KeywordFilterConsumer, RollupConsumer, LinkConsumer,
+    #                                       SampleConsumer and CombineConsumer.
+    # batch_size (int): Number of rows read at a time.
+    # workers (int): Number of threads running the consumers of a batch (default: one per consumer).
+    # dedupe_columns (list of str): If set, rows whose values in these columns were already seen are not given to the
+    #                               consumers (except CombineConsumer, which removes them exactly on its own). Use it
+    #                               when the source is the scraped parts, e.g. ['Group', 'Message ID'].
+    # progress_interval (float): Seconds between two progress lines (None: no progress).
+    # metrics (PipelineMetrics): Metrics to update (default: a new one); each consumer's time is counted in
+    #                            'consumer_seconds_total{consumer="..."}'.
+    # processes (int): Number of worker processes of the keyword and link consumers that were not given their own
+    #                  'processes' (None: they run in their threads and hold the GIL while matching).
+
+    # Returns:
+    # dict: {consumer name: result of its finish()} (the paths of the files it wrote, for the built-in consumers).
+
+    # Example:
+    # consumers = [KeywordFilterConsumer(['Trump', 'Biden'], 'reports/filtered_keywords'),
+    #              RollupConsumer('reports/resume_rollup.parquet', report_folder='reports'),
+    #              LinkConsumer('reports/telegram_links.xlsx', 'reports/link_graph.parquet', include_comments=True),
+    #              SampleConsumer('reports/sampled_data.xlsx', 10000, min_length=20, seed=42)]
+    # run_pipeline('unified_data_telegram.parquet', consumers)
+
+    import numpy as np
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    from partitioned_dataset import iter_dataset_batches
+    from pipeline_metrics import PipelineMetrics
+
+    metrics = metrics or PipelineMetrics('pipeline_runner', progress_interval)
+    if processes:
+        for consumer in consumers:
+            if isinstance(consumer, (KeywordFilterConsumer, LinkConsumer)) and not consumer.processes:
+                consumer.processes = processes
+    scan_files = scan_files_of(source)
+    total_rows = sum(scan_file.num_rows for scan_file in scan_files)
+    deduplicator = RowDeduplicator(dedupe_columns) if dedupe_columns else None
+
+    def file_batches():
+        for index, scan_file in enumerate(scan_files):
+            columns = scan_columns(scan_file, consumers, dedupe_columns or ())
+            row = scan_file.first_row
+            for batch in iter_dataset_batches(scan_file.path, columns=columns, batch_size=batch_size, base_dir=scan_file.base_dir):
+                yield batch, np.arange(row, row + batch.num_rows, dtype=np.int64), np.full(batch.num_rows, index, dtype=np.int64)
+                row += batch.num_rows
+
+    def batches():
+        # Small files (e.g. the partitions of a dataset folder) are coalesced into batches of about batch_size
+        # rows, so that the consumers' per-batch overhead is paid once per batch_size rows, not once per file
+        pending = []
+        for batch, rows, files in file_batches():
+            if pending and (batch.schema != pending[0][0].schema or sum(len(part[1]) for part in pending) >= batch_size):
+                yield coalesce(pending)
+                pending = []
+            pending.append((batch, rows, files))
+        if pending:
+            yield coalesce(pending)
+
+    def coalesce(parts):
+        if len(parts) == 1:
+            return SharedBatch(*parts[0])
+        batch = pa.Table.from_batches([part[0] for part in parts]).combine_chunks().to_batches()[0]
+        return SharedBatch(batch, np.concatenate([part[1] for part in parts]), np.concatenate([part[2] for part in parts]))
+
+    def consume(consumer, shared):
+        start_time = time.perf_counter()
+        consumer.consume(shared)
+        return time.perf_counter() - start_time
+
+    print(f"Scanning {total_rows} rows of {len(scan_files)} file(s) for: {', '.join(consumer.name for consumer in consumers)}")
+    scan_start = time.perf_counter()
+    # One thread reads the next batch while the pool runs the consumers of the current one
+    reader = ThreadPoolExecutor(max_workers=1)
+    executor = ThreadPoolExecutor(max_workers=workers or len(consumers))
+    try:
+        for consumer in consumers:
+            consumer.start(scan_files)
+        iterator = batches()
+        pending = reader.submit(next, iterator, None)
+        while True:
+            shared = pending.result()
+            if shared is None:
+                break
+            pending = reader.submit(next, iterator, None)
+
+            deduplicated = shared
+            if deduplicator is not None:
+                mask = deduplicator.keep(shared)
+                if not mask.all():
+                    deduplicated = SharedBatch(shared.batch.filter(pa.array(mask)), shared.rows[mask], shared.files[mask])
+
+            futures = [(consumer, executor.submit(consume, consumer, deduplicated if consumer.deduplicated else shared)) for consumer in consumers]
+            for consumer, future in futures:
+                metrics.inc('consumer_seconds_total', future.result(), consumer=consumer.name)
+            metrics.inc('messages_total', deduplicated.num_rows)
+            if 'Comments' in deduplicated.names:
+                metrics.inc('comments_total', int(pc.sum(deduplicated.batch.column('Comments')).as_py() or 0))
+            elif 'comment_counts' in deduplicated.cache:
+                metrics.inc('comments_total', int(deduplicated.cache['comment_counts'].sum()))
+            metrics.progress = (shared.rows[-1] + 1) / total_rows
+            metrics.maybe_report()
+    except BaseException:
+        for consumer in consumers:
+            consumer.close()
+        raise
+    finally:
+        executor.shutdown()
+        reader.shutdown(cancel_futures=True)
+    scan_seconds = time.perf_counter() - scan_start
+    metrics.set('scan_seconds', scan_seconds)
+    if deduplicator is not None:
+        metrics.inc('duplicates_total', deduplicator.duplicates)
+        print(f"{deduplicator.duplicates} duplicated rows skipped (columns {dedupe_columns})")
+    metrics.maybe_report(force=True)
+
+    results = {}
+    for consumer in consumers:
+        start_time = time.perf_counter()
+        results[consumer.name] = consumer.finish()
+        metrics.inc('consumer_seconds_total', time.perf_counter() - start_time, consumer=consumer.name)
+
+    print(f"Scan: {scan_seconds:.1f}s")
+    for consumer in consumers:
+        print(f" / {consumer.name}: {metrics.counter('consumer_seconds_total', consumer=consumer.name):.1f}s")
+    if metrics.jsonl_path or metrics.prometheus_path:
+        metrics.export()
+    return results
+
+def build_consumers(args):
+
+    # The consumers chosen on the command line (see main).
+
+    def output(name):
+        return os.path.join(args.output_folder, name)
+
+    consumers = []
+    if args.combine:
+        consumers.append(CombineConsumer(args.combine, args.duplicate_columns, args.comments_format))
+    if args.keywords:
+        consumers.append(KeywordFilterConsumer(args.keywords, output(args.keywords_output), args.content_col, args.max_rows_per_file,
+                                               args.case_insensitive, args.fold_accents, args.whole_words))
+    if args.rollup:
+        consumers.append(RollupConsumer(args.rollup_store or output(f'{args.summary_base}_rollup.parquet'), args.output_folder,
+                                        args.summary_base, args.summary_metrics, args.summary_format))
+    if args.links:
+        consumers.append(LinkConsumer(output(args.links_output), output(args.edges_output) if args.edges_output else None,
+                                      args.include_comments))
+    if args.sample:
+        consumers.append(SampleConsumer(output(args.sample_output), args.sample, args.content_col, args.category_col,
+                                        args.min_length, args.seed))
+    return consumers
+
+def main(argv=None):
+
+    # Command line of run_pipeline (python pipeline_runner.py --help). Only argparse is imported before the
+    # arguments are parsed; each consumer imports its script when it is created.
+
+    parser = argparse.ArgumentParser(description='Read a scraped dataset once and run the post-processing scripts on the same scan.')
+    parser.add_argument('source', help='Parquet file, folder of Parquet files (e.g. the scraped parts) or partitioned dataset folder')
+    parser.add_argument('--output-folder', default='.', help='Folder of the reports (default: the current folder)')
+    parser.add_argument('--batch-size', type=int, default=100000, help='Rows read at a time')
+    parser.add_argument('--workers', type=int, help='Threads running the consumers (default: one per consumer)')
+    parser.add_argument('--processes', type=int, help='Worker processes of the keyword matching and the link extraction (default: none, they run in threads)')
+    parser.add_argument('--progress-interval', type=float, default=10, help='Seconds between two progress lines')
+
+    combine = parser.add_argument_group('combine')
+    combine.add_argument('--combine', metavar='OUTPUT_FILE', help='Combine the rows into this Parquet file; duplicated rows are then skipped by every consumer')
+    combine.add_argument('--duplicate-columns', nargs='+', default=['Group', 'Message ID'])
+    combine.add_argument('--comments-format', choices=['nested'], help="Convert JSON 'Comments List' strings to the nested format")
+
+    keywords = parser.add_argument_group('keyword filter')
+    keywords.add_argument('--keywords', nargs='+', help='Keep the rows whose content has at least one of these keywords')
+    keywords.add_argument('--keywords-output', default='filtered_keywords', help='Base name of the Excel files')
+    keywords.add_argument('--content-col', default='Content')
+    keywords.add_argument('--case-insensitive', action='store_true')
+    keywords.add_argument('--fold-accents', action='store_true')
+    keywords.add_argument('--whole-words', action='store_true')
+    keywords.add_argument('--max-rows-per-file', type=int, default=1000000)
+
+    rollup = parser.add_argument_group('group x month summary')
+    rollup.add_argument('--rollup', action='store_true', help='Update the rollup store and write the summary tables')
+    rollup.add_argument('--rollup-store', help='Path of the rollup store (default: {summary-base}_rollup.parquet in the output folder)')
+    rollup.add_argument('--summary-base', default='resume', help='Base name of the summary tables')
+    rollup.add_argument('--summary-metrics', nargs='+', default=['Contents', 'Comments', 'Total'])
+    rollup.add_argument('--summary-format', choices=['xlsx', 'csv'], default='xlsx')
+
+    links = parser.add_argument_group('Telegram links')
+    links.add_argument('--links', action='store_true', help='Count the Telegram links and build the link graph')
+    links.add_argument('--links-output', default='telegram_links.xlsx')
+    links.add_argument('--edges-output', default='link_graph.parquet', help="Link graph file ('' to skip it)")
+    links.add_argument('--include-comments', action='store_true', help='Also extract the links of the comments')
+
+    sample = parser.add_argument_group('sample')
+    sample.add_argument('--sample', type=int, metavar='SAMPLE_SIZE', help='Write a proportional sample of this many rows')
+    sample.add_argument('--sample-output', default='sampled_data.xlsx')
+    sample.add_argument('--category-col', default='Group')
+    sample.add_argument('--min-length', type=int, default=0)
+    sample.add_argument('--seed', type=int)
+
+    args = parser.parse_args(argv)
+    consumers = build_consumers(args)
+    if not consumers:
+        parser.error('choose at least one of --combine, --keywords, --rollup, --links and --sample')
+    os.makedirs(args.output_folder, exist_ok=True)
+    run_pipeline(args.source, consumers, args.batch_size, args.workers, args.duplicate_columns if args.combine else None,
+                 args.progress_interval, processes=args.processes)
+
+
+# Usage
+if __name__ == '__main__':
+    # python pipeline_runner.py unified_data_telegram.parquet --keywords Trump Biden Kamala --rollup --links --sample 10000
+    main(sys.argv[1:])
@@ -0,0 +1,185 @@
+import asyncio
+import random
+import time
+
+try:
+    from telethon.errors import FloodWaitError
+except ImportError:  # Offline runs with FakeTelegramClient do not need Telethon
+    class FloodWaitError(Exception):
+        def __init__(self, request=None, capture=0):
+            self.seconds = int(capture)
+            super().__init__(f'A wait of {self.seconds} seconds is required')
+
+class AdaptiveRateLimiter:
+
+    # Token bucket shared by every request of a scraping session (history pages, reply threads, entity resolution).
+
+    # Each request takes a token; tokens are refilled at 'rate' per second, up to 'burst'. When Telegram answers
+    # with a FloodWaitError, every request of the session pauses for the time the server asked for (plus a short
+    # backoff), the failed request is retried, and the rate is cut by 'decrease'. Each successful request raises
+    # the rate again by 'increase' (additive increase, multiplicative decrease), so the session settles just below
+    # the highest rate the server tolerates.
+
+    # Parameters:
+    # rate (float): Initial number of requests per second.
+    # burst (int): Maximum number of requests sent at once after an idle period.
+    # min_rate (float): The rate never goes below this value.
+    # max_rate (float): The rate never goes above this value.
+    # increase (float): Requests per second added after each successful request.
+    # decrease (float): Factor applied to the rate after each flood error.
+    # max_retries (int): Number of times a request is retried after a flood or connection error.
+    # backoff (float): Base of the extra exponential wait added to the server's wait time (seconds).
+    # max_flood_wait (int): Flood waits longer than this are not waited for; the error is raised instead.
+    # metrics (PipelineMetrics): If set, receives the number of requests ('api_calls_total'), their latency
+    #                            ('api_latency_seconds') and the flood waits ('flood_waits_total', 'flood_wait_seconds_total'),
+    #                            which its progress line reports.
+    # report_interval (float): Without metrics, minimum number of seconds between two lines about flood waits.
+
+    # Example:
+    # limiter = AdaptiveRateLimiter(rate=10)
+    # entity = await limiter.call(lambda: client.get_entity('@channel'))
+    # async for message in limiter.iter_messages(client, entity, limit=500):
+    #     ...
+
+    def __init__(self, rate=10.0, burst=10, min_rate=0.2, max_rate=30.0, increase=0.05, decrease=0.5,
+                 max_retries=5, backoff=1.0, max_flood_wait=3600, metrics=None, report_interval=10.0):
+        self.rate = rate
+        self.burst = burst
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.decrease = decrease
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_flood_wait = max_flood_wait
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = asyncio.Lock()
+        self.requests = 0
+        self.floods = 0
+        self.waited = 0.0
+        self.metrics = metrics
+        self.report_interval = report_interval
+        self.last_report = None
+
+    async def acquire(self):
+
+        # Waits until a token is available (and any flood pause is over), then takes it.
+
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    self.requests += 1
+                    if self.metrics:
+                        self.metrics.inc('api_calls_total')
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def observe_latency(self, start_time):
+        if self.metrics:
+            self.metrics.observe('api_latency_seconds', time.perf_counter() - start_time)
+
+    def on_success(self):
+        self.rate = min(self.max_rate, self.rate + self.increase)
+
+    def on_flood(self, seconds, attempt=1):
+
+        # Pauses every request for the server's wait time plus an exponential backoff, and slows down.
+
+        now = time.monotonic()
+        wait = seconds + self.backoff * (2 ** (attempt - 1)) * (1 + random.random())
+        if now >= self.paused_until:
+            # Requests in flight when the flood started fail too: slow down once per flood, not once per request
+            self.rate = max(self.min_rate, self.rate * self.decrease)
+        self.paused_until = max(self.paused_until, now + wait)
+        self.tokens = 0.0
+        self.floods += 1
+        self.waited += wait
+        if self.metrics:
+            self.metrics.inc('flood_waits_total')
+            self.metrics.inc('flood_wait_seconds_total', wait)
+        elif self.last_report is None or now - self.last_report >= self.report_interval:
+            self.last_report = now
+            print(f'Flood wait of {seconds}s requested by Telegram: pausing {wait:.1f}s, rate lowered to {self.rate:.2f} requests/s '
+                  f'({self.floods} flood waits, {self.waited:.0f}s waited so far)')
+
+    def retry_or_raise(self, error, attempt):
+
+        # Handles an error of a request: returns if it should be retried, raises it otherwise.
+
+        if attempt > self.max_retries:
+            raise error
+        if isinstance(error, FloodWaitError):
+            if error.seconds > self.max_flood_wait:
+                raise error
+            self.on_flood(error.seconds, attempt)
+        elif isinstance(error, (ConnectionError, asyncio.TimeoutError)):
+            self.paused_until = max(self.paused_until, time.monotonic() + self.backoff * 2 ** (attempt - 1))
+        else:
+            raise error
+
+    async def call(self, request):
+
+        # Runs a single request (a function returning an awaitable) under the limiter, retrying flood errors.
+
+        attempt = 0
+        while True:
+            await self.acquire()
+            start_time = time.perf_counter()
+            try:
+                result = await request()
+            except Exception as e:
+                attempt += 1
+                self.retry_or_raise(e, attempt)
+                continue
+            self.observe_latency(start_time)
+            self.on_success()
+            return result
+
+    async def iter_messages(self, client, entity, page_size=100, **kwargs):
+
+        # Rate-limited client.iter_messages: one token per page of 'page_size' messages (Telethon fetches up to 100
+        # messages per request). If a request fails with a flood error, the iteration waits and resumes right after
+        # the last message received (offset_id), so no message is lost or repeated.
+
+        limit = kwargs.pop('limit', None)
+        received = 0
+        last_id = None
+        attempt = 0
+        while True:
+            resume_kwargs = dict(kwargs)
+            if received:
+                # Messages after the last one received ('offset_id' works in both directions, with reverse=True too)
+                resume_kwargs.pop('offset_date', None)
+                resume_kwargs['offset_id'] = last_id
+            remaining = None if limit is None else limit - received
+            try:
+                iterator = client.iter_messages(entity, limit=remaining, **resume_kwargs).__aiter__()
+                fetched = 0
+                while True:
+                    if fetched % page_size == 0:
+                        await self.acquire()
+                        start_time = time.perf_counter()
+                    try:
+                        message = await iterator.__anext__()
+                    except StopAsyncIteration:
+                        return
+                    if fetched % page_size == 0:
+                        self.observe_latency(start_time)
+                        self.on_success()
+                        attempt = 0
+                    fetched += 1
+                    received += 1
+                    last_id = message.id
+                    yield message
+            except Exception as e:
+                attempt += 1
+                self.retry_or_raise(e, attempt)
@@ -3,7 +3,10 @@ import pandas as pd
 from tqdm import tqdm
 import numpy as np
 import re
-import json
+import pyarrow.compute as pc
+from comments_schema import decode_comments_list
+from excel_export import write_excel
+from keyword_matcher import URL_PATTERN
 
 def remove_urls(text):
     
@@ -15,11 +18,120 @@ def remove_urls(text):
     # Returns:
     # str: The text without URLs.
     
-    url_pattern = r'http\S+|www\S+'
-    cleaned_text = re.sub(url_pattern, '', text)
+    cleaned_text = re.sub(URL_PATTERN, '', text)
     return cleaned_text
 
-def sample_data_proportionally(df, text_column, category_column, sample_size):
+class StratifiedReservoir:
+
+    # Streaming proportional stratified sampler: one reservoir per category, filled batch by batch.
+
+    # Every row gets a random key. Each category keeps at most 'sample_size' rows: the ones with text first, then
+    # the ones with the smallest keys. When all batches were added, each category contributes
+    # max(1, ceil(sample_size * category rows / total rows)) rows, like sample_data_proportionally always did.
+    # Only row numbers are kept, so any number of rows can be streamed through it with a memory bound of
+    # 'sample_size' rows per category.
+
+    # Parameters:
+    # sample_size (int): The maximum number of rows to sample.
+    # seed (int): Seed of the random generator, for reproducible samples (None: a different sample each time).
+
+    # Example:
+    # reservoir = StratifiedReservoir(10000, seed=42)
+    # reservoir.add(categories, has_text)   # once per batch, in row order
+    # rows = reservoir.select()
+
+    def __init__(self, sample_size, seed=None):
+        self.sample_size = sample_size
+        self.rng = np.random.default_rng(seed)
+        self.codes = {}
+        self.counts = np.zeros(0, dtype=np.int64)
+        self.rows_seen = 0
+        self.reservoir = {'code': np.empty(0, dtype=np.int64), 'priority': np.empty(0, dtype=bool),
+                          'key': np.empty(0), 'row': np.empty(0, dtype=np.int64)}
+
+    def add(self, categories, priority, rows=None):
+
+        # Add a batch of rows.
+
+        # Parameters:
+        # categories (array-like): The category of each row.
+        # priority (array-like of bool): True for the rows that have text (sampled first).
+        # rows (array-like of int): Row numbers (default: consecutive numbers continuing the previous batches).
+
+        batch_codes, uniques = pd.factorize(pd.Series(categories, dtype=object), use_na_sentinel=False)
+        for value in uniques:
+            self.codes.setdefault(value, len(self.codes))
+        codes = np.array([self.codes[value] for value in uniques], dtype=np.int64)[batch_codes]
+        if rows is None:
+            rows = np.arange(self.rows_seen, self.rows_seen + len(codes), dtype=np.int64)
+        self.rows_seen += len(codes)
+        self.counts = np.concatenate([self.counts, np.zeros(len(self.codes) - len(self.counts), dtype=np.int64)])
+        self.counts += np.bincount(codes, minlength=len(self.codes))
+
+        # Sort key: category, rows with text first, then the random key (code * 2 + no text + key in [0, 1))
+        keys = codes * 2 + ~np.asarray(priority, dtype=bool) + self.rng.random(len(codes))
+
+        # Rows that cannot beat the last row of a full reservoir are dropped before sorting
+        thresholds = np.full(len(self.codes), np.inf)
+        codes_kept, sort_keys = self.reservoir['code'], self.reservoir['key']
+        if len(codes_kept):
+            last = np.flatnonzero(np.r_[codes_kept[1:] != codes_kept[:-1], True])
+            full = self.rank_in_category(codes_kept)[last] + 1 >= self.sample_size
+            thresholds[codes_kept[last][full]] = sort_keys[last][full]
+        candidates = keys < thresholds[codes]
+
+        merged = {
+            'code': np.concatenate([self.reservoir['code'], codes[candidates]]),
+            'priority': np.concatenate([self.reservoir['priority'], np.asarray(priority, dtype=bool)[candidates]]),
+            'key': np.concatenate([self.reservoir['key'], keys[candidates]]),
+            'row': np.concatenate([self.reservoir['row'], np.asarray(rows, dtype=np.int64)[candidates]]),
+        }
+        # Keep the first 'sample_size' rows of each category
+        order = np.argsort(merged['key'], kind='stable')
+        merged = {name: values[order] for name, values in merged.items()}
+        keep = self.rank_in_category(merged['code']) < self.sample_size
+        self.reservoir = {name: values[keep] for name, values in merged.items()}
+
+    @staticmethod
+    def rank_in_category(codes):
+
+        # Position of each row within its category, for rows sorted by category.
+
+        starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]]) if len(codes) else np.empty(0, dtype=np.int64)
+        return np.arange(len(codes)) - np.repeat(starts, np.diff(np.r_[starts, len(codes)]))
+
+    def select(self):
+
+        # Return the sampled row numbers, grouped by category (in order of first appearance).
+
+        # A category with fewer rows with text than its share gets all of them, completed with rows without
+        # text drawn with replacement.
+
+        total_rows = self.counts.sum()
+        if not total_rows:
+            return np.empty(0, dtype=np.int64)
+        quotas = np.maximum(1, np.ceil(self.counts / total_rows * self.sample_size)).astype(np.int64)
+
+        codes, priority, rows = self.reservoir['code'], self.reservoir['priority'], self.reservoir['row']
+        with_text = np.bincount(codes[priority], minlength=len(self.counts))
+
+        selected = []
+        starts = np.searchsorted(codes, np.arange(len(self.counts)))
+        ends = np.searchsorted(codes, np.arange(len(self.counts)), side='right')
+        for code in tqdm(range(len(self.counts)), desc="Sampling categories"):
+            quota = quotas[code]
+            category_rows = rows[starts[code]:ends[code]]
+            if with_text[code] >= quota:
+                selected.append(category_rows[:quota])
+            elif with_text[code]:
+                without_text = category_rows[with_text[code]:]
+                fill = without_text if len(without_text) else category_rows[:with_text[code]]
+                selected.append(np.concatenate([category_rows[:with_text[code]], self.rng.choice(fill, quota - with_text[code], replace=True)]))
+            else:
+                selected.append(self.rng.choice(category_rows, quota, replace=True))
+        return np.concatenate(selected)
+
+def sample_data_proportionally(df, text_column, category_column, sample_size, seed=None, dedupe_clusters=False):
     
     # Sample data proportionally based on categories to reach a maximum sample size,
     # rounding up and ensuring at least one sample per category.
@@ -29,39 +141,127 @@ def sample_data_proportionally(df, text_column, category_column, sample_size):
     # text_column (str): The column name containing the text data.
     # category_column (str): The column name containing the category data.
     # sample_size (int): The maximum number of rows to sample.
+    # seed (int): Seed for a reproducible sample (default: a different sample each time).
+    # dedupe_clusters (bool): Sample one message per near-duplicate cluster (its canonical message if present), so
+    #                         texts forwarded to many channels are not over-represented. Needs the columns added
+    #                         by near_duplicates.add_near_duplicate_columns.
 
     # Returns:
     # DataFrame: A DataFrame containing the sampled data.
-    
-    sample_df = pd.DataFrame()
-    categories = df[category_column].unique()
-    total_rows = len(df)
-
-    for category in tqdm(categories, desc="Sampling categories"):
-        category_df = df[df[category_column] == category]
-        category_size = len(category_df)
-        proportion = category_size / total_rows
-        category_sample_size = max(1, int(np.ceil(proportion * sample_size)))
-
-        # Prioritize rows with content in text_column
-        non_empty_text_df = category_df[category_df[text_column].notna() & (category_df[text_column].str.strip() != "")]
-
-        if len(non_empty_text_df) >= category_sample_size:
-            category_sample = non_empty_text_df.sample(category_sample_size)
-        elif not non_empty_text_df.empty:
-            empty_text_sample_size = category_sample_size - len(non_empty_text_df)
-            empty_text_df = category_df[~category_df.index.isin(non_empty_text_df.index)]
-            empty_text_sample = empty_text_df.sample(empty_text_sample_size, replace=True)
-            category_sample = pd.concat([non_empty_text_df, empty_text_sample])
-        else:
-            # If all text_column entries are empty, sample from the original category_df
-            category_sample = category_df.sample(category_sample_size, replace=True)
-
-        sample_df = pd.concat([sample_df, category_sample])
-
-    return sample_df
-
-def create_sampled_file(folder_path, input_filename, text_column, category_column, sample_size, output_filename, min_length):
+
+    # The whole DataFrame is sampled in one pass (see StratifiedReservoir) instead of one mask per category.
+
+    if dedupe_clusters:
+        from near_duplicates import dedupe_by_cluster
+        df = dedupe_by_cluster(df)
+
+    # Prioritize rows with content in text_column
+    priority = (df[text_column].notna() & (df[text_column].astype(str).str.strip() != "")).to_numpy()
+
+    reservoir = StratifiedReservoir(sample_size, seed)
+    reservoir.add(df[category_column].to_numpy(dtype=object), priority)
+    return df.iloc[reservoir.select()]
+
+def add_batch_to_reservoir(reservoir, batch, text_column, category_column, min_length, rows, eligible=None):
+
+    # Add the rows of a batch whose text is longer than min_length to a StratifiedReservoir (rows whose text is only
+    # URLs or spaces are sampled last).
+
+    # Parameters:
+    # reservoir (StratifiedReservoir): The reservoir.
+    # batch (pyarrow.RecordBatch): The rows, with at least the category and text columns.
+    # text_column, category_column (str): Column names.
+    # min_length (int): Minimum length of text content to include in the sample.
+    # rows (numpy.ndarray): The row number of each row of the batch, returned by select().
+    # eligible (numpy.ndarray of bool): Optional mask of the rows that may be sampled at all.
+
+    texts = batch.column(text_column)
+    long_enough = pc.fill_null(pc.greater(pc.utf8_length(texts), min_length), False).to_numpy(zero_copy_only=False)
+    if eligible is not None:
+        long_enough &= eligible
+    without_urls = pc.utf8_trim_whitespace(pc.replace_substring_regex(texts, URL_PATTERN, ''))
+    priority = pc.fill_null(pc.not_equal(without_urls, ''), False).to_numpy(zero_copy_only=False)
+    selected = np.flatnonzero(long_enough)
+    categories = batch.column(category_column).to_pandas().to_numpy(dtype=object)
+    reservoir.add(categories[selected], priority[selected], np.asarray(rows, dtype=np.int64)[selected])
+
+def sample_parquet_proportionally(file_path, text_column, category_column, sample_size, min_length=0, seed=None, batch_size=100000,
+                                  groups=None, date_min=None, date_max=None, dedupe_clusters=False):
+
+    # Sample a Parquet file proportionally based on categories, streaming it in batches.
+
+    # Only the category and text columns are scanned; the full rows are read back for the sampled rows only.
+    # Rows whose text is not longer than min_length are skipped, and rows whose text is only URLs or spaces
+    # are sampled last, as when the URLs are removed before sampling.
+
+    # Parameters:
+    # file_path (str): Path of the Parquet file, or of a dataset folder partitioned by group and month.
+    # text_column (str): The column name containing the text data.
+    # category_column (str): The column name containing the category data.
+    # sample_size (int): The maximum number of rows to sample.
+    # min_length (int): Minimum length of text content to include in the sample.
+    # seed (int): Seed for a reproducible sample.
+    # batch_size (int): Number of rows scanned at a time.
+    # groups (list of str): Only sample these groups (default: all).
+    # date_min, date_max (datetime or str): Only sample the messages of this period (default: all).
+    # dedupe_clusters (bool): Sample one message per near-duplicate cluster (see sample_data_proportionally); the
+    #                         cluster columns are scanned first to choose the messages kept.
+
+    # Returns:
+    # DataFrame: The sampled rows, unmodified.
+
+    from keyword_index import read_rows
+    from partitioned_dataset import open_dataset, dataset_filter, dataset_columns, iter_dataset_batches, load_dataset
+
+    representatives = None
+    if dedupe_clusters:
+        from near_duplicates import cluster_representatives
+        clusters = load_dataset(file_path, columns=['Cluster ID', 'Canonical'], groups=groups, date_min=date_min, date_max=date_max,
+                                as_table=True)
+        representatives = cluster_representatives(clusters.column('Cluster ID').to_numpy(),
+                                                  clusters.column('Canonical').to_numpy(zero_copy_only=False))
+        del clusters
+
+    reservoir = StratifiedReservoir(sample_size, seed)
+    row = 0
+    batches = iter_dataset_batches(file_path, columns=[category_column, text_column], groups=groups, date_min=date_min,
+                                   date_max=date_max, batch_size=batch_size)
+    for batch in tqdm(batches, desc="Scanning rows"):
+        eligible = representatives[row:row + batch.num_rows] if representatives is not None else None
+        add_batch_to_reservoir(reservoir, batch, text_column, category_column, min_length, np.arange(row, row + batch.num_rows), eligible)
+        row += batch.num_rows
+
+    selected = reservoir.select()
+    unique_rows, positions = np.unique(selected, return_inverse=True)
+    if os.path.isdir(file_path) or groups is not None or date_min is not None or date_max is not None:
+        # Row numbers refer to the filtered scan: take them from the same scan
+        dataset = open_dataset(file_path)
+        scanner = dataset.scanner(columns=dataset_columns(dataset, file_path), filter=dataset_filter(dataset, groups, date_min, date_max))
+        sample_df = scanner.take(unique_rows).to_pandas()
+    else:
+        sample_df = read_rows(file_path, unique_rows)
+    return sample_df.iloc[positions].reset_index(drop=True)
+
+def save_sample(sample_df, text_column, output_path):
+
+    # Remove the URLs of the text column of sampled rows, decode their 'Comments List' and save them to an Excel file.
+
+    # Remove URLs from the text column of the sampled rows
+    tqdm.pandas(desc="Removing URLs from text")
+    sample_df[text_column] = sample_df[text_column].progress_apply(remove_urls)
+
+    # Decode the 'Comments List' column (JSON strings or nested lists)
+    if 'Comments List' in sample_df.columns:
+        print("Decoding 'Comments List' column...")
+        sample_df['Comments List'] = decode_comments_list(sample_df['Comments List'])
+
+    # Save the sampled data to a new Excel file
+    write_excel(sample_df, output_path)
+
+    print(f"Sampled data saved in file: {output_path}")
+
+def create_sampled_file(folder_path, input_filename, text_column, category_column, sample_size, output_filename, min_length, seed=None,
+                        groups=None, date_min=None, date_max=None, dedupe_clusters=False):
     
     # Create a sampled file based on the input Parquet file.
 
@@ -73,17 +273,24 @@ def create_sampled_file(folder_path, input_filename, text_column, category_colum
     # sample_size (int): Maximum number of rows to sample.
     # output_filename (str): The name of the output file.
     # min_length (int): Minimum length of text content to include in analysis.
+    # seed (int): Seed for a reproducible sample (default: a different sample each time).
+    # groups (list of str): Only sample these groups (default: all).
+    # date_min, date_max (datetime or str): Only sample the messages of this period (default: all).
+    #                                       input_filename may also be a dataset folder partitioned by group and month
+    #                                       (see partitioned_dataset.py), where these filters skip whole folders.
+    # dedupe_clusters (bool): Sample one message per near-duplicate cluster (needs the columns added by
+    #                         near_duplicates.add_near_duplicate_columns).
 
     # Returns:
     # None
 
     # Steps:
-    # 1. Load the Parquet file into a DataFrame.
-    # 2. Filter the data based on text length.
-    # 3. Remove URLs from the text column.
-    # 4. Decode the 'Comments List' column from JSON, if present.
-    # 5. Sample data proportionally based on categories.
-    # 6. Save the sampled data to a new Excel file.
+    # 1. Stream the category and text columns of the Parquet file, filtering the data based on text length
+    #    (and keeping one message per near-duplicate cluster, if dedupe_clusters is set).
+    # 2. Sample data proportionally based on categories, in a single pass.
+    # 3. Read the sampled rows and remove URLs from their text column.
+    # 4. Decode the 'Comments List' column (JSON or nested), if present.
+    # 5. Save the sampled data to a new Excel file.
 
     # Usage:
     # Place the Parquet file to be sampled in the specified folder path and specify the appropriate column names, sample size, output file name, and minimum text length.
@@ -96,45 +303,29 @@ def create_sampled_file(folder_path, input_filename, text_column, category_colum
     #     category_column="Group",
     #     sample_size=10000,
     #     output_filename='sampled_data.xlsx',
-    #     min_length=20
+    #     min_length=20,
+    #     seed=42
     # )
     
     input_file_path = os.path.join(folder_path, input_filename)
 
-    # Load the Parquet file into a DataFrame
-    print("Loading Parquet file...")
-    df = pd.read_parquet(input_file_path)
+    # Sample data proportionally, reading only the category and text columns
+    print("Sampling Parquet file...")
+    sample_df = sample_parquet_proportionally(input_file_path, text_column, category_column, sample_size, min_length, seed,
+                                              groups=groups, date_min=date_min, date_max=date_max, dedupe_clusters=dedupe_clusters)
 
-    # Filter the data based on text length
-    tqdm.pandas(desc="Filtering based on text length")
-    df = df[df[text_column].str.len() > min_length]
-
-    # Remove URLs from the text column
-    tqdm.pandas(desc="Removing URLs from text")
-    df[text_column] = df[text_column].progress_apply(remove_urls)
-
-    # Decode the 'Comments List' column from JSON
-    if 'Comments List' in df.columns:
-        tqdm.pandas(desc="Decoding 'Comments List' column")
-        df['Comments List'] = df['Comments List'].progress_apply(lambda x: json.loads(x) if pd.notnull(x) else x)
-
-    # Sample data proportionally
-    sample_df = sample_data_proportionally(df, text_column, category_column, sample_size)
-
-    # Save the sampled data to a new Excel file
-    output_path = os.path.join(folder_path, output_filename)
-    sample_df.to_excel(output_path, index=False, engine='openpyxl')
-
-    print(f"Sampled data saved in file: {output_path}")
+    save_sample(sample_df, text_column, os.path.join(folder_path, output_filename))
 
 
 # Usage
-folder_path = r'C:\Users\Public\PyCharmProjects\Data_Conspira' # Example
-input_filename = "unified_data_telegram.parquet" # Example
-text_column = "Content"
-category_column = "Group"
-sample_size = 10000 # Example
-output_filename = 'sampled_data.xlsx' # Example
-min_length = 20 # Example
-
-create_sampled_file(folder_path, input_filename, text_column, category_column, sample_size, output_filename, min_length)
+if __name__ == '__main__':
+    folder_path = r'C:\Users\Public\PyCharmProjects\Data_Conspira' # Example
+    input_filename = "unified_data_telegram.parquet" # Example
+    text_column = "Content"
+    category_column = "Group"
+    sample_size = 10000 # Example
+    output_filename = 'sampled_data.xlsx' # Example
+    min_length = 20 # Example
+    seed = 42 # Example: same seed, same sample
+
+    create_sampled_file(folder_path, input_filename, text_column, category_column, sample_size, output_filename, min_length, seed)
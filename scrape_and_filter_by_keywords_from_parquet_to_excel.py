@@ -1,9 +1,47 @@
 import pandas as pd
-from tqdm import tqdm
 import os
-import json
+from comments_schema import decode_comments_list
+from keyword_matcher import match_keywords
+from keyword_index import load_index_meta, update_keyword_index, query_keyword_index, read_rows
+from partitioned_dataset import load_dataset, filter_dataframe, dataset_files, dataset_columns, open_dataset, partition_values
+from excel_export import export_dataframe_to_excel
 
-def filter_and_save_by_keywords(folder_path, input_filename, output_filename, content_col, keywords, max_rows_per_file):
+def save_filtered_rows(filtered_df, output_base, max_rows_per_file, workers=None, dedupe_clusters=False):
+
+    # Decode the 'Comments List' of the rows that matched the keywords and save them to Excel part files.
+
+    # Parameters:
+    # filtered_df (DataFrame): The matching rows, with their keyword columns and 'Keyword_Count'.
+    # output_base (str): Path of the output files, without extension (see excel_export.excel_part_paths).
+    # max_rows_per_file (int): The maximum number of rows per output file.
+    # workers (int): Number of processes writing the Excel parts.
+    # dedupe_clusters (bool): Keep one row per near-duplicate cluster (see filter_and_save_by_keywords).
+
+    # Returns:
+    # list of str: The paths of the Excel files.
+
+    if dedupe_clusters:
+        from near_duplicates import dedupe_by_cluster
+        print("Keeping one message per near-duplicate cluster...")
+        filtered_df = dedupe_by_cluster(filtered_df)
+
+    # Decode the 'Comments List' column (JSON strings or nested lists) of the matching rows only
+    if 'Comments List' in filtered_df.columns:
+        print("Decoding 'Comments List' column...")
+        filtered_df = filtered_df.assign(**{'Comments List': decode_comments_list(filtered_df['Comments List'])})
+
+    # Print the number of rows in the filtered dataframe
+    print(f"Number of rows in the filtered dataframe: {len(filtered_df)}")
+
+    # Split and save the final files, streaming the rows of each part (the parts are written in parallel)
+    output_paths = export_dataframe_to_excel(filtered_df, output_base, max_rows_per_file, workers=workers)
+    for output_path in output_paths:
+        print(f"Filtered file saved at: {output_path}")
+    return output_paths
+
+def filter_and_save_by_keywords(folder_path, input_filename, output_filename, content_col, keywords, max_rows_per_file,
+                                case_insensitive=False, fold_accents=False, whole_words=False, workers=None,
+                                index_folder=None, groups=None, date_min=None, date_max=None, dedupe_clusters=False):
     
     # Filters the rows based on keywords in the specified column, adds a column for each keyword indicating its presence,
     # and saves the result to new Excel files if the maximum number of rows is exceeded.
@@ -15,17 +53,34 @@ def filter_and_save_by_keywords(folder_path, input_filename, output_filename, co
     # keywords (list): The list of keywords to filter the content.
     # output_filename (str): The base name of the output Excel file.
     # max_rows_per_file (int): The maximum number of rows per output file.
+    # case_insensitive (bool): Match keywords ignoring case (default: exact case, as before).
+    # fold_accents (bool): Match keywords ignoring accents, e.g. 'eleicao' finds 'eleição' (default: False).
+    # whole_words (bool): Only match whole words, e.g. 'ato' does not find 'contato' (default: False).
+    # workers (int): Number of processes used to match the keywords and to write the Excel parts (default: number of CPUs).
+    # index_folder (str): Folder of a persistent inverted index (see keyword_index.py). If given, the index is
+    #                     updated with the new messages if the input file changed (e.g. after a combine), and only
+    #                     the rows it returns as candidates are read.
+    # groups (list of str): Only filter the messages of these groups (default: all).
+    # date_min, date_max (datetime or str): Only filter the messages of this period (default: all).
+    #                                       input_filename may also be a dataset folder partitioned by group and month
+    #                                       (see partitioned_dataset.py), where these filters skip whole folders.
+    # dedupe_clusters (bool): Keep one message per near-duplicate cluster among the matches (its canonical message
+    #                         if it matched), so a text forwarded to hundreds of channels is counted once. Needs the
+    #                         columns added by near_duplicates.add_near_duplicate_columns.
 
     # Returns:
     # None
 
     # Steps:
-    # 1. Load the Parquet file into a DataFrame.
-    # 2. Decode the 'Comments List' column from JSON, if present.
-    # 3. Create a new column for each keyword indicating its presence in the content.
-    # 4. Add a column that counts the number of keywords found in each row.
-    # 5. Filter the DataFrame to include only rows where at least one keyword was found.
-    # 6. Split and save the filtered DataFrame into multiple Excel files if necessary.
+    # 1. Load the Parquet file into a DataFrame (only the candidate rows of the keywords, if an index is used).
+    # 2. Create a new column for each keyword indicating its presence in the content
+    #    (all keywords are found in a single scan of each message, see keyword_matcher.py).
+    # 3. Add a column that counts the number of keywords found in each row.
+    # 4. Filter the DataFrame to include only rows where at least one keyword was found
+    #    (and keep one row per near-duplicate cluster, if dedupe_clusters is set).
+    # 5. Decode the 'Comments List' column (JSON or nested) of the matching rows, if present.
+    # 6. Split and save the filtered DataFrame into multiple Excel files if necessary
+    #    (streamed in constant memory and written in parallel, see excel_export.py).
 
     # Usage:
     # Place the Parquet file to be filtered in the specified folder path and specify the appropriate column names, keywords, output file name, and maximum number of rows per file.
@@ -46,17 +101,35 @@ def filter_and_save_by_keywords(folder_path, input_filename, output_filename, co
 
         # Load the Parquet file
         print(f"Loading {input_file_path}...")
-        df = pd.read_parquet(input_file_path)
-
-        # Decode the 'Comments List' column from JSON
-        if 'Comments List' in df.columns:
-            tqdm.pandas(desc="Decoding 'Comments List' column")
-            df['Comments List'] = df['Comments List'].progress_apply(lambda x: json.loads(x) if pd.notnull(x) else x)
+        if index_folder:
+            indexed_columns = load_index_meta(index_folder)['columns'] or []
+            if content_col not in indexed_columns:
+                indexed_columns = indexed_columns + [content_col]
+            file_paths = dataset_files(input_file_path, groups, date_min, date_max)
+            update_keyword_index(index_folder, file_paths, columns=indexed_columns)
+            parts = []
+            for file_path in file_paths:
+                candidates = query_keyword_index(index_folder, keywords, column=content_col, file_path=file_path,
+                                                 exact_tokens=whole_words)
+                part = read_rows(file_path, candidates[os.path.abspath(file_path)])
+                if os.path.isdir(input_file_path):
+                    # Files of a partitioned dataset get their group from their folder
+                    part['Group'] = partition_values(file_path, input_file_path)['Group']
+                parts.append(part)
+            df = pd.concat(parts, ignore_index=True) if parts else load_dataset(input_file_path, groups=groups, date_min=date_min, date_max=date_max)
+            if os.path.isdir(input_file_path):
+                df = df[dataset_columns(open_dataset(input_file_path), input_file_path)]
+            df = filter_dataframe(df, groups, date_min, date_max)
+            print(f"Candidate rows found in the index: {len(df)}")
+        else:
+            df = load_dataset(input_file_path, groups=groups, date_min=date_min, date_max=date_max)
 
         # Create a new column for each keyword
         print("Creating keyword columns...")
-        for keyword in tqdm(keywords, desc="Creating keyword columns"):
-            df[keyword] = df[content_col].astype(str).apply(lambda x: 1 if keyword in x else 0)
+        keyword_columns = match_keywords(df[content_col], keywords, case_insensitive=case_insensitive,
+                                         fold_accents=fold_accents, whole_words=whole_words, workers=workers)
+        for keyword in keywords:
+            df[keyword] = keyword_columns[keyword]
 
         # Add a column that counts the number of keywords found in each row
         print("Adding count of keywords found...")
@@ -65,33 +138,18 @@ def filter_and_save_by_keywords(folder_path, input_filename, output_filename, co
         # Filter the DataFrame to only include rows where at least one keyword was found
         print("Filtering by keywords...")
         filtered_df = df[df['Keyword_Count'] > 0]
-
-        # Print the number of rows in the filtered dataframe
-        print(f"Number of rows in the filtered dataframe: {len(filtered_df)}")
-
-        # Split and save the final files
-        num_files = (len(filtered_df) // max_rows_per_file) + 1
-
-        for i in tqdm(range(num_files), desc="Saving files"):
-            start_row = i * max_rows_per_file
-            end_row = (i + 1) * max_rows_per_file
-            output_df = filtered_df.iloc[start_row:end_row]
-
-            part_suffix = 'unique' if num_files == 1 else f'part_{i + 1}'
-            output_path = os.path.join(folder_path, f'{output_filename}_{part_suffix}.xlsx')
-            output_df.to_excel(output_path, index=False, engine='openpyxl')
-
-            print(f"Filtered file saved at: {output_path}")
+        save_filtered_rows(filtered_df, os.path.join(folder_path, output_filename), max_rows_per_file, workers, dedupe_clusters)
     except Exception as e:
         print(f"An error occurred: {e}")
 
 
 # Usage
-folder_path = r'C:\Users\Public\PyCharmProjects\Data_Conspira' # Example
-input_filename = "unified_data_telegram.parquet" # Example
-content_col = 'Content'
-keywords = ['Trump', 'Biden', 'Kamala']  # Add your keywords here
-output_filename = 'filtered_keywords' # Example
-max_rows_per_file = 1000000  # Adjust the maximum number of rows per file as needed (max for .xlsx is 1,048,576)
-
-filter_and_save_by_keywords(folder_path, input_filename, output_filename, content_col, keywords, max_rows_per_file)
+if __name__ == '__main__':  # Required by the process pool used to match keywords
+    folder_path = r'C:\Users\Public\PyCharmProjects\Data_Conspira' # Example
+    input_filename = "unified_data_telegram.parquet" # Example
+    content_col = 'Content'
+    keywords = ['Trump', 'Biden', 'Kamala']  # Add your keywords here
+    output_filename = 'filtered_keywords' # Example
+    max_rows_per_file = 1000000  # Adjust the maximum number of rows per file as needed (max for .xlsx is 1,048,576)
+
+    filter_and_save_by_keywords(folder_path, input_filename, output_filename, content_col, keywords, max_rows_per_file)
@@ -0,0 +1,78 @@
+import json
+import os
+from datetime import datetime
+
+class ScrapeCheckpoints:
+
+    # Persistent per-channel high-water marks, stored in a small JSON state file.
+
+    # For every (channel, keyword) pair the store keeps:
+    # - 'max_id': the highest message ID scraped so far;
+    # - 'min_id': the lowest message ID scraped so far (scraping is contiguous between both);
+    # - 'backfilled_until': the oldest date the history was completely scraped back to, or None
+    #   if the backfill was interrupted (time limit, message limit, crash).
+
+    # Changes are kept in memory by record() and mark_backfilled() and only written by commit(),
+    # which the scraper calls right after the scraped rows themselves were saved to disk.
+
+    # Parameters:
+    # path (str): Path of the JSON state file; it is created on the first commit.
+
+    # Example:
+    # checkpoints = ScrapeCheckpoints('scrape_checkpoints.json')
+    # data = await scrape_channels(client, channels, date_min, date_max, checkpoints=checkpoints)
+
+    def __init__(self, path):
+        self.path = path
+        self.channels = {}
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as file:
+                self.channels = json.load(file)
+
+    @staticmethod
+    def key(channel, key_search=''):
+        return f'{channel}|{key_search}'
+
+    def get(self, channel, key_search=''):
+
+        # Returns the checkpoint of a channel, or None if it was never scraped.
+
+        return self.channels.get(self.key(channel, key_search))
+
+    def record(self, channel, key_search, message_id):
+
+        # Extends the scraped ID range of a channel with a message that was just scraped.
+
+        state = self.channels.setdefault(self.key(channel, key_search),
+                                         {'max_id': message_id, 'min_id': message_id, 'backfilled_until': None})
+        state['max_id'] = max(state['max_id'], message_id)
+        state['min_id'] = min(state['min_id'], message_id)
+
+    def mark_backfilled(self, channel, key_search, date_min):
+
+        # Records that the history of a channel was completely scraped back to date_min.
+
+        state = self.get(channel, key_search)
+        if state is None:
+            return
+        backfilled_until = state['backfilled_until']
+        if backfilled_until is None or date_min < datetime.fromisoformat(backfilled_until):
+            state['backfilled_until'] = date_min.isoformat()
+
+    def needs_backfill(self, channel, key_search, date_min):
+
+        # Returns True if messages older than the checkpoint's 'min_id' may still be missing for date_min.
+
+        state = self.get(channel, key_search)
+        if state is None or state['backfilled_until'] is None:
+            return True
+        return date_min < datetime.fromisoformat(state['backfilled_until'])
+
+    def commit(self):
+
+        # Atomically writes the state file (a crash never leaves a half-written file behind).
+
+        temporary_path = f'{self.path}.tmp'
+        with open(temporary_path, 'w', encoding='utf-8') as file:
+            json.dump(self.channels, file, indent=2, ensure_ascii=False)
+        os.replace(temporary_path, self.path)
@@ -0,0 +1,328 @@
+import asyncio
+import glob
+import os
+import socket
+import sqlite3
+import time
+from datetime import datetime
+from multiprocessing import Process
+from parquet_stream_writer import StreamingParquetWriter
+from telegram_scraper import date_slices, message_schema, scrape_channels
+
+# Sharded scraping over several Telegram accounts, coordinated by a durable local work queue.
+#
+# The queue is a SQLite file with one row per unit of work: a channel, or a (channel, date slice) pair. Worker
+# processes, each with its own client (its own account and session file), lease one unit at a time, scrape it
+# into its own Parquet part files and mark it done. While a unit is being scraped its lease is renewed; if a
+# worker dies, its lease expires and the unit goes back to the queue for another worker.
+#
+# Part files are named 'unit_{id}_attempt_{n}_part_{k}.parquet'. When a unit is completed, the parts of its
+# other (crashed or abandoned) attempts are removed, so the output folder can be merged as is with
+# combine_parquet_files(output_folder, ['Group', 'Message ID'], ...).
+#
+# SQLite locking needs a local disk: run the workers of one queue on the same machine (or give each machine
+# its own queue of channels).
+
+class ScrapeWorkQueue:
+
+    # Durable queue of scraping units with leases, stored in a SQLite file.
+
+    # Each unit has a status: 'pending' (waiting for a worker), 'leased' (being scraped until 'lease_until'),
+    # 'done', or 'failed' (it failed 'max_attempts' times). Leases that expired are given back to 'pending'
+    # every time a worker asks for a unit.
+
+    # Parameters:
+    # path (str): Path of the SQLite file (created if missing).
+    # max_attempts (int): Number of failed attempts after which a unit is marked 'failed'.
+
+    # Example:
+    # queue = ScrapeWorkQueue('scrape_queue.sqlite')
+    # queue.add_units(['@canal1', '@canal2'], date_min, date_max, slices=4)
+    # unit = queue.lease('worker-1', lease_seconds=600)
+
+    def __init__(self, path, max_attempts=3):
+        self.path = path
+        self.max_attempts = max_attempts
+        self.connection = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('''
+            CREATE TABLE IF NOT EXISTS units (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                channel TEXT NOT NULL,
+                date_min TEXT NOT NULL,
+                date_max TEXT NOT NULL,
+                key_search TEXT NOT NULL DEFAULT '',
+                status TEXT NOT NULL DEFAULT 'pending',
+                worker TEXT,
+                lease_until REAL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                rows INTEGER,
+                error TEXT,
+                UNIQUE (channel, date_min, date_max, key_search)
+            )''')
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+        return False
+
+    def add_units(self, channels, date_min, date_max, key_search='', slices=1):
+
+        # Queues each channel, split in 'slices' date slices (see telegram_scraper.date_slices).
+        # Units already in the queue (same channel, dates and keyword) are not added twice.
+
+        # Returns:
+        # int: The number of units added.
+
+        units = [(channel, slice_min.isoformat(), slice_max.isoformat(), key_search)
+                 for channel in channels for slice_min, slice_max in date_slices(date_min, date_max, slices)]
+        with self.connection:
+            cursor = self.connection.executemany(
+                'INSERT OR IGNORE INTO units (channel, date_min, date_max, key_search) VALUES (?, ?, ?, ?)', units)
+        return cursor.rowcount
+
+    def requeue_expired(self):
+
+        # Gives the units whose lease expired back to the queue; returns their number.
+
+        cursor = self.connection.execute("UPDATE units SET status = 'pending', worker = NULL, lease_until = NULL "
+                                         "WHERE status = 'leased' AND lease_until < ?", (time.time(),))
+        return cursor.rowcount
+
+    def lease(self, worker, lease_seconds=600):
+
+        # Takes the oldest pending unit for a worker, after requeuing the expired leases.
+
+        # Returns:
+        # dict: The unit ('id', 'channel', 'date_min', 'date_max' (datetimes), 'key_search', 'attempts'),
+        # or None if no unit is pending.
+
+        self.connection.execute('BEGIN IMMEDIATE')
+        try:
+            self.requeue_expired()
+            row = self.connection.execute("SELECT * FROM units WHERE status = 'pending' ORDER BY id LIMIT 1").fetchone()
+            if row is None:
+                self.connection.execute('COMMIT')
+                return None
+            self.connection.execute("UPDATE units SET status = 'leased', worker = ?, lease_until = ?, attempts = attempts + 1 "
+                                    "WHERE id = ?", (worker, time.time() + lease_seconds, row['id']))
+            self.connection.execute('COMMIT')
+        except BaseException:
+            self.connection.execute('ROLLBACK')
+            raise
+        return {
+            'id': row['id'],
+            'channel': row['channel'],
+            'date_min': datetime.fromisoformat(row['date_min']),
+            'date_max': datetime.fromisoformat(row['date_max']),
+            'key_search': row['key_search'],
+            'attempts': row['attempts'] + 1,
+        }
+
+    def renew(self, unit_id, worker, lease_seconds=600):
+
+        # Extends the lease of a unit; returns False if the worker lost it (expired and leased again).
+
+        cursor = self.connection.execute("UPDATE units SET lease_until = ? WHERE id = ? AND worker = ? AND status = 'leased'",
+                                         (time.time() + lease_seconds, unit_id, worker))
+        return cursor.rowcount == 1
+
+    def complete(self, unit_id, worker, rows):
+
+        # Marks a unit as done; returns False if the worker does not hold its lease anymore.
+
+        cursor = self.connection.execute("UPDATE units SET status = 'done', lease_until = NULL, rows = ?, error = NULL "
+                                         "WHERE id = ? AND worker = ? AND status = 'leased'", (rows, unit_id, worker))
+        return cursor.rowcount == 1
+
+    def release(self, unit_id, worker):
+
+        # Gives a unit back to the queue without counting a failure (e.g. the worker reached its time limit).
+
+        cursor = self.connection.execute("UPDATE units SET status = 'pending', worker = NULL, lease_until = NULL "
+                                         "WHERE id = ? AND worker = ? AND status = 'leased'", (unit_id, worker))
+        return cursor.rowcount == 1
+
+    def fail(self, unit_id, worker, error):
+
+        # Gives a unit back to the queue after an error, or marks it 'failed' after 'max_attempts' attempts.
+
+        cursor = self.connection.execute(
+            "UPDATE units SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+            "worker = NULL, lease_until = NULL, error = ? WHERE id = ? AND worker = ? AND status = 'leased'",
+            (self.max_attempts, error, unit_id, worker))
+        return cursor.rowcount == 1
+
+    def counts(self):
+
+        # Returns the number of units of each status, e.g. {'pending': 10, 'leased': 2, 'done': 30}.
+
+        return {row['status']: row['count'] for row in
+                self.connection.execute('SELECT status, COUNT(*) AS count FROM units GROUP BY status')}
+
+def unit_file_name(unit):
+    return f"unit_{unit['id']:06}_attempt_{unit['attempts']:02}"
+
+def remove_unit_parts(output_folder, unit, other_attempts=False):
+
+    # Removes the part files of the unit's current attempt, or with other_attempts, of all its other attempts
+    # (including unfinished '.tmp' parts).
+
+    own_prefix = f'{unit_file_name(unit)}_part_'
+    for path in glob.glob(os.path.join(output_folder, f"unit_{unit['id']:06}_attempt_*_part_*.parquet*")):
+        if os.path.basename(path).startswith(own_prefix) != other_attempts:
+            try:
+                os.remove(path)
+            except FileNotFoundError:  # Renamed or removed by a worker still writing it
+                pass
+
+async def scrape_worker(client, queue_path, output_folder, worker_id=None, lease_seconds=600, time_limit=21600,
+                        max_units=None, comments_format='json', **scrape_kwargs):
+
+    # Lease units from the queue and scrape them with one client until the queue is empty.
+
+    # Parameters:
+    # client (TelegramClient): An already started client (or a FakeTelegramClient), used by this worker only.
+    # queue_path (str): Path of the SQLite work queue.
+    # output_folder (str): Folder of the part files (shared by all workers).
+    # worker_id (str): Name of the worker in the queue (default: host name and process ID).
+    # lease_seconds (int): Duration of a lease; it is renewed every third of it while the unit is scraped, and the
+    #                      scrape of the unit is stopped if the renewal fails (the lease was lost to another worker).
+    # time_limit (int): Time after which the worker stops (the current unit is given back to the queue).
+    # max_units (int): Maximum number of units scraped by this worker.
+    # comments_format (str): Storage of 'Comments List' ('json' or 'nested').
+    # **scrape_kwargs: Other arguments of scrape_channels (max_comment_requests, rate_limiter, ...).
+
+    # Returns:
+    # int: The number of units completed by this worker.
+
+    # Example:
+    # async with TelegramClient('account_1', api_id, api_hash, flood_sleep_threshold=0) as client:
+    #     await scrape_worker(client, 'scrape_queue.sqlite', 'sharded_parts')
+
+    worker_id = worker_id or f'{socket.gethostname()}-{os.getpid()}'
+    schema = message_schema(comments_format, scrape_kwargs.get('typed_columns', False))
+    start_time = time.time()
+    completed_units = 0
+
+    with ScrapeWorkQueue(queue_path) as queue:
+        while max_units is None or completed_units < max_units:
+            remaining_time = time_limit - (time.time() - start_time)
+            if remaining_time <= 0:
+                break
+            unit = queue.lease(worker_id, lease_seconds)
+            if unit is None:
+                break
+            print(f"[{worker_id}] Unit {unit['id']}: {unit['channel']} from {unit['date_min']} to {unit['date_max']} (attempt {unit['attempts']})")
+
+            async def keep_lease():
+                while True:
+                    await asyncio.sleep(lease_seconds / 3)
+                    if not queue.renew(unit['id'], worker_id, lease_seconds):
+                        # The lease expired and another worker took the unit: stop scraping it
+                        outcomes[unit['channel']] = 'lease lost'
+                        scrape.cancel()
+                        return
+
+            writer = StreamingParquetWriter(output_folder, unit_file_name(unit), schema=schema)
+            outcomes = {}
+            scrape = asyncio.create_task(scrape_channels(client, [unit['channel']], unit['date_min'], unit['date_max'],
+                                                         key_search=unit['key_search'], time_limit=remaining_time,
+                                                         writer=writer, comments_format=comments_format,
+                                                         outcomes=outcomes, **scrape_kwargs))
+            heartbeat = asyncio.create_task(keep_lease())
+            try:
+                await scrape
+            except asyncio.CancelledError:
+                if outcomes.get(unit['channel']) != 'lease lost':
+                    raise
+            except Exception as e:
+                outcomes[unit['channel']] = f'{type(e).__name__}: {e}'
+            finally:
+                heartbeat.cancel()
+                writer.close()
+
+            outcome = outcomes.get(unit['channel'], 'interrupted')
+            if outcome == 'complete' and queue.complete(unit['id'], worker_id, writer.rows_written):
+                # Parts left by crashed or abandoned attempts would duplicate the rows of this one
+                remove_unit_parts(output_folder, unit, other_attempts=True)
+                completed_units += 1
+                print(f"[{worker_id}] Unit {unit['id']} done: {writer.rows_written} posts")
+                continue
+
+            # Interrupted, failed, or the lease was lost to another worker: the parts of this attempt are dropped
+            remove_unit_parts(output_folder, unit)
+            if outcome == 'interrupted':
+                queue.release(unit['id'], worker_id)
+            elif outcome not in ('complete', 'lease lost'):
+                queue.fail(unit['id'], worker_id, outcome)
+            print(f"[{worker_id}] Unit {unit['id']} not completed: {outcome if outcome != 'complete' else 'lease lost'}")
+    return completed_units
+
+async def run_client_worker(client_factory, queue_path, output_folder, worker_id=None, **worker_kwargs):
+
+    # Create a client with client_factory, start it and run scrape_worker with it.
+
+    async with client_factory() as client:
+        return await scrape_worker(client, queue_path, output_folder, worker_id, **worker_kwargs)
+
+def worker_process(client_factory, queue_path, output_folder, worker_id=None, **worker_kwargs):
+
+    # Entry point of a worker process: runs its own event loop and its own client.
+
+    return asyncio.run(run_client_worker(client_factory, queue_path, output_folder, worker_id, **worker_kwargs))
+
+def run_sharded_scrape(client_factories, queue_path, output_folder, **worker_kwargs):
+
+    # Start one worker process per client and wait until they all stopped.
+
+    # Parameters:
+    # client_factories (list of callable): One picklable function per account returning a new, not yet started
+    #                                      client, e.g. functools.partial(TelegramClient, 'account_1', api_id, api_hash,
+    #                                      flood_sleep_threshold=0). Each session file must be authorized beforehand.
+    # queue_path (str): Path of the SQLite work queue (filled with ScrapeWorkQueue.add_units).
+    # output_folder (str): Folder of the part files.
+    # **worker_kwargs: Other arguments of scrape_worker (lease_seconds, time_limit, comments_format, ...).
+
+    # Returns:
+    # dict: The number of units of each status at the end.
+
+    # Example:
+    # with ScrapeWorkQueue('scrape_queue.sqlite') as queue:
+    #     queue.add_units(channels, date_min, date_max, slices=4)
+    # accounts = [partial(TelegramClient, f'account_{i}', api_ids[i], api_hashes[i], flood_sleep_threshold=0) for i in range(3)]
+    # run_sharded_scrape(accounts, 'scrape_queue.sqlite', 'sharded_parts')
+    # combine_parquet_files('sharded_parts', ['Group', 'Message ID'], 'unified_data_telegram.parquet')
+
+    ScrapeWorkQueue(queue_path).close()  # Create the queue before the workers open it at the same time
+    processes = [Process(target=worker_process, args=(client_factory, queue_path, output_folder, f'worker-{index + 1}'),
+                         kwargs=worker_kwargs)
+                 for index, client_factory in enumerate(client_factories)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+
+    with ScrapeWorkQueue(queue_path) as queue:
+        counts = queue.counts()
+    print(f"Sharded scrape finished: {counts}")
+    return counts
+
+# Usage
+if __name__ == '__main__':
+    from datetime import timezone
+    from functools import partial
+    from fake_telegram_client import FakeTelegramClient
+
+    # Dry run with three fake accounts sharing a queue of 6 channels x 3 date slices
+    fake_channels = {f'@fake_channel_{i:03}': 600 for i in range(6)}
+    with ScrapeWorkQueue('scrape_queue_test.sqlite') as queue:
+        queue.add_units(list(fake_channels), datetime(2025, 1, 1, tzinfo=timezone.utc), datetime(2025, 1, 15, tzinfo=timezone.utc), slices=3)
+    factories = [partial(FakeTelegramClient, fake_channels, comments_per_post=1, latency=0.01, seed=0)] * 3
+    run_sharded_scrape(factories, 'scrape_queue_test.sqlite', 'sharded_parts_test')
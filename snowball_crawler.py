@@ -0,0 +1,188 @@
+import json
+import os
+import re
+import pandas as pd
+from telegram_scraper import message_schema, scrape_channels
+from parquet_stream_writer import StreamingParquetWriter
+from snowballing_scrape_telegram_links_from_data import build_link_edges
+
+def normalize_channel(channel):
+
+    # Normalize a channel name or link to the form used in the frontier: '@' + lowercase username.
+
+    # Example:
+    # normalize_channel('https://t.me/s/CanalX')  ->  '@canalx'
+
+    channel = re.sub(r'^(?:https?://)?t\.me/(?:s/)?', '', channel.strip()).split('/')[0]
+    return '@' + channel.lstrip('@').lower()
+
+class SnowballFrontier:
+
+    # Persistent crawl frontier of a multi-hop snowball, stored in a small JSON state file.
+
+    # The state keeps:
+    # - 'seen': every channel ever queued, with the hop it was discovered at (a channel is never queued twice);
+    # - 'queue': the channels waiting to be scraped, as [channel, hop] pairs;
+    # - 'scraped': the channels already scraped.
+
+    # Parameters:
+    # path (str): Path of the JSON state file; it is created on the first save.
+
+    # Example:
+    # frontier = SnowballFrontier('snowball_frontier.json')
+    # frontier.add(['@canal1', '@canal2'], hop=0)
+    # channels = frontier.pop(hop=0)
+
+    def __init__(self, path):
+        self.path = path
+        self.state = {'seen': {}, 'queue': [], 'scraped': []}
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as file:
+                self.state = json.load(file)
+
+    def add(self, channels, hop):
+
+        # Queues the channels that were never seen; returns the number of channels added.
+
+        added = 0
+        for channel in channels:
+            channel = normalize_channel(channel)
+            if channel in self.state['seen']:
+                continue
+            self.state['seen'][channel] = hop
+            self.state['queue'].append([channel, hop])
+            added += 1
+        return added
+
+    def pop(self, hop):
+
+        # Removes and returns the queued channels of a hop (channels of earlier hops left over by an
+        # interrupted session are returned too).
+
+        channels = [channel for channel, channel_hop in self.state['queue'] if channel_hop <= hop]
+        self.state['queue'] = [[channel, channel_hop] for channel, channel_hop in self.state['queue'] if channel_hop > hop]
+        return channels
+
+    def mark_scraped(self, channels):
+        scraped = set(self.state['scraped'])
+        self.state['scraped'].extend(channel for channel in channels if channel not in scraped)
+
+    def is_seen(self, channel):
+        return normalize_channel(channel) in self.state['seen']
+
+    def save(self):
+
+        # Atomically writes the state file.
+
+        temporary_path = f'{self.path}.tmp'
+        with open(temporary_path, 'w', encoding='utf-8') as file:
+            json.dump(self.state, file, indent=2, ensure_ascii=False)
+        os.replace(temporary_path, self.path)
+
+def select_new_channels(edges, frontier, min_weight=2, min_sources=1, max_channels=None):
+
+    # Rank the targets of a link graph and keep the ones worth scraping at the next hop.
+
+    # Parameters:
+    # edges (DataFrame): Link graph with the columns 'Source Group', 'Target Channel' and 'Weight'.
+    # frontier (SnowballFrontier): Channels already seen are skipped.
+    # min_weight (int): Minimum total number of links pointing to a channel.
+    # min_sources (int): Minimum number of distinct groups linking to a channel.
+    # max_channels (int): Maximum number of channels kept (the most linked ones).
+
+    # Returns:
+    # list of str: The selected channels, most linked first.
+
+    if edges.empty:
+        return []
+    targets = edges.groupby('Target Channel').agg(Weight=('Weight', 'sum'), Sources=('Source Group', 'nunique'))
+    targets = targets[(targets['Weight'] >= min_weight) & (targets['Sources'] >= min_sources)]
+    targets = targets[~targets.index.map(frontier.is_seen)]
+    targets = targets.sort_values(by=['Weight', 'Sources'], ascending=False, kind='stable')
+    channels = targets.index.tolist()
+    return channels[:max_channels] if max_channels else channels
+
+async def snowball_crawl(client, seed_channels, date_min, date_max, output_folder, hops=2, state_file=None,
+                         min_weight=2, min_sources=1, max_channels_per_hop=150, include_comments=True,
+                         comments_format='json', **scrape_kwargs):
+
+    # Multi-hop snowball: scrape the seed channels, extract the channels they link to, scrape those, and so on.
+
+    # Each hop is scraped with scrape_channels into its own Parquet part files ('hop_00_part_00001.parquet', ...),
+    # then the links of the new parts are extracted (build_link_edges) and the most linked channels never seen
+    # before are queued for the next hop. The frontier and the link graph are saved after every hop, so an
+    # interrupted crawl continues where it stopped when it is run again with the same output folder.
+
+    # Parameters:
+    # client (TelegramClient): An already started Telegram client.
+    # seed_channels (list of str): The channels of hop 0.
+    # date_min (datetime): Start date of the messages to scrape.
+    # date_max (datetime): End date of the messages to scrape.
+    # output_folder (str): Folder of the part files, the frontier ('snowball_frontier.json') and the link graph ('link_graph.parquet').
+    # hops (int): Number of hops after the seeds (0 only scrapes the seeds).
+    # state_file (str): Path of the frontier state file (default: 'snowball_frontier.json' in output_folder).
+    # min_weight (int): Minimum number of links for a channel to be queued.
+    # min_sources (int): Minimum number of distinct linking groups for a channel to be queued.
+    # max_channels_per_hop (int): Maximum number of new channels per hop (Telegram limits joins/resolves to ~200 channels).
+    # include_comments (bool): Also follow the links posted in comments.
+    # comments_format (str): Storage of 'Comments List' ('json' or 'nested').
+    # **scrape_kwargs: Other arguments of scrape_channels (key_search, concurrency, checkpoints, ...).
+
+    # Returns:
+    # DataFrame: The accumulated link graph ('Source Group', 'Target Channel', 'Weight').
+
+    # Example:
+    # async with TelegramClient(session_name, api_id, api_hash) as client:
+    #     edges = await snowball_crawl(client, ['@canal1'], date_min, date_max, 'snowball', hops=2)
+
+    os.makedirs(output_folder, exist_ok=True)
+    frontier = SnowballFrontier(state_file or os.path.join(output_folder, 'snowball_frontier.json'))
+    graph_path = os.path.join(output_folder, 'link_graph.parquet')
+    edges = pd.read_parquet(graph_path) if os.path.exists(graph_path) else pd.DataFrame(columns=['Source Group', 'Target Channel', 'Weight'])
+
+    if not frontier.state['seen']:
+        frontier.add(seed_channels, hop=0)
+        frontier.save()
+    schema = message_schema(comments_format, scrape_kwargs.get('typed_columns', False))
+
+    for hop in range(hops + 1):
+        channels = frontier.pop(hop)
+        if not channels:
+            continue
+        print(f"Hop {hop}: scraping {len(channels)} channels...")
+
+        writer = StreamingParquetWriter(output_folder, f'hop_{hop:02}', schema=schema)
+        await scrape_channels(client, channels, date_min, date_max, file_name=f'hop_{hop:02}', writer=writer,
+                              comments_format=comments_format, **scrape_kwargs)
+        frontier.mark_scraped(channels)
+
+        if hop < hops:
+            hop_edges = build_link_edges(writer.part_paths(), include_comments=include_comments)
+            hop_edges = hop_edges[hop_edges['Source Group'].str.lower().isin(channels)]
+            edges = pd.concat([edges, hop_edges], ignore_index=True)
+            edges = edges.groupby(['Source Group', 'Target Channel'], as_index=False)['Weight'].sum()
+            edges = edges.sort_values(by='Weight', ascending=False, kind='stable').reset_index(drop=True)
+            edges.to_parquet(f'{graph_path}.tmp', index=False)
+            os.replace(f'{graph_path}.tmp', graph_path)
+
+            new_channels = select_new_channels(hop_edges, frontier, min_weight, min_sources, max_channels_per_hop)
+            frontier.add(new_channels, hop + 1)
+            print(f"Hop {hop}: {len(hop_edges)} links between groups, {len(new_channels)} new channels queued for hop {hop + 1}")
+        frontier.save()
+
+    return edges
+
+# Usage
+if __name__ == '__main__':
+    import asyncio
+    from datetime import datetime, timezone
+    from fake_telegram_client import FakeTelegramClient
+
+    # Dry run against the fake client (the fake messages contain no links, so only the seeds are scraped)
+    async def main():
+        async with FakeTelegramClient({'@canal1': 200, '@canal2': 200}) as client:
+            edges = await snowball_crawl(client, ['@canal1', '@canal2'], datetime(2024, 1, 1, tzinfo=timezone.utc),
+                                         datetime(2025, 1, 15, tzinfo=timezone.utc), 'snowball_test', hops=1)
+            print(edges)
+
+    asyncio.run(main())
@@ -1,8 +1,23 @@
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
 from tqdm import tqdm
+from partitioned_dataset import open_dataset, iter_dataset_batches, load_dataset
 import os
 import re
 
+TELEGRAM_LINK_PATTERN = r'(https?://t\.me/[^\s]+)'
+NORMALIZED_LINK_PATTERN = r'(https?://t\.me/[\w\d\+]+)'
+
+# Public channel or group behind a link (t.me/name or t.me/s/name); invites (t.me/+...), private links (t.me/c/...)
+# and Telegram's own paths (t.me/joinchat, t.me/addstickers, ...) do not name a channel
+CHANNEL_LINK_PATTERN = r'^https?://t\.me/(?:s/)?([A-Za-z]\w{4,})'
+RESERVED_PATHS = {'joinchat', 'addstickers', 'addemoji', 'addtheme', 'addlist', 'setlanguage', 'share', 'proxy',
+                  'socks', 'boost', 'login', 'invoice', 'contact', 'confirmphone'}
+
+# The 'Comment Url' of each comment links back to the scraped post itself, so it is removed before extracting links
+COMMENT_URL_PATTERN = r'"Comment Url":\s*"[^"]*"'
+
 def extract_telegram_links(content):
     
     # Extract Telegram links from a given content string.
@@ -13,7 +28,7 @@ def extract_telegram_links(content):
     # Returns:
     # list: A list of Telegram links found in the content.
     
-    return re.findall(r'(https?://t\.me/[^\s]+)', content)
+    return re.findall(TELEGRAM_LINK_PATTERN, content)
 
 def normalize_telegram_link(link):
     
@@ -25,10 +40,143 @@ def normalize_telegram_link(link):
     # Returns:
     # str: The normalized Telegram link, or None if the link does not match the pattern.
     
-    base_link = re.match(r'(https?://t\.me/[\w\d\+]+)', link)
+    base_link = re.match(NORMALIZED_LINK_PATTERN, link)
     return base_link.group(1) if base_link else None
 
-def process_file_for_telegram_links(folder_path, input_filename, output_filename):
+def extract_telegram_links_column(texts):
+
+    # Extract every Telegram link of a column of texts at once (vectorized version of extract_telegram_links).
+
+    # Parameters:
+    # texts (Series): The texts; only rows containing 't.me/' (found with a columnar Arrow search) are scanned.
+
+    # Returns:
+    # DataFrame: One row per link found, with the columns 'Row' (index label of the text) and 'Link'.
+
+    values = pa.array(texts.astype(object).where(texts.notna(), None), type=pa.string())
+    candidates = texts[pc.fill_null(pc.match_substring(values, 't.me/'), False).to_numpy(zero_copy_only=False)]
+    links = candidates.astype(str).str.extractall(TELEGRAM_LINK_PATTERN)[0]
+    return pd.DataFrame({'Row': links.index.get_level_values(0).to_numpy(dtype=texts.index.dtype), 'Link': links.to_numpy(dtype=object)})
+
+def link_channels(links):
+
+    # Normalize links to the channel they point to, e.g. 'https://t.me/s/Name/123' -> '@name'.
+
+    # Parameters:
+    # links (Series): Telegram links.
+
+    # Returns:
+    # Series: '@' + lowercase username, or missing for links that do not name a public channel or group.
+
+    names = links.str.extract(CHANNEL_LINK_PATTERN)[0].str.lower()
+    return ('@' + names).where(names.notna() & ~names.isin(RESERVED_PATHS))
+
+def source_groups(groups):
+
+    # Return the groups of an Arrow 'Group' column as '@'-prefixed strings (numpy array), as the combine script writes them.
+
+    groups = groups.to_pandas().astype(str)
+    return groups.where(groups.str.startswith('@'), '@' + groups).to_numpy()
+
+def batch_links(batch, include_comments=True):
+
+    # Extract the Telegram links of a batch of rows, from 'Content' and, optionally, from the texts of the comments.
+
+    # Parameters:
+    # batch (pyarrow.RecordBatch): The rows, with a 'Content' column (and 'Comments List' for the comments).
+    # include_comments (bool): Also extract the links of the comments ('Comment Url', the link back to the post, is skipped).
+
+    # Returns:
+    # list of DataFrame: One DataFrame per source of texts, with the columns 'Row' (row in the batch) and 'Link'.
+
+    texts = [batch.column('Content').to_pandas()]
+    if include_comments and 'Comments List' in batch.schema.names:
+        comments = batch.column('Comments List')
+        if pa.types.is_list(comments.type):
+            from comments_schema import flatten_comments
+            flat = flatten_comments(pa.table({'Comments List': comments}))
+            comment_contents = flat.column('Comment Content').to_pandas()
+            comment_contents.index = flat.column('Row Index').to_pandas()
+            texts.append(comment_contents)
+        else:
+            texts.append(pc.replace_substring_regex(comments, COMMENT_URL_PATTERN, '').to_pandas())
+    return [extract_telegram_links_column(text) for text in texts]
+
+def link_edges(links, groups):
+
+    # Turn the links of a batch into 'Source Group -> Target Channel' edges (one row per link).
+
+    # Parameters:
+    # links (DataFrame): Links found by batch_links ('Row' and 'Link').
+    # groups (numpy.ndarray): The '@'-prefixed group of each row of the batch (see source_groups).
+
+    # Returns:
+    # DataFrame: Columns 'Source Group' and 'Target Channel'.
+
+    links = links.assign(**{'Source Group': groups[links['Row'].to_numpy()], 'Target Channel': link_channels(links['Link'])})
+    # Channels linking to themselves (signatures, post links) are not edges of the graph
+    links = links[links['Target Channel'].notna() & (links['Target Channel'] != links['Source Group'].str.lower())]
+    return links[['Source Group', 'Target Channel']]
+
+def normalize_links(links):
+
+    # Normalize a Series of Telegram links (vectorized normalize_telegram_link); links that do not match are dropped.
+
+    normalized_links = links.str.extract(NORMALIZED_LINK_PATTERN, expand=False).where(links.str.match(NORMALIZED_LINK_PATTERN))
+    return normalized_links.dropna()
+
+def batch_link_results(batch, include_comments=True, groups=None):
+
+    # The normalized links of a batch of rows and, given the groups of its rows, its link graph edges.
+    # Used by pipeline_runner.py, in the consumer's thread or in a worker process (batches and results pickle).
+
+    # Parameters:
+    # batch (pyarrow.RecordBatch): The rows (see batch_links).
+    # include_comments (bool): Also extract the links of the comments.
+    # groups (numpy.ndarray): The '@'-prefixed group of each row (see source_groups); None to skip the edges.
+
+    # Returns:
+    # tuple: (list of Series of normalized links, list of DataFrame of edges), one item per source of texts.
+
+    links = batch_links(batch, include_comments)
+    edges = [link_edges(part, groups) for part in links] if groups is not None else []
+    return [normalize_links(part['Link']) for part in links], edges
+
+def build_link_edges(file_paths, include_comments=True, batch_size=100000, groups=None, date_min=None, date_max=None):
+
+    # Build the weighted link graph 'source group -> target channel' of scraped Parquet files, batch by batch.
+
+    # Parameters:
+    # file_paths (list of str): Parquet files in the scraper's schema, or partitioned dataset folders.
+    # include_comments (bool): Also count the links found in the texts of the comments.
+    # batch_size (int): Number of rows read at a time.
+    # groups (list of str): Only use the messages of these groups (default: all).
+    # date_min, date_max (datetime or str): Only use the messages of this period (default: all).
+
+    # Returns:
+    # DataFrame: Columns 'Source Group', 'Target Channel' and 'Weight' (number of links), sorted by weight.
+
+    edges = []
+    for file_path in file_paths:
+        names = open_dataset(file_path).schema.names
+        columns = [column for column in ['Group', 'Content', 'Comments List'] if column in names]
+        if not include_comments and 'Comments List' in columns:
+            columns.remove('Comments List')
+
+        batches = iter_dataset_batches(file_path, columns=columns, groups=groups, date_min=date_min, date_max=date_max, batch_size=batch_size)
+        for batch in tqdm(batches, desc=f"Extracting links from {os.path.basename(file_path)}"):
+            batch_groups = source_groups(batch.column('Group'))
+            for links in batch_links(batch, include_comments and 'Comments List' in columns):
+                edges.append(link_edges(links, batch_groups))
+
+    if not edges:
+        return pd.DataFrame(columns=['Source Group', 'Target Channel', 'Weight'])
+    edges = pd.concat(edges, ignore_index=True)
+    edges = edges.groupby(['Source Group', 'Target Channel']).size().reset_index(name='Weight')
+    return edges.sort_values(by='Weight', ascending=False, kind='stable').reset_index(drop=True)
+
+def process_file_for_telegram_links(folder_path, input_filename, output_filename, edges_filename=None, include_comments=False,
+                                    groups=None, date_min=None, date_max=None):
     
     # Process a Parquet file to extract, normalize, and count Telegram links.
 
@@ -36,17 +184,24 @@ def process_file_for_telegram_links(folder_path, input_filename, output_filename
     # folder_path (str): The path to the folder containing the Parquet file.
     # input_filename (str): The name of the input Parquet file.
     # output_filename (str): The name of the output Excel file to save the results.
+    # edges_filename (str): Optional name of a file (.parquet, .csv or .xlsx) to save the link graph
+    #                       'Source Group -> Target Channel' with weights (see build_link_edges).
+    # include_comments (bool): Also extract the links found in the comments (default: only 'Content', as before).
+    # groups (list of str): Only analyze the messages of these groups (default: all).
+    # date_min, date_max (datetime or str): Only analyze the messages of this period (default: all).
+    #                                       input_filename may also be a dataset folder partitioned by group and month
+    #                                       (see partitioned_dataset.py), where these filters skip whole folders.
 
     # Returns:
     # None
 
     # Steps:
     # 1. Load the Parquet file into a DataFrame.
-    # 2. Extract Telegram links from the 'Content' column.
-    # 3. Flatten the list of extracted links.
-    # 4. Normalize the Telegram links.
-    # 5. Count the frequency of unique Telegram links.
-    # 6. Save the results to an Excel file.
+    # 2. Extract Telegram links from the 'Content' column (and the comments, if requested), vectorized.
+    # 3. Normalize the Telegram links.
+    # 4. Count the frequency of unique Telegram links.
+    # 5. Save the results to an Excel file.
+    # 6. Optionally, build and save the weighted link graph between groups and channels.
 
     # Usage:
     # Place the Parquet file to be processed in the specified folder path and specify the appropriate column names and output file name.
@@ -61,29 +216,31 @@ def process_file_for_telegram_links(folder_path, input_filename, output_filename
     # Combine folder path and input filename to get the full file path
     file_path = os.path.join(folder_path, input_filename)
 
-    # Load the Parquet file with progress bar
+    # Load only the needed columns
     print(f"Loading {file_path}...")
-    df = pd.read_parquet(file_path)
+    columns = ['Content', 'Comments List'] if include_comments else ['Content']
+    df = load_dataset(file_path, columns=columns, groups=groups, date_min=date_min, date_max=date_max)
 
-    # Extract Telegram links from the 'Content' column with progress bar
+    # Extract Telegram links from the 'Content' column, vectorized
     print("Extracting Telegram links...")
-    tqdm.pandas(desc="Extracting Telegram links")
-    df['Telegram Links'] = df['Content'].progress_apply(lambda x: extract_telegram_links(str(x)))
-
-    # Flatten the list of lists and filter out empty entries with progress bar
-    print("Flattening list of Telegram links...")
-    all_links = [link for sublist in tqdm(df['Telegram Links'].tolist(), desc="Flattening links") for link in sublist]
+    texts = [df['Content']]
+    if include_comments:
+        comments = pa.array(df['Comments List'].astype(object).where(df['Comments List'].notna(), None)) if 'Comments List' in df.columns else None
+        if comments is not None and pa.types.is_string(comments.type):
+            texts.append(pc.replace_substring_regex(comments, COMMENT_URL_PATTERN, '').to_pandas())
+        elif comments is not None:
+            from comments_schema import decode_comments_list
+            contents = decode_comments_list(df['Comments List']).explode().dropna().map(lambda comment: comment.get('Comment Content'))
+            texts.append(contents)
+    all_links = pd.concat([extract_telegram_links_column(text)['Link'] for text in texts], ignore_index=True)
 
     # Normalize the links
     print("Normalizing Telegram links...")
-    normalized_links = [normalize_telegram_link(link) for link in tqdm(all_links, desc="Normalizing links")]
-
-    # Filter out None values
-    normalized_links = [link for link in normalized_links if link]
+    normalized_links = normalize_links(all_links)
 
     # Create a DataFrame with the unique links and their frequency
     print("Counting unique links...")
-    link_counts = pd.Series(tqdm(normalized_links, desc="Counting links")).value_counts().reset_index()
+    link_counts = normalized_links.value_counts().reset_index()
     link_counts.columns = ['Telegram Link', 'Frequency']
 
     # Save the result to a new Excel file
@@ -91,11 +248,24 @@ def process_file_for_telegram_links(folder_path, input_filename, output_filename
     print(f"Saving the Telegram links to '{output_path}'...")
     link_counts.to_excel(output_path, index=False)
 
+    # Save the link graph between groups and channels
+    if edges_filename:
+        edges = build_link_edges([file_path], include_comments=include_comments, groups=groups, date_min=date_min, date_max=date_max)
+        edges_path = os.path.join(folder_path, edges_filename)
+        if edges_filename.endswith('.parquet'):
+            edges.to_parquet(edges_path, index=False)
+        elif edges_filename.endswith('.csv'):
+            edges.to_csv(edges_path, index=False)
+        else:
+            edges.to_excel(edges_path, index=False)
+        print(f"Link graph with {len(edges)} edges saved to '{edges_path}'")
+
     print(f"Analysis completed and saved to '{output_path}'")
 
 
 # Usage
-folder_path = r'C:\Users\Public\PyCharmProjects\Data_Conspira' # Example
-input_filename = "unified_data_telegram.parquet" # Example
-output_filename = 'telegram_links.xlsx' # Example
-process_file_for_telegram_links(folder_path, input_filename, output_filename)
+if __name__ == '__main__':
+    folder_path = r'C:\Users\Public\PyCharmProjects\Data_Conspira' # Example
+    input_filename = "unified_data_telegram.parquet" # Example
+    output_filename = 'telegram_links.xlsx' # Example
+    process_file_for_telegram_links(folder_path, input_filename, output_filename)
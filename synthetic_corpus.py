@@ -0,0 +1,221 @@
+import json
+import os
+from datetime import datetime, timezone
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from tqdm import tqdm
+from telegram_scraper import MESSAGE_SCHEMA
+
+# Synthetic corpora in the scraper's exact schema (MESSAGE_SCHEMA), for benchmarks.
+#
+# Rows are generated with vectorized numpy / Arrow operations, one batch at a time, and streamed to Parquet part
+# files, so even the 10M-row scale is written in constant memory. The corpus is deterministic for a given seed.
+# It reproduces what the analysis scripts care about:
+# - a few large groups and many small ones (Zipf-like sizes);
+# - 'Content' with a Zipf word distribution, empty media-only posts, external URLs and 't.me' links to other groups;
+# - 'Reactions' strings as written by format_reactions ('👍 3 ❤ 2 ');
+# - 'Comments List' as the JSON text written by build_message_row (json.dumps of build_comment_row dicts);
+# - a fraction of exact duplicate rows (the overlaps of re-scraped windows that combine_parquet_files removes).
+
+CORPUS_SCALES = {'10k': 10000, '1m': 1000000, '10m': 10000000}
+
+VOCABULARY = [
+    'de', 'a', 'o', 'que', 'e', 'do', 'da', 'em', 'um', 'para', 'com', 'não', 'uma', 'os', 'no', 'se', 'na', 'por',
+    'mais', 'as', 'dos', 'como', 'mas', 'ao', 'ele', 'das', 'seu', 'sua', 'ou', 'quando', 'muito', 'nos', 'já',
+    'eu', 'também', 'só', 'pelo', 'pela', 'até', 'isso', 'ela', 'entre', 'depois', 'sem', 'mesmo', 'aos', 'seus',
+    'quem', 'nas', 'me', 'esse', 'eles', 'você', 'essa', 'num', 'nem', 'suas', 'meu', 'às', 'minha', 'numa',
+    'governo', 'presidente', 'eleição', 'eleições', 'urna', 'voto', 'povo', 'brasil', 'notícia', 'vídeo', 'grupo',
+    'canal', 'verdade', 'mentira', 'mídia', 'imprensa', 'justiça', 'congresso', 'senado', 'ministro', 'política',
+    'economia', 'saúde', 'vacina', 'liberdade', 'democracia', 'fraude', 'manifestação', 'Trump', 'Biden', 'Kamala',
+    'Lula', 'Bolsonaro', 'STF', 'TSE', 'compartilhe', 'urgente', 'atenção', 'assista', 'leia', 'hoje', 'agora',
+]
+
+MAX_COMMENTS = 50  # Per post
+
+EMOJIS = ['👍', '❤', '🔥', '😂', '😡', '👏', '😢', '🙏']
+
+EXTERNAL_URLS = ['https://www.youtube.com/watch?v=abc123', 'https://twitter.com/user/status/1', 'https://example.com/noticia',
+                 'https://www.instagram.com/p/xyz/', 'http://bit.ly/3abcdE']
+
+def zipf_probabilities(size, exponent=1.0):
+    weights = 1 / np.arange(1, size + 1) ** exponent
+    return weights / weights.sum()
+
+def random_texts(rng, count, min_words, max_words, vocabulary):
+
+    # Return 'count' texts of min_words..max_words words drawn from the vocabulary (Zipf frequencies).
+
+    lengths = rng.integers(min_words, max_words + 1, count)
+    offsets = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+    words = pa.array(vocabulary).take(pa.array(rng.choice(len(vocabulary), int(offsets[-1]), p=zipf_probabilities(len(vocabulary)))))
+    return pc.binary_join(pa.LargeListArray.from_arrays(pa.array(offsets), words), ' ')
+
+def join(*parts):
+    return pc.binary_join_element_wise(*parts, '', null_handling='replace', null_replacement='')
+
+def masked(values, mask):
+
+    # Keep the values where mask is True, nulls elsewhere.
+
+    return pc.if_else(pa.array(mask), values, pa.nulls(len(mask), type=values.type))
+
+def format_dates(seconds):
+    return pc.strftime(pa.array(seconds, type=pa.timestamp('s')), format='%Y-%m-%d %H:%M:%S')
+
+def reaction_strings(rng, count, probability, max_reactions=3, json_escaped=False):
+
+    # Reactions as format_reactions writes them: 'emoji count ' repeated, '' when there are none.
+
+    emojis = pa.array([json.dumps(emoji)[1:-1] for emoji in EMOJIS] if json_escaped else EMOJIS)
+    kinds = np.where(rng.random(count) < probability, rng.integers(1, max_reactions + 1, count), 0)
+    slots = []
+    for slot in range(max_reactions):
+        emoji = emojis.take(pa.array(rng.integers(0, len(EMOJIS), count)))
+        counts = pc.cast(pa.array(rng.zipf(1.6, count).clip(1, 100000)), pa.string())
+        slots.append(masked(join(emoji, ' ', counts, ' '), kinds > slot))
+    return join(*slots)
+
+def comments_json(rng, groups, post_ids, post_seconds, comment_counts, first_comment_id):
+
+    # Build the 'Comments List' JSON text of each post, exactly as json.dumps writes the build_comment_row dicts.
+
+    total = int(comment_counts.sum())
+    row_of_comment = np.repeat(np.arange(len(comment_counts)), comment_counts)
+    comment_groups = groups.take(pa.array(row_of_comment))
+    comment_posts = post_ids[row_of_comment]
+    comment_ids = first_comment_id + np.arange(total)
+    # Content is json-escaped like json.dumps does with its default ensure_ascii=True
+    vocabulary = [json.dumps(word)[1:-1] for word in VOCABULARY]
+    contents = random_texts(rng, total, 2, 15, vocabulary)
+    dates = format_dates(post_seconds[row_of_comment] + rng.integers(60, 3 * 86400, total))
+    group_names = pc.utf8_slice_codeunits(comment_groups, 1)
+
+    comments = join(
+        '{"Type": "comment", "Comment Group": "', comment_groups,
+        '", "Comment Author ID": ', pc.cast(pa.array(rng.integers(10 ** 8, 10 ** 10, total)), pa.string()),
+        ', "Comment Content": "', contents,
+        '", "Comment Date": "', dates,
+        '", "Comment Message ID": ', pc.cast(pa.array(comment_ids), pa.string()),
+        ', "Comment Author": null, "Comment Views": null, "Comment Reactions": "', reaction_strings(rng, total, 0.2, json_escaped=True),
+        '", "Comment Shares": null, "Comment Media": "', pa.array(np.where(rng.random(total) < 0.05, 'True', 'False')),
+        '", "Comment Url": "https://t.me/', group_names, '/', pc.cast(pa.array(comment_posts), pa.string()),
+        '?comment=', pc.cast(pa.array(comment_ids), pa.string()), '"}',
+    )
+    offsets = np.concatenate([[0], np.cumsum(comment_counts)]).astype(np.int64)
+    return join('[', pc.binary_join(pa.LargeListArray.from_arrays(pa.array(offsets), comments), ', '), ']')
+
+def generate_batch(rng, start, count, total_rows, group_names, group_probabilities, date_min, date_max, link_probability,
+                   url_probability, comments_mean, duplicate_fraction):
+
+    # Generate the rows [start, start + count) of the corpus as a pyarrow.Table in MESSAGE_SCHEMA.
+
+    duplicates = int(count * duplicate_fraction)
+    unique = count - duplicates
+    index = start + np.arange(unique)
+
+    group_codes = rng.choice(len(group_names), unique, p=group_probabilities)
+    groups = pa.array(group_names).take(pa.array(group_codes))
+    message_ids = index + 1
+    # Messages get newer with their index, with a few minutes of jitter
+    span = date_max.timestamp() - date_min.timestamp()
+    seconds = (date_min.timestamp() + index / max(total_rows, 1) * span + rng.integers(0, 600, unique)).astype(np.int64)
+
+    content = random_texts(rng, unique, 3, 60, VOCABULARY)
+    has_url = rng.random(unique) < url_probability
+    urls = pa.array(EXTERNAL_URLS).take(pa.array(rng.integers(0, len(EXTERNAL_URLS), unique)))
+    has_link = rng.random(unique) < link_probability
+    linked = pc.utf8_slice_codeunits(pa.array(group_names).take(pa.array(rng.choice(len(group_names), unique, p=group_probabilities))), 1)
+    content = join(content, masked(join(' ', urls), has_url), masked(join(' https://t.me/', linked), has_link))
+    media_only = rng.random(unique) < 0.1
+    content = pc.if_else(pa.array(media_only), pa.scalar(''), content)
+
+    comment_counts = np.minimum(rng.poisson(comments_mean, unique), MAX_COMMENTS) if comments_mean else np.zeros(unique, dtype=np.int64)
+    # Comment IDs come after the post IDs, in a range reserved for each batch so they never collide
+    first_comment_id = total_rows + 1 + start * MAX_COMMENTS
+
+    table = pa.table({
+        'Type': pa.array(['text'] * unique),
+        'Group': groups,
+        'Author ID': pa.array(rng.integers(10 ** 8, 10 ** 10, unique)),
+        'Content': content,
+        'Date': format_dates(seconds),
+        'Message ID': pa.array(message_ids),
+        'Author': pa.nulls(unique, type=pa.string()),
+        'Views': pa.array(rng.lognormal(7, 1.5, unique).astype(np.int64)),
+        'Reactions': reaction_strings(rng, unique, 0.5),
+        'Shares': pa.array(rng.zipf(2.0, unique).clip(1, 100000) - 1),
+        'Media': pa.array(np.where(media_only | (rng.random(unique) < 0.2), 'True', 'False')),
+        'Url': join('https://t.me/', pc.utf8_slice_codeunits(groups, 1), '/', pc.cast(pa.array(message_ids), pa.string())),
+        'Comments List': comments_json(rng, groups, message_ids, seconds, comment_counts, first_comment_id),
+    }).cast(MESSAGE_SCHEMA)
+
+    if duplicates:
+        table = pa.concat_tables([table, table.take(pa.array(rng.integers(0, unique, duplicates)))])
+    return table
+
+def generate_corpus(output_folder, rows, num_groups=200, rows_per_file=1000000, seed=0,
+                    date_min=datetime(2024, 1, 1, tzinfo=timezone.utc), date_max=datetime(2025, 1, 15, tzinfo=timezone.utc),
+                    link_probability=0.05, url_probability=0.2, comments_mean=1.0, duplicate_fraction=0.01,
+                    batch_size=100000, file_name='corpus'):
+
+    # Write a synthetic corpus of scraped messages as Parquet part files.
+
+    # Parameters:
+    # output_folder (str): Folder of the part files (created if missing).
+    # rows (int or str): Number of rows, or one of CORPUS_SCALES ('10k', '1m', '10m').
+    # num_groups (int): Number of groups ('@canal_0001', ...), with Zipf-like sizes.
+    # rows_per_file (int): Number of rows per part file.
+    # seed (int): Seed of the corpus: the same seed always writes the same files.
+    # date_min, date_max (datetime): Period of the messages.
+    # link_probability (float): Share of posts with a 't.me' link to another group.
+    # url_probability (float): Share of posts with an external URL.
+    # comments_mean (float): Mean number of comments per post (Poisson).
+    # duplicate_fraction (float): Share of rows that are exact copies of other rows of the same part.
+    # batch_size (int): Number of rows generated at a time.
+    # file_name (str): Base name of the part files: '{file_name}_part_00001.parquet', ...
+
+    # Returns:
+    # list of str: The paths of the part files.
+
+    # Example:
+    # generate_corpus('benchmark_corpus_1m', '1m', seed=42)
+
+    rows = CORPUS_SCALES[rows] if isinstance(rows, str) else rows
+    os.makedirs(output_folder, exist_ok=True)
+    group_names = [f'@canal_{index:04}' for index in range(1, num_groups + 1)]
+    group_probabilities = zipf_probabilities(num_groups, 0.8)
+
+    paths = []
+    writer = None
+    file_rows = 0
+    progress = tqdm(total=rows, desc="Generating corpus")
+    start = 0
+    batch_number = 0
+    while start < rows:
+        if writer is None or file_rows >= rows_per_file:
+            if writer is not None:
+                writer.close()
+            paths.append(os.path.join(output_folder, f'{file_name}_part_{len(paths) + 1:05}.parquet'))
+            writer = pq.ParquetWriter(paths[-1], MESSAGE_SCHEMA)
+            file_rows = 0
+        count = min(batch_size, rows - start, rows_per_file - file_rows)
+        rng = np.random.default_rng([seed, batch_number])
+        table = generate_batch(rng, start, count, rows, group_names, group_probabilities, date_min, date_max,
+                               link_probability, url_probability, comments_mean, duplicate_fraction)
+        writer.write_table(table)
+        file_rows += count
+        start += count
+        batch_number += 1
+        progress.update(count)
+    if writer is not None:
+        writer.close()
+    progress.close()
+    return paths
+
+# Usage
+if __name__ == '__main__':
+    for scale in ['10k']:
+        corpus_paths = generate_corpus(f'benchmark_corpus_{scale}', scale)
+        print(f"{scale}: {len(corpus_paths)} files written")
@@ -0,0 +1,630 @@
+import asyncio
+import time
+from datetime import timedelta
+import json
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from comments_schema import COMMENTS_LIST_TYPE
+from excel_export import XML_INVALID_CHARACTERS, write_excel
+from pipeline_metrics import DURATION_BUCKETS, PipelineMetrics
+from partitioned_dataset import DATE_TYPE
+from rate_limiter import AdaptiveRateLimiter
+from typed_columns import GROUP_TYPE, REACTIONS_TYPE, TYPED_COMMENTS_LIST_TYPE, reaction_counts
+
+# Schema of the rows built by build_message_row, used to stream them to Parquet with stable column types
+MESSAGE_SCHEMA = pa.schema([
+    ('Type', pa.string()),
+    ('Group', pa.string()),
+    ('Author ID', pa.int64()),
+    ('Content', pa.string()),
+    ('Date', pa.string()),
+    ('Message ID', pa.int64()),
+    ('Author', pa.string()),
+    ('Views', pa.int64()),
+    ('Reactions', pa.string()),
+    ('Shares', pa.int64()),
+    ('Media', pa.string()),
+    ('Url', pa.string()),
+    ('Comments List', pa.string()),
+])
+
+# Same schema with 'Comments List' stored as a native list<struct<...>> column (comments_format='nested')
+NESTED_MESSAGE_SCHEMA = MESSAGE_SCHEMA.set(MESSAGE_SCHEMA.get_field_index('Comments List'), pa.field('Comments List', COMMENTS_LIST_TYPE))
+
+# Schemas of the rows built with typed_columns=True: timestamps, booleans, reaction lists and dictionary-encoded
+# groups instead of text (see typed_columns.py)
+TYPED_MESSAGE_SCHEMA = pa.schema([
+    pa.field(field.name, {'Group': GROUP_TYPE, 'Date': DATE_TYPE, 'Reactions': REACTIONS_TYPE, 'Media': pa.bool_()}.get(field.name, field.type))
+    for field in MESSAGE_SCHEMA
+])
+TYPED_NESTED_MESSAGE_SCHEMA = TYPED_MESSAGE_SCHEMA.set(TYPED_MESSAGE_SCHEMA.get_field_index('Comments List'),
+                                                       pa.field('Comments List', TYPED_COMMENTS_LIST_TYPE))
+
+def message_schema(comments_format='json', typed_columns=False):
+
+    # Return the schema of the rows built by build_message_row with these options (for StreamingParquetWriter).
+
+    if typed_columns:
+        return TYPED_NESTED_MESSAGE_SCHEMA if comments_format == 'nested' else TYPED_MESSAGE_SCHEMA
+    return NESTED_MESSAGE_SCHEMA if comments_format == 'nested' else MESSAGE_SCHEMA
+
+def remove_unsupported_characters(text):
+
+    # Remove invalid XML characters from a given text string.
+
+    # Parameters:
+    # text (str): The text to be cleaned.
+
+    # Returns:
+    # str: The text without characters that are not allowed in XML (and therefore in .xlsx files).
+
+    cleaned_text = XML_INVALID_CHARACTERS.sub('', text)
+    return cleaned_text
+
+def format_reactions(reactions):
+
+    # Format the reactions of a message as 'emoji count emoji count ...'.
+
+    # Parameters:
+    # reactions (MessageReactions or None): The reactions attribute of a Telethon message.
+
+    # Returns:
+    # str: The concatenated reactions string (empty if there are no reactions).
+
+    emoji_string = ''
+    if reactions:
+        for reaction_count in reactions.results:
+            emoji = reaction_count.reaction.emoticon
+            count = str(reaction_count.count)
+            emoji_string += emoji + " " + count + " "
+    return emoji_string
+
+def build_comment_row(channel, message, comment_message, typed_columns=False):
+
+    # Build the dictionary stored in 'Comments List' for a single comment.
+
+    # Parameters:
+    # channel (str): The channel or group being scraped.
+    # message (Message): The post the comment replies to.
+    # comment_message (Message): The comment itself.
+    # typed_columns (bool): Store the date, reactions and media as typed values instead of text (nested comments only).
+
+    # Returns:
+    # dict: The comment fields, in the same schema used by the notebook.
+
+    return {
+        'Type': 'comment',
+        'Comment Group': channel,
+        'Comment Author ID': comment_message.sender_id,
+        'Comment Content': comment_message.text.replace("'", '"'),
+        'Comment Date': comment_message.date if typed_columns else comment_message.date.strftime('%Y-%m-%d %H:%M:%S'),
+        'Comment Message ID': comment_message.id,
+        'Comment Author': comment_message.post_author,
+        'Comment Views': comment_message.views,
+        'Comment Reactions': reaction_counts(comment_message.reactions) if typed_columns else format_reactions(comment_message.reactions),
+        'Comment Shares': comment_message.forwards,
+        'Comment Media': bool(comment_message.media) if typed_columns else 'True' if comment_message.media else 'False',
+        'Comment Url': f'https://t.me/{channel}/{message.id}?comment={comment_message.id}'.replace('@', ''),
+    }
+
+def build_message_row(channel, message, comments_list, comments_format='json', typed_columns=False):
+
+    # Build the output row for a single post.
+
+    # Parameters:
+    # channel (str): The channel or group being scraped.
+    # message (Message): The post.
+    # comments_list (list of dict): The comments of the post, as returned by build_comment_row.
+    # comments_format (str): 'json' to store 'Comments List' as a JSON string, or 'nested' to keep it as a list of
+    # dicts (stored as a list<struct<...>> Parquet column, see comments_schema.py).
+    # typed_columns (bool): Store 'Date' as a datetime, 'Media' as a bool and 'Reactions' as a list of
+    # {'Emoji', 'Count'} dicts instead of text (see typed_columns.py and TYPED_MESSAGE_SCHEMA).
+
+    # Returns:
+    # dict: The row with columns 'Type', 'Group', 'Author ID', 'Content', 'Date', 'Message ID', 'Author',
+    # 'Views', 'Reactions', 'Shares', 'Media', 'Url' and 'Comments List'.
+
+    if comments_format == 'nested':
+        for comment in comments_list:
+            comment['Comment Content'] = remove_unsupported_characters(comment['Comment Content'])
+        cleaned_comments_list = comments_list
+    else:
+        cleaned_comments_list = remove_unsupported_characters(json.dumps(comments_list))
+
+    return {
+        'Type': 'text',
+        'Group': channel,
+        'Author ID': message.sender_id,
+        'Content': remove_unsupported_characters(message.text),
+        'Date': message.date if typed_columns else message.date.strftime('%Y-%m-%d %H:%M:%S'),
+        'Message ID': message.id,
+        'Author': message.post_author,
+        'Views': message.views,
+        'Reactions': reaction_counts(message.reactions) if typed_columns else format_reactions(message.reactions),
+        'Shares': message.forwards,
+        'Media': bool(message.media) if typed_columns else 'True' if message.media else 'False',
+        'Url': f'https://t.me/{channel}/{message.id}'.replace('@', ''),
+        'Comments List': cleaned_comments_list,
+    }
+
+def save_data(data, filename_base, file_format):
+
+    # Save the scraped rows as a Parquet or Excel file.
+
+    # Parameters:
+    # data (list of dict): The scraped rows.
+    # filename_base (str): The output file name, without extension.
+    # file_format (str): Either 'parquet' or 'excel'.
+
+    # Returns:
+    # str: The path of the saved file, or None if the format is unknown.
+
+    nested = any(isinstance(row['Comments List'], list) for row in data[:1])
+    typed = any(isinstance(row['Media'], bool) for row in data[:1])
+    if file_format == 'parquet':
+        filename = f'{filename_base}.parquet'
+        if nested or typed:
+            schema = message_schema('nested' if nested else 'json', typed)
+            pq.write_table(pa.Table.from_pylist(data, schema=schema), filename)
+        else:
+            pd.DataFrame(data).to_parquet(filename, index=False)
+    elif file_format == 'excel':
+        filename = f'{filename_base}.xlsx'
+        df = pd.DataFrame(data)
+        if nested:
+            # Spreadsheet cells cannot hold lists, so comments are written as JSON like in the default format
+            df['Comments List'] = df['Comments List'].map(lambda comments: json.dumps(comments, default=str))
+        write_excel(df, filename)
+    else:
+        return None
+    return filename
+
+async def fetch_comments(client, channel, message, limit=None, limiter=None, entity=None, typed_columns=False):
+
+    # Fetch the comments (replies) of a post.
+
+    # Parameters:
+    # client (TelegramClient): A connected Telethon client.
+    # channel (str): The channel or group being scraped.
+    # message (Message): The post whose comments should be fetched.
+    # limit (int): Maximum number of comments to fetch, or None to fetch all of them.
+    # limiter (AdaptiveRateLimiter): Rate limiter of the session; flood waits are waited for and retried.
+    # entity: The resolved channel (default: 'channel' is resolved by Telethon).
+    # typed_columns (bool): Build the comments with typed values (see build_comment_row).
+
+    # Returns:
+    # list of dict: The comments, or an empty list if they could not be fetched.
+
+    # Posts that Telegram reports as having no replies do not need a request at all
+    replies = getattr(message, 'replies', None)
+    if replies is not None and not replies.replies:
+        return []
+
+    limiter = limiter or AdaptiveRateLimiter()
+    comments_list = []
+    try:
+        async for comment_message in limiter.iter_messages(client, entity or channel, reply_to=message.id, limit=limit):
+            comments_list.append(build_comment_row(channel, comment_message=comment_message, message=message,
+                                                   typed_columns=typed_columns))
+    except Exception as e:
+        comments_list = []
+        print(f'Error processing comments: {e}')
+    return comments_list
+
+async def fetch_comments_for_window(client, channel, messages, session):
+
+    # Fetch the comments of a window of posts in parallel.
+
+    # At most 'max_comment_requests' reply threads are in flight at the same time across the whole
+    # session (the semaphore is shared by all channels), and each thread is capped at 'max_replies_per_post'.
+
+    # Parameters:
+    # client (TelegramClient): A connected Telethon client.
+    # channel (str): The channel or group being scraped.
+    # messages (list of Message): The posts of the window.
+    # session (dict): The shared session state created by scrape_channels.
+
+    # Returns:
+    # list of list of dict: The comments of each post, in the same order as 'messages'.
+
+    async def fetch(message):
+        async with session['comment_semaphore']:
+            return await fetch_comments(client, channel, message, limit=session['max_replies_per_post'],
+                                        limiter=session['limiter'], entity=session['entities'].get(channel),
+                                        typed_columns=session['typed_columns'] and session['comments_format'] == 'nested')
+
+    return await asyncio.gather(*(fetch(message) for message in messages))
+
+async def flush_window(client, channel, window, session, record=True):
+
+    # Fetch the comments of the buffered posts and append the finished rows to the session data.
+
+    # Parameters:
+    # client (TelegramClient): A connected Telethon client.
+    # channel (str): The channel or group being scraped.
+    # window (list of Message): The buffered posts, newest first.
+    # session (dict): The shared session state created by scrape_channels.
+    # record (bool): Record the posts in the checkpoints (False for date slices, recorded once all slices are done).
+    # A post that cannot be processed stops the recording of the channel: the checkpoints hold one contiguous ID
+    # range, which must not grow past a post that is missing from the output.
+
+    # Returns:
+    # int: The number of posts of the channel appended so far.
+
+    comments_lists = await fetch_comments_for_window(client, channel, window, session)
+    metrics = session['metrics']
+
+    for message, comments_list in zip(window, comments_lists):
+        try:
+            row = build_message_row(channel, message, comments_list, session['comments_format'], session['typed_columns'])
+        except Exception as e:
+            metrics.inc('errors_total')
+            session['failed_posts'][channel] += 1
+            print(f'Error processing message: {e}')
+            continue
+        part_written = False
+        writer = session['writer']
+        if writer:
+            bytes_written = writer.bytes_written
+            part_written = writer.append(row)
+            metrics.inc('bytes_written_total', writer.bytes_written - bytes_written)
+        else:
+            session['data'].append(row)
+        session['rows'] += 1
+        if session['checkpoints'] and record and not session['failed_posts'][channel]:
+            session['checkpoints'].record(channel, session['key_search'], message.id)
+            if part_written:
+                session['checkpoints'].commit()
+
+        session['channel_rows'][channel] += 1
+        t_index = session['rows']
+        metrics.inc('messages_total')
+        metrics.inc('comments_total', len(comments_list))
+
+        if session['file_name'] and not session['writer'] and t_index % 1000 == 0:
+            save_data(session['data'], f'backup_{session["file_name"]}_until_{t_index:05}_{channel}_ID{message.id:07}', session['file_format'])
+            if session['checkpoints']:
+                session['checkpoints'].commit()
+
+    report_progress(session)
+    return session['channel_rows'][channel]
+
+def report_progress(session, force=False):
+
+    # Update the fraction of the session that is done and print the progress line (at most every
+    # 'progress_interval' seconds, see PipelineMetrics.maybe_report).
+
+    # The fraction is the share of each channel's date window that was read (channels that are finished count
+    # as done), or the share of max_t_index or time_limit already used, whichever is the highest: the session
+    # ends at the first of the three.
+
+    # Parameters:
+    # session (dict): The shared session state created by scrape_channels.
+    # force (bool): Print and export now, whatever the time since the last report.
+
+    channel_progress = session['channel_progress']
+    window_progress = sum(channel_progress.values()) / len(channel_progress) if channel_progress else 0.0
+    metrics = session['metrics']
+    metrics.progress = max(window_progress, session['rows'] / session['max_t_index'],
+                           (time.time() - session['start_time']) / session['time_limit'])
+    metrics.maybe_report(force)
+
+def plan_passes(channel, session):
+
+    # Decide which parts of a channel's history must be read, based on its checkpoint.
+
+    # Parameters:
+    # channel (str): The channel or group to scrape.
+    # session (dict): The shared session state created by scrape_channels.
+
+    # Returns:
+    # list of dict: Keyword arguments for client.iter_messages, one per pass. Without a checkpoint there is a
+    # single pass that starts at date_max on the server side ('offset_date') and goes backwards until date_min;
+    # with a checkpoint there is one pass (oldest first) over the messages newer than 'max_id' and, if the
+    # backfill is not finished, one pass over the messages older than 'min_id'.
+
+    checkpoints = session['checkpoints']
+    state = checkpoints.get(channel, session['key_search']) if checkpoints else None
+    if state is None:
+        # 'offset_date' is exclusive and Telegram dates have whole seconds: date_max itself is included
+        return [{'offset_date': session['date_max'] + timedelta(seconds=1)}]
+
+    passes = [{'min_id': state['max_id'], 'reverse': True}]
+    if checkpoints.needs_backfill(channel, session['key_search'], session['date_min']):
+        passes.append({'offset_id': state['min_id']})
+    return passes
+
+def date_slices(date_min, date_max, slices):
+
+    # Split a date window into consecutive slices of the same length, newest first.
+
+    # Parameters:
+    # date_min (datetime): Start of the window.
+    # date_max (datetime): End of the window.
+    # slices (int): Number of slices.
+
+    # Returns:
+    # list of (datetime, datetime): The (date_min, date_max) of each slice; both ends are included and the
+    # slices do not overlap.
+
+    # Example:
+    # date_slices(datetime(2024, 1, 1), datetime(2024, 1, 3), 2)
+    # -> [(datetime(2024, 1, 2), datetime(2024, 1, 3)), (datetime(2024, 1, 1), datetime(2024, 1, 1, 23, 59, 59, 999999))]
+
+    step = (date_max - date_min) / slices
+    bounds = [date_max - step * index for index in range(slices)] + [date_min]
+    return [(bounds[index + 1], bounds[index] if index == 0 else bounds[index] - timedelta(microseconds=1))
+            for index in range(slices)]
+
+async def scrape_pass(client, channel, entity, iter_kwargs, date_min, date_max, session, record=True):
+
+    # Read one pass over a channel's history (see plan_passes) and append the posts between date_min and date_max.
+
+    # Parameters:
+    # client (TelegramClient): A connected Telethon client, shared by all channels of the session.
+    # channel (str): The channel or group to scrape.
+    # entity: The resolved channel.
+    # iter_kwargs (dict): Keyword arguments for client.iter_messages.
+    # date_min (datetime): The pass stops at the first post older than this date (newer, for reverse passes).
+    # date_max (datetime): Posts newer than this date are skipped.
+    # session (dict): The shared session state created by scrape_channels.
+    # record (bool): Record the posts in the checkpoints as they are appended.
+
+    # Returns:
+    # tuple: (completed, message_ids): completed is False if the session limits interrupted the pass;
+    # message_ids are the IDs of the posts appended.
+
+    reverse = iter_kwargs.get('reverse', False)
+    window = []
+    message_ids = []
+    completed = True
+
+    async for message in session['limiter'].iter_messages(client, entity, search=session['key_search'], **iter_kwargs):
+        if session['t_index'] >= session['max_t_index'] or time.time() - session['start_time'] > session['time_limit']:
+            completed = False
+            break
+
+        try:
+            if date_min <= message.date <= date_max:
+                # Reserve the slot now so concurrent channels never exceed max_t_index
+                session['t_index'] += 1
+                window.append(message)
+                message_ids.append(message.id)
+
+                if len(window) >= session['comment_window']:
+                    await flush_window(client, channel, window, session, record)
+                    if not reverse:
+                        update_coverage(channel, date_max, date_max - message.date, session)
+                    window = []
+
+            elif (message.date > date_max) if reverse else (message.date < date_min):
+                break
+
+        except Exception as e:
+            print(f'Error processing message: {e}')
+
+    if window:
+        await flush_window(client, channel, window, session, record)
+    if completed and not reverse:
+        update_coverage(channel, date_max, date_max - date_min, session)
+    return completed, message_ids
+
+def update_coverage(channel, pass_date_max, covered, session):
+
+    # Record how much of the date window a pass (or date slice) of a channel has read, for report_progress.
+
+    # Parameters:
+    # channel (str): The channel being scraped.
+    # pass_date_max (datetime): The date_max of the pass, which identifies it among the slices of the channel.
+    # covered (timedelta): Time between pass_date_max and the oldest post read so far.
+    # session (dict): The shared session state created by scrape_channels.
+
+    coverage = session['coverage'].setdefault(channel, {})
+    coverage[pass_date_max] = covered
+    window = session['date_max'] - session['date_min']
+    if window.total_seconds() > 0:
+        session['channel_progress'][channel] = min(1.0, sum(coverage.values(), timedelta()) / window)
+
+async def scrape_channel(client, channel, session):
+
+    # Scrape the posts of a single channel within the session's date window.
+
+    # Posts are read from the channel history and buffered in windows of 'comment_window' posts;
+    # the comments of each window are then fetched in parallel by fetch_comments_for_window,
+    # instead of one reply thread after the other. If the session has checkpoints, only the
+    # messages that are not covered by the channel's checkpoint are read (see plan_passes).
+    # Every request (entity resolution, history pages, reply threads) goes through the session's rate limiter.
+
+    # The first pass over a channel starts at date_max on the server side, so the requests only cover the
+    # date window, whatever the age of the channel. With 'date_slices' > 1 that pass is split into slices
+    # read at the same time (see date_slices); their posts are recorded in the checkpoints once every slice
+    # is complete, since the checkpoints only hold one contiguous ID range per channel.
+
+    # Parameters:
+    # client (TelegramClient): A connected Telethon client, shared by all channels of the session.
+    # channel (str): The channel or group to scrape.
+    # session (dict): The shared session state created by scrape_channels.
+
+    # Returns:
+    # int: The number of posts scraped from the channel.
+
+    limiter = session['limiter']
+    entity = await limiter.call(lambda: client.get_entity(channel))
+    session['entities'][channel] = entity
+    session['channel_rows'][channel] = 0
+    session['failed_posts'][channel] = 0
+    checkpoints = session['checkpoints']
+    session['outcomes'][channel] = 'interrupted'
+
+    for iter_kwargs in plan_passes(channel, session):
+        if 'offset_date' in iter_kwargs and session['date_slices'] > 1:
+            results = await asyncio.gather(*(
+                scrape_pass(client, channel, entity, {'offset_date': slice_max + timedelta(seconds=1)}, slice_min, slice_max,
+                            session, record=False)
+                for slice_min, slice_max in date_slices(session['date_min'], session['date_max'], session['date_slices'])
+            ))
+            completed = all(slice_completed for slice_completed, _ in results)
+            message_ids = [message_id for _, slice_ids in results for message_id in slice_ids]
+            if completed and checkpoints and message_ids and not session['failed_posts'][channel]:
+                checkpoints.record(channel, session['key_search'], min(message_ids))
+                checkpoints.record(channel, session['key_search'], max(message_ids))
+        else:
+            completed, _ = await scrape_pass(client, channel, entity, iter_kwargs, session['date_min'], session['date_max'], session)
+
+        if not completed:
+            return session['channel_rows'][channel]
+        if session['failed_posts'][channel]:
+            # Not complete: the failed posts are read again by the next run (from the checkpoints) or attempt
+            session['outcomes'][channel] = f"{session['failed_posts'][channel]} post(s) could not be processed"
+            return session['channel_rows'][channel]
+        if checkpoints and not iter_kwargs.get('reverse', False):
+            checkpoints.mark_backfilled(channel, session['key_search'], session['date_min'])
+
+    session['outcomes'][channel] = 'complete'
+    return session['channel_rows'][channel]
+
+async def scrape_channels(client, channels, date_min, date_max, key_search='', max_t_index=1000000, time_limit=21600,
+                          concurrency=5, min_channel_seconds=0, file_name=None, file_format='parquet',
+                          comment_window=50, max_comment_requests=10, max_replies_per_post=None, checkpoints=None,
+                          writer=None, comments_format='json', rate_limiter=None, date_slices=1, outcomes=None,
+                          metrics=None, progress_interval=10, typed_columns=False):
+
+    # Scrape many channels concurrently over one shared, already connected TelegramClient.
+
+    # Parameters:
+    # client (TelegramClient): A connected Telethon client (or a FakeTelegramClient for offline runs).
+    # channels (list of str): Channels or groups to scrape, e.g. ['@LulanoTelegram', 'https://t.me/Other'].
+    # date_min (datetime): Oldest message date to keep (timezone-aware, UTC).
+    # date_max (datetime): Newest message date to keep (timezone-aware, UTC).
+    # key_search (str): Keyword to search, or '' to scrape every message.
+    # max_t_index (int): Maximum number of posts to scrape in the whole session.
+    # time_limit (int): Timeout of the whole session, in seconds.
+    # concurrency (int): Maximum number of channels scraped at the same time.
+    # min_channel_seconds (int): Minimum time each channel keeps its concurrency slot (0: no pause; the pace of the
+    # requests is set by the rate limiter instead).
+    # file_name (str): Base name for backup and per-channel files; if None, nothing is written to disk.
+    # file_format (str): Either 'parquet' or 'excel'.
+    # comment_window (int): Number of posts buffered before their comments are fetched in parallel.
+    # max_comment_requests (int): Maximum number of reply threads fetched at the same time (across all channels).
+    # max_replies_per_post (int): Maximum number of comments kept per post, or None to keep all of them.
+    # checkpoints (ScrapeCheckpoints): Per-channel high-water marks; if given, only new messages are fetched and
+    # interrupted backfills are resumed, and the checkpoints are committed every time the rows are saved to disk.
+    # Without file_name and writer nothing is saved here: the checkpoints are only recorded, and the caller must
+    # call checkpoints.commit() after saving the returned rows.
+    # writer (StreamingParquetWriter): If given, rows are streamed to Parquet part files instead of being kept in
+    # memory; backups and 'complete_' files are then unnecessary and are not written.
+    # comments_format (str): 'json' (default) stores 'Comments List' as a JSON string; 'nested' stores it as a typed
+    # list<struct<...>> column (use NESTED_MESSAGE_SCHEMA for the writer).
+    # typed_columns (bool): Store 'Date' as timestamp[us, UTC], 'Media' as bool, 'Reactions' as a list of {'Emoji', 'Count'}
+    # and 'Group' dictionary-encoded, instead of text (also inside nested comments; see typed_columns.py). Use
+    # message_schema(comments_format, typed_columns=True) for the writer.
+    # rate_limiter (AdaptiveRateLimiter): Token bucket shared by all the requests of the session; flood waits are waited
+    # for, retried and slow it down (default: AdaptiveRateLimiter()). Share one limiter between sessions of the same account.
+    # date_slices (int): Number of date slices of each channel's first pass read at the same time (1: a single pass
+    # from date_max back to date_min). Slicing speeds up long backfills of a few channels.
+    # outcomes (dict): If given, receives the outcome of each channel: 'complete', 'interrupted' (session limits
+    # reached before the channel was done) or the error that stopped it.
+    # metrics (PipelineMetrics): Receives the counters and histograms of the session (posts, comments, requests, request
+    # latency, flood waits, bytes written, channel durations); give it a 'jsonl_path' or 'prometheus_path' to export
+    # them (default: PipelineMetrics('telegram_scraper', progress_interval=progress_interval)).
+    # progress_interval (float): Minimum number of seconds between two progress lines (None: no progress lines).
+
+    # Returns:
+    # list of dict: The scraped rows, in the same schema as the notebook ('Type', 'Group', 'Message ID', 'Comments List', ...).
+    # When a writer is given the rows are on disk instead and the list is empty.
+
+    # Steps:
+    # 1. Create the shared session state (rows, counters, limits, rate limiter).
+    # 2. Start one task per channel, limited by a semaphore of size 'concurrency'.
+    # 3. Each task iterates the channel's messages (only those not covered by its checkpoint), fetches the comments of each window of posts in parallel
+    #    and appends the rows to the shared list.
+    # 4. After each channel, save a 'complete_' file with the rows gathered so far (if file_name is set)
+    #    and commit the checkpoints.
+    # 5. Wait for all tasks, close the current part of the writer (if any) and return the rows.
+    # Progress is printed as one line every 'progress_interval' seconds (see report_progress), not per post.
+
+    # Example (flood_sleep_threshold=0 lets the rate limiter see every flood wait instead of Telethon sleeping silently):
+    # async with TelegramClient(username, api_id, api_hash, flood_sleep_threshold=0) as client:
+    #     data = await scrape_channels(client, ['@LulanoTelegram', '@jairbolsonarobrasil'], date_min, date_max,
+    #                                  concurrency=5, file_name='Test', file_format='parquet')
+
+    session = {
+        'data': [],
+        'rows': 0,
+        't_index': 0,
+        'start_time': time.time(),
+        'date_min': date_min,
+        'date_max': date_max,
+        'key_search': key_search,
+        'max_t_index': max_t_index,
+        'time_limit': time_limit,
+        'file_name': file_name,
+        'file_format': file_format,
+        'comment_window': comment_window,
+        'comment_semaphore': asyncio.Semaphore(max_comment_requests),
+        'max_replies_per_post': max_replies_per_post,
+        'checkpoints': checkpoints,
+        'writer': writer,
+        'comments_format': comments_format,
+        'typed_columns': typed_columns,
+        'limiter': rate_limiter or AdaptiveRateLimiter(),
+        'entities': {},
+        'channel_rows': {},
+        'failed_posts': {},
+        'date_slices': date_slices,
+        'outcomes': outcomes if outcomes is not None else {},
+        'metrics': metrics or PipelineMetrics('telegram_scraper', progress_interval=progress_interval),
+        'coverage': {},
+        'channel_progress': {channel: 0.0 for channel in channels},
+    }
+    metrics = session['metrics']
+    if session['limiter'].metrics is None:
+        session['limiter'].metrics = metrics
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run_channel(channel):
+        async with semaphore:
+            if session['t_index'] >= max_t_index or time.time() - session['start_time'] > time_limit:
+                session['outcomes'][channel] = 'interrupted'
+                return
+
+            loop_start_time = time.time()
+            try:
+                c_index = await scrape_channel(client, channel, session)
+
+                print(f'\n\n##### {channel} was ok with {c_index:05} posts #####\n\n')
+
+                if file_name and not writer:
+                    save_data(session['data'], f'complete_{channel}_in_{file_name}_until_{session["rows"]:05}', file_format)
+                    if checkpoints:
+                        checkpoints.commit()
+            except Exception as e:
+                session['outcomes'][channel] = f'{type(e).__name__}: {e}'
+                metrics.inc('channel_errors_total')
+                print(f'{channel} error: {e}')
+
+            loop_duration = time.time() - loop_start_time
+            metrics.observe('channel_duration_seconds', loop_duration, DURATION_BUCKETS)
+            metrics.set('channel_last_duration_seconds', loop_duration, channel=channel)
+            metrics.set('channel_posts', session['channel_rows'].get(channel, 0), channel=channel)
+            session['channel_progress'][channel] = 1.0
+            report_progress(session)
+            if loop_duration < min_channel_seconds:
+                await asyncio.sleep(min_channel_seconds - loop_duration)
+
+    await asyncio.gather(*(run_channel(channel) for channel in channels))
+
+    if writer:
+        bytes_written = writer.bytes_written
+        writer.write_part()
+        metrics.inc('bytes_written_total', writer.bytes_written - bytes_written)
+        if checkpoints:
+            checkpoints.commit()
+    report_progress(session, force=True)
+
+    limiter = session['limiter']
+    if limiter.floods:
+        print(f'{limiter.floods} flood waits ({limiter.waited:.0f}s waited), final rate {limiter.rate:.2f} requests/s')
+    print(f'\n{"-" * 50}\n#Concluded! #{session["rows"]:05} posts were scraped!\n{"-" * 50}\n\n\n\n')
+    return session['data']
@@ -0,0 +1,35 @@
+import os
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from combine_scraped_parquet_files import combine_parquet_files, combine_parquet_files_streaming
+from synthetic_corpus import generate_corpus
+
+def sorted_rows(path):
+    return pd.read_parquet(path).sort_values(['Group', 'Message ID']).reset_index(drop=True)
+
+def test_streaming_combine_matches_the_in_memory_combine(tmp_path):
+    folder = str(tmp_path / 'parts')
+    os.makedirs(tmp_path / 'temp')
+    paths = generate_corpus(folder, 3000, num_groups=20, rows_per_file=1000, seed=7, duplicate_fraction=0.05)
+
+    # Messages scraped again in another part: an edited copy, and a copy whose group was saved without '@'
+    copies = pq.read_table(paths[0]).slice(100, 300)
+    edited = copies.set_column(copies.schema.get_field_index('Content'), 'Content',
+                               pc.binary_join_element_wise(copies.column('Content'), pa.scalar(' (editado)'), ''))
+    without_at = copies.slice(150).set_column(copies.schema.get_field_index('Group'), 'Group',
+                                              pc.utf8_slice_codeunits(copies.slice(150).column('Group'), 1))
+    pq.write_table(pa.concat_tables([edited, without_at]), os.path.join(folder, 'corpus_part_00000.parquet'))
+
+    combine_parquet_files(folder, ['Group', 'Message ID'], str(tmp_path / 'in_memory.parquet'))
+    # Small buckets and batches, so that the rows are spilled to several buckets and merged back
+    combine_parquet_files_streaming(folder, ['Group', 'Message ID'], str(tmp_path / 'streaming.parquet'),
+                                    rows_per_bucket=500, batch_size=200, temp_folder=str(tmp_path / 'temp'))
+
+    in_memory, streaming = sorted_rows(tmp_path / 'in_memory.parquet'), sorted_rows(tmp_path / 'streaming.parquet')
+    total_rows = sum(pq.ParquetFile(os.path.join(folder, file)).metadata.num_rows for file in os.listdir(folder))
+    assert len(in_memory) < total_rows - 300  # The copies of the last part were removed too
+    assert not in_memory.duplicated(['Group', 'Message ID']).any()
+    pd.testing.assert_frame_equal(streaming, in_memory)
+    assert os.listdir(tmp_path / 'temp') == []  # The buckets were removed
@@ -0,0 +1,73 @@
+import random
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+from keyword_index import load_index_meta, update_keyword_index, query_keyword_index, tokenize
+
+WORDS = ['governo', 'eleição', 'Trump', '#TrumpWins', 'economia', 'saúde', 'vacina', 'Lula', 'bom', 'dia', 'amém', 'urgente']
+
+def messages(count, seed):
+    rng = random.Random(seed)
+    return [' '.join(rng.choice(WORDS) for _ in range(rng.randint(1, 6))) for _ in range(count)]
+
+def write_messages(path, contents):
+    pq.write_table(pa.table({'Content': pa.array(contents, pa.string())}), path, row_group_size=50)
+    return str(path)
+
+def expected_rows(contents, keywords, exact):
+    # Rows the index must return: every token of the keyword is found in (or equal to) a token of the text
+    rows = []
+    for row, content in enumerate(contents):
+        tokens = tokenize(str(content))
+        for keyword in keywords:
+            if all(any(query == token if exact else query in token for token in tokens) for query in tokenize(keyword)):
+                rows.append(row)
+                break
+    return rows
+
+def check_queries(index_folder, path, contents):
+    for keywords, exact in [(['trump'], False), (['trump'], True), (['Eleicao', 'bom dia'], False), (['vacinas'], False)]:
+        rows = query_keyword_index(index_folder, keywords, file_path=path, exact_tokens=exact)[str(path)]
+        assert rows.tolist() == expected_rows(contents, keywords, exact)
+
+def test_queries_match_the_tokens(tmp_path):
+    contents = messages(300, seed=1) + [None, '', '!!']
+    path = write_messages(tmp_path / 'unified.parquet', contents)
+    update_keyword_index(str(tmp_path / 'index'), [path], segment_rows=40)
+    check_queries(str(tmp_path / 'index'), path, contents)
+
+    # A keyword without word characters cannot be looked up: every row is a candidate
+    assert len(query_keyword_index(str(tmp_path / 'index'), ['!!'], file_path=path)[path]) == len(contents)
+
+def test_rewritten_file_only_indexes_new_messages(tmp_path):
+    index_folder = str(tmp_path / 'index')
+    old = messages(200, seed=2)
+    path = write_messages(tmp_path / 'unified.parquet', old)
+    first = update_keyword_index(index_folder, [path])
+    assert first == len(set(old))
+
+    # A combine adds new messages and sorts the file again: only the new texts are tokenized
+    new = ['mensagem nova número %d' % number for number in range(30)]
+    combined = old + new
+    random.Random(3).shuffle(combined)
+    write_messages(tmp_path / 'unified.parquet', combined)
+    assert update_keyword_index(index_folder, [path]) == len(new)
+    assert load_index_meta(index_folder)['num_documents'] == first + len(new)
+    check_queries(index_folder, path, combined)
+    assert query_keyword_index(index_folder, ['nova'], file_path=path)[path].tolist() == [row for row, content in enumerate(combined) if 'nova' in content]
+
+    # Unchanged files are not read again
+    assert update_keyword_index(index_folder, [path]) == 0
+
+def test_index_is_rebuilt_when_most_documents_are_unused(tmp_path):
+    index_folder = str(tmp_path / 'index')
+    path = write_messages(tmp_path / 'unified.parquet', ['texto antigo %d' % number for number in range(50)])
+    update_keyword_index(index_folder, [path])
+
+    contents = ['texto novo %d' % number for number in range(20)]
+    write_messages(tmp_path / 'unified.parquet', contents)
+    update_keyword_index(index_folder, [path])
+    meta = load_index_meta(index_folder)
+    assert meta['num_documents'] == 20
+    assert query_keyword_index(index_folder, ['antigo'], file_path=path)[path].tolist() == []
+    assert np.array_equal(query_keyword_index(index_folder, ['novo'], file_path=path)[path], np.arange(20))
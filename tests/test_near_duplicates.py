@@ -0,0 +1,30 @@
+import pyarrow as pa
+import pyarrow.parquet as pq
+from near_duplicates import find_near_duplicates
+
+def write_messages(path, contents, dates):
+    pq.write_table(pa.table({'Content': pa.array(contents, pa.string()), 'Date': pa.array(dates, pa.string())}), path)
+    return str(path)
+
+def test_empty_file(tmp_path):
+    clusters = find_near_duplicates(write_messages(tmp_path / 'empty.parquet', [], []), workers=1)
+    assert len(clusters) == 0
+    assert list(clusters.columns) == ['Cluster ID', 'Cluster Size', 'Canonical']
+
+def test_messages_without_signature_are_singletons(tmp_path):
+    # Every message is shorter than min_tokens: no row has a signature, so nothing is bucketed
+    path = write_messages(tmp_path / 'short.parquet', ['Bom dia!', 'Amém', None], ['2024-01-01', '2024-01-02', None])
+    clusters = find_near_duplicates(path, workers=1)
+    assert clusters['Cluster ID'].tolist() == [0, 1, 2]
+    assert clusters['Cluster Size'].tolist() == [1, 1, 1]
+    assert clusters['Canonical'].all()
+
+def test_forwards_are_clustered_with_the_oldest_message(tmp_path):
+    text = 'O governo anunciou hoje um novo pacote de medidas para a economia do país'
+    path = write_messages(tmp_path / 'forwards.parquet',
+                          [text + ' https://t.me/canal', 'Amém', text, 'Uma mensagem completamente diferente sobre outro assunto qualquer'],
+                          ['2024-01-03', '2024-01-01', '2024-01-02', '2024-01-04'])
+    clusters = find_near_duplicates(path, workers=1)
+    assert clusters['Cluster ID'].tolist() == [2, 1, 2, 3]
+    assert clusters['Cluster Size'].tolist() == [2, 1, 2, 1]
+    assert clusters['Canonical'].tolist() == [False, True, True, True]
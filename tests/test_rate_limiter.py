@@ -0,0 +1,60 @@
+import asyncio
+import pytest
+from fake_telegram_client import FakeTelegramClient
+from rate_limiter import AdaptiveRateLimiter, FloodWaitError
+from telegram_scraper import scrape_channels
+
+def flood_limiter(**kwargs):
+    # No real waiting: the flood waits are 0 seconds and the rate never drops
+    return AdaptiveRateLimiter(rate=10000, burst=10000, max_rate=10000, min_rate=10000, backoff=0.0001, max_retries=50, **kwargs)
+
+async def collect(limiter, client, channel, **kwargs):
+    return [message.id async for message in limiter.iter_messages(client, channel, **kwargs)]
+
+def test_iter_messages_resumes_after_flood_waits_without_loss_or_duplicates():
+    client = FakeTelegramClient({'@channel': 500}, page_size=10, flood_probability=0.2, flood_seconds=0)
+    limiter = flood_limiter()
+    ids = asyncio.run(collect(limiter, client, '@channel', page_size=10))
+    assert ids == list(range(500, 0, -1))
+    assert client.floods > 0
+    assert limiter.floods == client.floods
+
+def test_iter_messages_resumes_with_limit_and_reverse():
+    client = FakeTelegramClient({'@channel': 300}, page_size=10, flood_probability=0.2, flood_seconds=0)
+    ids = asyncio.run(collect(flood_limiter(), client, '@channel', page_size=10, limit=123, reverse=True, offset_id=50))
+    assert ids == list(range(51, 174))
+    assert client.floods > 0
+
+def test_call_retries_flood_waits():
+    client = FakeTelegramClient({'@channel': 10}, flood_probability=0.5, flood_seconds=0)
+    limiter = flood_limiter()
+
+    async def resolve():
+        return await asyncio.gather(*[limiter.call(lambda: client.get_entity('@channel')) for _ in range(20)])
+
+    entities = asyncio.run(resolve())
+    assert all(entity.username == 'channel' for entity in entities)
+    assert limiter.floods == client.floods > 0
+
+def test_long_flood_waits_are_raised():
+    client = FakeTelegramClient({'@channel': 10}, flood_probability=1.0, flood_seconds=7200)
+    with pytest.raises(FloodWaitError):
+        asyncio.run(collect(flood_limiter(max_flood_wait=3600), client, '@channel'))
+
+def test_flood_waits_slow_the_rate_down():
+    limiter = AdaptiveRateLimiter(rate=10, min_rate=1, backoff=0)
+    limiter.on_flood(60)
+    assert limiter.rate == 5
+    limiter.on_flood(60)  # Same flood (the pause is not over): the rate is only cut once
+    assert limiter.rate == 5
+
+def test_scrape_channels_with_flood_waits_keeps_every_post_once():
+    channels = {'@channel_a': 120, '@channel_b': 80}
+    client = FakeTelegramClient(channels, comments_per_post=1, page_size=20, flood_probability=0.1, flood_seconds=0)
+    date_min = client.date_max - 200 * client.post_interval
+    data = asyncio.run(scrape_channels(client, list(channels), date_min, client.date_max, concurrency=2,
+                                       rate_limiter=flood_limiter(), progress_interval=None))
+    keys = [(row['Group'], row['Message ID']) for row in data]
+    assert client.floods > 0
+    assert len(keys) == len(set(keys))
+    assert set(keys) == {(channel, message_id) for channel, count in channels.items() for message_id in range(1, count + 1)}
@@ -0,0 +1,58 @@
+import asyncio
+import glob
+import json
+import os
+import pyarrow.parquet as pq
+from fake_telegram_client import FakeTelegramClient
+from parquet_stream_writer import StreamingParquetWriter
+from rate_limiter import AdaptiveRateLimiter
+from scrape_checkpoints import ScrapeCheckpoints
+from telegram_scraper import message_schema, scrape_channels
+
+CHANNELS = {'@channel_a': 120, '@channel_b': 80, '@channel_c': 50}
+
+def fast_limiter():
+    return AdaptiveRateLimiter(rate=10000, burst=10000, max_rate=10000)
+
+def fake_client(**kwargs):
+    return FakeTelegramClient(CHANNELS, comments_per_post=2, latency=0.001, page_size=20, **kwargs)
+
+def scrape(client, **kwargs):
+    date_min = client.date_max - 200 * client.post_interval
+    kwargs.setdefault('rate_limiter', fast_limiter())
+    return asyncio.run(scrape_channels(client, list(CHANNELS), date_min, client.date_max, progress_interval=None, **kwargs))
+
+def all_posts():
+    return {(channel, message_id) for channel, count in CHANNELS.items() for message_id in range(1, count + 1)}
+
+def test_concurrent_scrape_returns_every_post_once():
+    data = scrape(fake_client(), concurrency=3, max_comment_requests=5)
+    keys = [(row['Group'], row['Message ID']) for row in data]
+    assert len(keys) == len(set(keys))
+    assert set(keys) == all_posts()
+    for row in data:
+        comments = json.loads(row['Comments List'])
+        assert sorted(comment['Comment Content'] for comment in comments) == [f"Comment {index} on post {row['Message ID']}" for index in range(2)]
+
+def test_concurrency_does_not_change_the_rows():
+    sequential = scrape(fake_client(), concurrency=1, max_comment_requests=1)
+    concurrent = scrape(fake_client(), concurrency=3, max_comment_requests=10)
+    key = lambda row: (row['Group'], row['Message ID'])
+    assert sorted(sequential, key=key) == sorted(concurrent, key=key)
+
+def test_resume_from_checkpoints_without_loss_or_duplicates(tmp_path):
+    checkpoints = ScrapeCheckpoints(str(tmp_path / 'checkpoints.json'))
+    schema = message_schema('json')
+    for run, max_t_index in enumerate([100, 1000000]):
+        writer = StreamingParquetWriter(str(tmp_path), f'run_{run}', schema=schema)
+        scrape(fake_client(), concurrency=3, max_t_index=max_t_index, checkpoints=checkpoints, writer=writer)
+        writer.close()
+        if run == 0:
+            first_run = sum(pq.read_metadata(path).num_rows for path in glob.glob(os.path.join(str(tmp_path), 'run_0*.parquet')))
+            assert first_run < len(all_posts())
+
+    rows = [row for path in sorted(glob.glob(os.path.join(str(tmp_path), 'run_*.parquet')))
+            for row in pq.read_table(path, columns=['Group', 'Message ID']).to_pylist()]
+    keys = [(row['Group'], row['Message ID']) for row in rows]
+    assert len(keys) == len(set(keys))
+    assert set(keys) == all_posts()
@@ -0,0 +1,108 @@
+import asyncio
+import glob
+import os
+from datetime import datetime, timedelta, timezone
+import pyarrow.parquet as pq
+import telegram_scraper
+from fake_telegram_client import FakeTelegramClient
+from parquet_stream_writer import StreamingParquetWriter
+from rate_limiter import AdaptiveRateLimiter
+from scrape_checkpoints import ScrapeCheckpoints
+from telegram_scraper import message_schema, plan_passes, scrape_channels
+
+DATE_MAX = datetime(2025, 1, 15, tzinfo=timezone.utc)
+DATE_MIN = DATE_MAX - timedelta(days=30)
+
+def scrape(channels, checkpoints, writer=None, **kwargs):
+    client = FakeTelegramClient(channels, comments_per_post=1, latency=0.001, page_size=20, date_max=DATE_MAX)
+    limiter = AdaptiveRateLimiter(rate=10000, burst=10000, max_rate=10000)
+    return asyncio.run(scrape_channels(client, list(channels), DATE_MIN, DATE_MAX, checkpoints=checkpoints, writer=writer,
+                                       rate_limiter=limiter, progress_interval=None, **kwargs))
+
+def scrape_to_parts(folder, run, channels, checkpoints, **kwargs):
+    writer = StreamingParquetWriter(folder, f'run_{run}', schema=message_schema('json'))
+    outcomes = {}
+    scrape(channels, checkpoints, writer, outcomes=outcomes, **kwargs)
+    writer.close()
+    return outcomes
+
+def part_keys(folder, run='*'):
+    return [(row['Group'], row['Message ID']) for path in sorted(glob.glob(os.path.join(folder, f'run_{run}_*.parquet')))
+            for row in pq.read_table(path, columns=['Group', 'Message ID']).to_pylist()]
+
+def all_posts(channels):
+    return {(channel, message_id) for channel, count in channels.items() for message_id in range(1, count + 1)}
+
+def test_plan_passes():
+    checkpoints = ScrapeCheckpoints('unused.json')
+    session = {'checkpoints': checkpoints, 'key_search': '', 'date_min': DATE_MIN, 'date_max': DATE_MAX}
+    assert plan_passes('@channel', session) == [{'offset_date': DATE_MAX + timedelta(seconds=1)}]
+
+    checkpoints.record('@channel', '', 40)
+    checkpoints.record('@channel', '', 10)
+    assert plan_passes('@channel', session) == [{'min_id': 40, 'reverse': True}, {'offset_id': 10}]
+
+    checkpoints.mark_backfilled('@channel', '', DATE_MIN)
+    assert plan_passes('@channel', session) == [{'min_id': 40, 'reverse': True}]
+    session['date_min'] = DATE_MIN - timedelta(days=1)  # A wider window needs the older messages again
+    assert plan_passes('@channel', session) == [{'min_id': 40, 'reverse': True}, {'offset_id': 10}]
+
+def test_checkpoints_are_not_committed_when_nothing_is_saved(tmp_path):
+    checkpoints = ScrapeCheckpoints(str(tmp_path / 'checkpoints.json'))
+    data = scrape({'@channel_a': 50, '@channel_b': 50}, checkpoints)
+    assert len(data) == 100
+    assert not os.path.exists(tmp_path / 'checkpoints.json')
+    # Recorded in memory: the caller commits them once it saved the rows
+    assert checkpoints.get('@channel_a') == {'max_id': 50, 'min_id': 1, 'backfilled_until': DATE_MIN.isoformat()}
+
+def test_interrupted_run_is_resumed_with_every_post_once(tmp_path):
+    folder = str(tmp_path)
+    checkpoints = ScrapeCheckpoints(str(tmp_path / 'checkpoints.json'))
+    channels = {'@channel_a': 120, '@channel_b': 80}
+    outcomes = scrape_to_parts(folder, 0, channels, checkpoints, max_t_index=90, comment_window=10)
+    assert 'interrupted' in outcomes.values()
+    assert len(part_keys(folder, 0)) < len(all_posts(channels))
+
+    # New posts were published in the meantime: the resumed run reads them (min_id pass) and the backfill (offset_id pass)
+    channels = {'@channel_a': 150, '@channel_b': 95}
+    outcomes = scrape_to_parts(folder, 1, channels, ScrapeCheckpoints(str(tmp_path / 'checkpoints.json')))
+    assert set(outcomes.values()) == {'complete'}
+    keys = part_keys(folder)
+    assert len(keys) == len(set(keys))
+    assert set(keys) == all_posts(channels)
+
+    # Nothing is left to read
+    scrape_to_parts(folder, 2, channels, ScrapeCheckpoints(str(tmp_path / 'checkpoints.json')))
+    assert part_keys(folder, 2) == []
+
+def test_date_slices_are_recorded_once_complete(tmp_path):
+    checkpoints = ScrapeCheckpoints(str(tmp_path / 'checkpoints.json'))
+    outcomes = scrape_to_parts(str(tmp_path), 0, {'@channel': 60}, checkpoints, date_slices=3)
+    assert outcomes == {'@channel': 'complete'}
+    assert checkpoints.get('@channel') == {'max_id': 60, 'min_id': 1, 'backfilled_until': DATE_MIN.isoformat()}
+    assert sorted(part_keys(str(tmp_path), 0)) == sorted(all_posts({'@channel': 60}))
+
+def test_post_that_failed_once_is_scraped_again(tmp_path, monkeypatch):
+    folder = str(tmp_path)
+    channels = {'@channel': 50}
+    build_message_row = telegram_scraper.build_message_row
+    failures = []
+
+    def failing_build_message_row(channel, message, *args):
+        if message.id == 25 and not failures:
+            failures.append(message.id)
+            raise ValueError('transient error')
+        return build_message_row(channel, message, *args)
+
+    monkeypatch.setattr(telegram_scraper, 'build_message_row', failing_build_message_row)
+    outcomes = scrape_to_parts(folder, 0, channels, ScrapeCheckpoints(str(tmp_path / 'checkpoints.json')), comment_window=10)
+    assert failures == [25]
+    assert outcomes['@channel'] != 'complete'
+    assert ('@channel', 25) not in part_keys(folder, 0)
+    state = ScrapeCheckpoints(str(tmp_path / 'checkpoints.json')).get('@channel')
+    assert state['min_id'] > 25 and state['backfilled_until'] is None
+
+    outcomes = scrape_to_parts(folder, 1, channels, ScrapeCheckpoints(str(tmp_path / 'checkpoints.json')))
+    assert outcomes == {'@channel': 'complete'}
+    assert ('@channel', 25) in part_keys(folder, 1)
+    assert set(part_keys(folder)) == all_posts(channels)
@@ -0,0 +1,114 @@
+import asyncio
+import glob
+import os
+import time
+from datetime import timedelta
+import pyarrow as pa
+import pyarrow.parquet as pq
+from fake_telegram_client import FakeTelegramClient
+from rate_limiter import AdaptiveRateLimiter
+from scrape_work_queue import ScrapeWorkQueue, scrape_worker, unit_file_name
+from telegram_scraper import message_schema
+
+CHANNELS = {'@channel_a': 120, '@channel_b': 80}
+
+def fake_client():
+    return FakeTelegramClient(CHANNELS, comments_per_post=1, latency=0.001, page_size=20)
+
+def add_units(queue_path, slices=2):
+    client = fake_client()
+    with ScrapeWorkQueue(queue_path) as queue:
+        return queue.add_units(list(CHANNELS), client.date_max - 200 * client.post_interval, client.date_max + timedelta(seconds=1), slices=slices)
+
+def run_worker(queue_path, output_folder, worker_id, **kwargs):
+    limiter = AdaptiveRateLimiter(rate=10000, burst=10000, max_rate=10000)
+    return asyncio.run(scrape_worker(fake_client(), queue_path, output_folder, worker_id, rate_limiter=limiter, progress_interval=None, **kwargs))
+
+def scraped_keys(output_folder):
+    rows = [row for path in sorted(glob.glob(os.path.join(output_folder, '*.parquet')))
+            for row in pq.read_table(path, columns=['Group', 'Message ID']).to_pylist()]
+    return [(row['Group'], row['Message ID']) for row in rows]
+
+def all_posts():
+    return {(channel, message_id) for channel, count in CHANNELS.items() for message_id in range(1, count + 1)}
+
+def test_units_are_not_added_twice(tmp_path):
+    queue_path = str(tmp_path / 'queue.sqlite')
+    assert add_units(queue_path) == 4
+    assert add_units(queue_path) == 0
+
+def test_expired_lease_is_requeued_and_the_old_worker_loses_it(tmp_path):
+    with ScrapeWorkQueue(str(tmp_path / 'queue.sqlite')) as queue:
+        queue.add_units(['@channel_a'], fake_client().date_max - timedelta(days=1), fake_client().date_max)
+        unit = queue.lease('worker-1', lease_seconds=0.05)
+        assert queue.lease('worker-2') is None  # Still leased
+        time.sleep(0.1)
+        again = queue.lease('worker-2')
+        assert again['id'] == unit['id'] and again['attempts'] == 2
+        assert not queue.renew(unit['id'], 'worker-1')
+        assert not queue.complete(unit['id'], 'worker-1', 10)
+        assert queue.complete(unit['id'], 'worker-2', 10)
+        assert queue.counts() == {'done': 1}
+
+def test_units_fail_after_max_attempts(tmp_path):
+    with ScrapeWorkQueue(str(tmp_path / 'queue.sqlite'), max_attempts=2) as queue:
+        queue.add_units(['@channel_a'], fake_client().date_max - timedelta(days=1), fake_client().date_max)
+        for attempt in range(2):
+            unit = queue.lease('worker-1')
+            assert queue.fail(unit['id'], 'worker-1', 'ValueError: boom')
+        assert queue.counts() == {'failed': 1}
+        assert queue.lease('worker-1') is None
+
+def test_workers_scrape_every_post_once(tmp_path):
+    queue_path, output_folder = str(tmp_path / 'queue.sqlite'), str(tmp_path / 'parts')
+    os.makedirs(output_folder)
+    add_units(queue_path)
+    assert run_worker(queue_path, output_folder, 'worker-1', max_units=1) == 1
+    assert run_worker(queue_path, output_folder, 'worker-2') == 3
+    with ScrapeWorkQueue(queue_path) as queue:
+        assert queue.counts() == {'done': 4}
+    keys = scraped_keys(output_folder)
+    assert len(keys) == len(set(keys))
+    assert set(keys) == all_posts()
+
+def test_parts_of_a_crashed_attempt_are_removed(tmp_path):
+    queue_path, output_folder = str(tmp_path / 'queue.sqlite'), str(tmp_path / 'parts')
+    os.makedirs(output_folder)
+    add_units(queue_path, slices=1)
+
+    # A worker leases a unit, writes a part and dies: its lease expires
+    with ScrapeWorkQueue(queue_path) as queue:
+        crashed = queue.lease('crashed-worker', lease_seconds=0.05)
+    crashed_part = os.path.join(output_folder, f'{unit_file_name(crashed)}_part_0001.parquet')
+    pq.write_table(pa.Table.from_pylist([{'Group': crashed['channel'], 'Message ID': 1}], schema=message_schema('json')), crashed_part)
+    time.sleep(0.1)
+
+    assert run_worker(queue_path, output_folder, 'worker-1') == 2
+    assert not os.path.exists(crashed_part)
+    keys = scraped_keys(output_folder)
+    assert len(keys) == len(set(keys))
+    assert set(keys) == all_posts()
+
+def test_scrape_stops_when_the_lease_is_lost(tmp_path, monkeypatch):
+    queue_path, output_folder = str(tmp_path / 'queue.sqlite'), str(tmp_path / 'parts')
+    os.makedirs(output_folder)
+    with ScrapeWorkQueue(queue_path) as queue:
+        queue.add_units(['@channel_a'], fake_client().date_max - 200 * fake_client().post_interval, fake_client().date_max)
+
+    # Another worker takes the unit before the first renewal, as if the lease had expired
+    renew = ScrapeWorkQueue.renew
+    def renew_after_steal(self, unit_id, worker, lease_seconds=600):
+        self.connection.execute("UPDATE units SET worker = 'worker-2' WHERE id = ?", (unit_id,))
+        return renew(self, unit_id, worker, lease_seconds)
+    monkeypatch.setattr(ScrapeWorkQueue, 'renew', renew_after_steal)
+
+    slow_client = FakeTelegramClient(CHANNELS, comments_per_post=1, latency=0.05, page_size=20)
+    limiter = AdaptiveRateLimiter(rate=10000, burst=10000, max_rate=10000)
+    start_time = time.time()
+    completed = asyncio.run(scrape_worker(slow_client, queue_path, output_folder, 'worker-1', lease_seconds=0.3,
+                                          max_units=1, rate_limiter=limiter, progress_interval=None))
+    assert completed == 0
+    assert time.time() - start_time < 2  # The scrape of the 120 posts (several seconds) was cancelled
+    assert scraped_keys(output_folder) == []
+    with ScrapeWorkQueue(queue_path) as queue:
+        assert queue.counts() == {'leased': 1}  # Left to worker-2, not failed or released
@@ -0,0 +1,262 @@
+import os
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from tqdm import tqdm
+from comments_schema import COMMENT_STRUCT, comments_to_nested, is_nested
+from partitioned_dataset import DATE_TYPE, to_timestamp
+
+# Typed storage for the columns the scraper historically wrote as text.
+#
+#   'Date'        '2025-01-15 10:00:00'  ->  timestamp[us, UTC]
+#   'Media'       'True' / 'False'       ->  bool
+#   'Reactions'   '👍 3 ❤ 2 '            ->  list<struct<Emoji: string, Count: int32>>, e.g. [{'Emoji': '👍', 'Count': 3}, ...]
+#   'Group'       string                 ->  dictionary<int32, string> (each channel name is stored once per batch)
+#
+# The same applies to 'Comment Date', 'Comment Media' and 'Comment Reactions' inside a nested 'Comments List'
+# (JSON comments keep their text fields: JSON has no timestamps).
+#
+# 'Reactions' is a list of (Emoji, Count) structs, which is the physical layout of an Arrow map<string, int32>,
+# because maps do not survive the pandas round trips of the combine and export scripts and lists of structs do.
+# Totals are columnar: sum_reaction_counts never parses a string.
+#
+# New sessions write these types with scrape_channels(..., typed_columns=True); migrate_to_typed_columns converts
+# files written before.
+
+REACTION_STRUCT = pa.struct([('Emoji', pa.string()), ('Count', pa.int32())])
+REACTIONS_TYPE = pa.list_(REACTION_STRUCT)
+GROUP_TYPE = pa.dictionary(pa.int32(), pa.string())
+
+TYPED_COMMENT_FIELDS = {'Comment Date': DATE_TYPE, 'Comment Reactions': REACTIONS_TYPE, 'Comment Media': pa.bool_()}
+TYPED_COMMENT_STRUCT = pa.struct([pa.field(field.name, TYPED_COMMENT_FIELDS.get(field.name, field.type)) for field in COMMENT_STRUCT])
+
+TYPED_COMMENTS_LIST_TYPE = pa.list_(TYPED_COMMENT_STRUCT)
+
+def reaction_counts(reactions):
+
+    # Return the reactions of a Telethon message as a 'Reactions' value of the typed schema.
+
+    # Parameters:
+    # reactions (MessageReactions or None): The reactions attribute of a Telethon message.
+
+    # Returns:
+    # list of dict: [{'Emoji': '👍', 'Count': 3}, ...] (empty if there are no reactions).
+
+    if not reactions:
+        return []
+    return [{'Emoji': reaction_count.reaction.emoticon, 'Count': reaction_count.count} for reaction_count in reactions.results]
+
+def reactions_text(value):
+
+    # Format a typed 'Reactions' value back as the scraper's text ('👍 3 ❤ 2 '), e.g. for spreadsheets.
+
+    if value is None:
+        return ''
+    return ''.join(f"{reaction['Emoji']} {reaction['Count']} " for reaction in value)
+
+def is_reactions_type(data_type):
+
+    # Returns True for REACTIONS_TYPE, and for the lists of {'Emoji', 'Count'} structs Arrow infers from the
+    # pandas values of a typed 'Reactions' column (with int64 counts).
+
+    return (pa.types.is_list(data_type) and pa.types.is_struct(data_type.value_type)
+            and [field.name for field in data_type.value_type] == [field.name for field in REACTION_STRUCT])
+
+def parse_reactions(column):
+
+    # Convert a 'Reactions' column of text ('👍 3 ❤ 2 ') to REACTIONS_TYPE, without a Python loop over the rows.
+
+    # Parameters:
+    # column (pyarrow.Array or ChunkedArray): Reaction strings, or values already of REACTIONS_TYPE.
+
+    # Returns:
+    # pyarrow.Array: The reactions as REACTIONS_TYPE (missing values stay missing).
+
+    if isinstance(column, pa.ChunkedArray):
+        column = column.combine_chunks()
+    if column.type == REACTIONS_TYPE:
+        return column
+    if pa.types.is_list(column.type):
+        return column.cast(REACTIONS_TYPE)
+
+    tokens = pc.utf8_split_whitespace(pc.cast(column, pa.string()))
+    words = pc.list_flatten(tokens)
+    nonempty = pc.not_equal(words, '')
+    words = words.filter(nonempty)
+    lengths = np.bincount(pc.list_parent_indices(tokens).filter(nonempty).to_numpy(), minlength=len(tokens))
+    if (lengths % 2).any():
+        raise ValueError("'Reactions' values must alternate emojis and counts, e.g. '👍 3 ❤ 2 '")
+    pairs = np.arange(0, len(words), 2)
+    structs = pa.StructArray.from_arrays([words.take(pairs), pc.cast(words.take(pairs + 1), pa.int32())], fields=list(REACTION_STRUCT))
+    offsets = pa.array(np.concatenate([[0], np.cumsum(lengths // 2)]), type=pa.int32())
+    return pa.ListArray.from_arrays(offsets, structs, type=REACTIONS_TYPE, mask=tokens.is_null())
+
+def sum_reaction_counts(column):
+
+    # Total number of reactions of each row of a typed 'Reactions' column.
+
+    # Parameters:
+    # column (pyarrow.Array or ChunkedArray): A REACTIONS_TYPE column.
+
+    # Returns:
+    # numpy.ndarray: The totals (0 for missing values).
+
+    if isinstance(column, pa.ChunkedArray):
+        column = column.combine_chunks()
+    counts = pc.struct_field(pc.list_flatten(column), 'Count').to_numpy(zero_copy_only=False)
+    parents = pc.list_parent_indices(column).to_numpy()
+    return np.bincount(parents, weights=counts, minlength=len(column)).astype(np.int64)
+
+def to_bool(column):
+
+    # Convert a 'Media' column to bool: the strings 'True' / 'False' (any case) or values already boolean.
+
+    # Unlike astype(bool) in pandas, which makes the string 'False' True, only 'True' becomes True.
+
+    if isinstance(column, pa.ChunkedArray):
+        column = column.combine_chunks()
+    if pa.types.is_boolean(column.type):
+        return column
+    if pa.types.is_string(column.type) or pa.types.is_large_string(column.type):
+        return pc.equal(pc.utf8_lower(column), 'true')
+    return pc.cast(column, pa.bool_())
+
+def media_to_bool(series):
+
+    # pandas version of to_bool, for the DataFrames of the combine scripts.
+
+    def media_value(value):
+        if isinstance(value, str):
+            return value.lower() == 'true'
+        return bool(value) if pd.notna(value) else False
+
+    if series.dtype == bool:
+        return series
+    return series.map(media_value).astype(bool)
+
+def to_typed_comments(column):
+
+    # Convert a nested 'Comments List' column to TYPED_COMMENTS_LIST_TYPE (JSON strings are decoded first).
+
+    if isinstance(column, pa.ChunkedArray):
+        column = column.combine_chunks()
+    if column.type == TYPED_COMMENTS_LIST_TYPE:
+        return column
+    if not is_nested(column):
+        column = comments_to_nested(column.to_pylist())
+    flat = pc.list_flatten(column)
+    fields = {field.name: flat.field(field.name) for field in flat.type}
+    fields['Comment Date'] = to_timestamp(fields['Comment Date'])
+    fields['Comment Media'] = to_bool(fields['Comment Media'])
+    fields['Comment Reactions'] = parse_reactions(fields['Comment Reactions'])
+    structs = pa.StructArray.from_arrays([fields[field.name].cast(field.type) for field in TYPED_COMMENT_STRUCT],
+                                         fields=list(TYPED_COMMENT_STRUCT), mask=flat.is_null())
+    lengths = pc.fill_null(pc.list_value_length(column), 0).to_numpy(zero_copy_only=False)
+    offsets = pa.array(np.concatenate([[0], np.cumsum(lengths)]), type=pa.int32())
+    return pa.ListArray.from_arrays(offsets, structs, type=TYPED_COMMENTS_LIST_TYPE, mask=column.is_null())
+
+def has_typed_columns(schema):
+
+    # Returns True if a schema stores 'Reactions' as typed reactions (the files of a typed_columns=True session or
+    # of migrate_to_typed_columns).
+
+    return 'Reactions' in schema.names and pa.types.is_list(schema.field('Reactions').type)
+
+def to_typed_table(table, comments_format=None):
+
+    # Return a table in the scraper's schema with 'Date', 'Media', 'Reactions' and 'Group' converted to their typed storage.
+
+    # Parameters:
+    # table (pyarrow.Table): A table written by the scraper (text or typed columns; missing columns are skipped).
+    # comments_format (str): None to keep 'Comments List' as stored, or 'nested' to store it as typed comments
+    #                        (a nested 'Comments List' is always converted to typed comments).
+
+    # Returns:
+    # pyarrow.Table: The converted table (without the pandas metadata, which describes the old columns).
+
+    converters = {
+        'Date': lambda column: to_timestamp(column.combine_chunks()),
+        'Media': to_bool,
+        'Reactions': parse_reactions,
+        'Group': lambda column: pc.dictionary_encode(pc.cast(column, pa.string())).combine_chunks(),
+    }
+    for name, convert in converters.items():
+        if name in table.column_names:
+            converted = convert(table.column(name))
+            table = table.set_column(table.column_names.index(name), pa.field(name, converted.type), converted)
+    if 'Comments List' in table.column_names and (comments_format == 'nested' or is_nested(table.column('Comments List'))):
+        comments = to_typed_comments(table.column('Comments List'))
+        table = table.set_column(table.column_names.index('Comments List'), pa.field('Comments List', comments.type), comments)
+    return table.replace_schema_metadata(None)
+
+def migrate_parquet_file(input_file_path, output_file_path, comments_format=None, batch_size=100000):
+
+    # Convert one Parquet file to the typed columns, a batch at a time.
+
+    # Parameters:
+    # input_file_path (str): Path of the Parquet file to convert.
+    # output_file_path (str): Path of the converted Parquet file (must be different from the input).
+    # comments_format (str): None to keep 'Comments List' as stored, 'nested' to convert JSON comments to typed comments.
+    # batch_size (int): Number of rows converted at a time.
+
+    # Returns:
+    # int: The number of rows converted.
+
+    parquet_file = pq.ParquetFile(input_file_path)
+    writer = None
+    total_rows = 0
+    try:
+        for batch in parquet_file.iter_batches(batch_size=batch_size):
+            table = to_typed_table(pa.Table.from_batches([batch]), comments_format)
+            if writer is None:
+                writer = pq.ParquetWriter(output_file_path, table.schema)
+            writer.write_table(table.cast(writer.schema))
+            total_rows += table.num_rows
+        if writer is None:
+            pq.write_table(to_typed_table(parquet_file.schema_arrow.empty_table(), comments_format), output_file_path)
+    finally:
+        if writer is not None:
+            writer.close()
+    return total_rows
+
+def migrate_to_typed_columns(input_path, output_path, comments_format=None, batch_size=100000):
+
+    # One-time migration of scraped Parquet files to the typed columns.
+
+    # Parameters:
+    # input_path (str): A Parquet file, or a folder of Parquet files (e.g. the scraped parts, or the unified file's folder).
+    # output_path (str): The converted file, or the folder where the converted files are written with the same names.
+    # comments_format (str): None to keep 'Comments List' as stored, 'nested' to convert JSON comments to typed comments.
+    # batch_size (int): Number of rows converted at a time (memory stays bounded whatever the file size).
+
+    # Returns:
+    # int: The number of rows converted.
+
+    # Example:
+    # migrate_to_typed_columns('unified_data_telegram.parquet', 'unified_data_telegram_typed.parquet')
+    # migrate_to_typed_columns('scraped_parts', 'scraped_parts_typed', comments_format='nested')
+
+    if os.path.abspath(input_path) == os.path.abspath(output_path):
+        raise ValueError('The output path must be different from the input path')
+    if not os.path.isdir(input_path):
+        total_rows = migrate_parquet_file(input_path, output_path, comments_format, batch_size)
+        input_size, output_size = os.path.getsize(input_path), os.path.getsize(output_path)
+    else:
+        os.makedirs(output_path, exist_ok=True)
+        total_rows = input_size = output_size = 0
+        for file in tqdm(sorted(file for file in os.listdir(input_path) if file.endswith('.parquet')), desc="Migrating files"):
+            total_rows += migrate_parquet_file(os.path.join(input_path, file), os.path.join(output_path, file), comments_format, batch_size)
+            input_size += os.path.getsize(os.path.join(input_path, file))
+            output_size += os.path.getsize(os.path.join(output_path, file))
+    print(f"{total_rows} rows migrated to typed columns: {input_size / 1024 ** 2:.1f} MB -> {output_size / 1024 ** 2:.1f} MB")
+    return total_rows
+
+
+# Usage
+if __name__ == '__main__':
+    input_path = 'unified_data_telegram.parquet' # Example
+    output_path = 'unified_data_telegram_typed.parquet' # Example
+
+    migrate_to_typed_columns(input_path, output_path)